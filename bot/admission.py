@@ -0,0 +1,173 @@
+import os
+import math
+import asyncio
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+from .scheduler import job_cost, SCHEDULER_MAX_RUNNING
+from .ratelimit import LLM_REQUESTS_PER_MINUTE
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# Pending or processing generations one user may have; further submissions get 429 (0 disables)
+ADMISSION_MAX_ACTIVE_PER_USER = int(os.getenv("ADMISSION_MAX_ACTIVE_PER_USER", "5"))
+# Generations waiting for a job slot across all users; further submissions get 503 (0 disables)
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "20"))
+# Estimated seconds to work through all pending and running generations; above it submissions get 503 (0 disables)
+ADMISSION_MAX_BACKLOG_SECONDS = float(os.getenv("ADMISSION_MAX_BACKLOG_SECONDS", "1800"))
+# Seconds per LLM call assumed until generations have recorded their own
+ADMISSION_DEFAULT_SECONDS_PER_CALL = float(os.getenv("ADMISSION_DEFAULT_SECONDS_PER_CALL", "2"))
+# Generations running at once, used to turn the backlog into a drain time; workers count too
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", str(SCHEDULER_MAX_RUNNING)))
+# Upper bound for the Retry-After header
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "900"))
+
+
+class AdmissionDecision:
+    """Outcome of an admission check; status_code and retry_after are set when rejected."""
+
+    def __init__(self, admitted: bool, reason: str, detail: str = "", status_code: int = 200,
+                 retry_after: Optional[int] = None, backlog_seconds: float = 0.0):
+        self.admitted = admitted
+        self.reason = reason
+        self.detail = detail
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.backlog_seconds = backlog_seconds
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+
+
+class AdmissionController:
+    """
+    Decides whether a new generation is accepted, from the current backlog.
+
+    The backlog is every pending generation (estimated at job_cost LLM calls) plus the
+    remaining planned calls of processing ones. It drains at the lower of concurrency /
+    seconds_per_call, with seconds_per_call taken from recently recorded generations, and
+    the LLM requests-per-minute quota. Checks, in order:
+
+    - per user: at most max_active_per_user pending or processing generations (429, retry
+      once the user's closest-to-done generation should finish);
+    - queue depth: at most max_queued pending generations overall (503, retry once enough
+      queued jobs should have started);
+    - backlog: the drain time including the new job stays under max_backlog_seconds (503,
+      retry once the excess should have drained).
+
+    Callers hold `lock` from check() until the generation row exists, so concurrent
+    submissions to one process cannot all slip in under the same count.
+    """
+
+    def __init__(
+        self,
+        max_active_per_user: int = ADMISSION_MAX_ACTIVE_PER_USER,
+        max_queued: int = ADMISSION_MAX_QUEUED,
+        max_backlog_seconds: float = ADMISSION_MAX_BACKLOG_SECONDS,
+        concurrency: int = ADMISSION_CONCURRENCY,
+        default_seconds_per_call: float = ADMISSION_DEFAULT_SECONDS_PER_CALL,
+        max_retry_after: int = ADMISSION_MAX_RETRY_AFTER
+    ):
+        self.max_active_per_user = max_active_per_user
+        self.max_queued = max_queued
+        self.max_backlog_seconds = max_backlog_seconds
+        self.concurrency = max(1, concurrency)
+        self.default_seconds_per_call = default_seconds_per_call
+        self.max_retry_after = max_retry_after
+        self.counts: Counter = Counter()
+        self.last_backlog_seconds = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        # Created on first use so it binds to the server's event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _retry_after(self, seconds: float) -> int:
+        return int(min(self.max_retry_after, max(1, math.ceil(seconds))))
+
+    def _reject(self, reason: str, status_code: int, detail: str, retry_seconds: float, backlog_seconds: float) -> AdmissionDecision:
+        self.counts[f"rejected_{reason}"] += 1
+        decision = AdmissionDecision(False, reason, detail, status_code, self._retry_after(retry_seconds), backlog_seconds)
+        logger.warning(f"Admission rejected ({reason}): {detail}, Retry-After {decision.retry_after}s")
+        return decision
+
+    def check(self, user_id: Any, questions_per_client: int, backlog: Dict[str, Any]) -> AdmissionDecision:
+        """Decide on a new generation; backlog is database.get_generation_backlog()."""
+        active: List[Dict[str, Any]] = backlog["active"]
+        seconds_per_call = backlog.get("seconds_per_call") or self.default_seconds_per_call
+        # Calls per second the backlog drains at: job slots in parallel, capped by the LLM quota
+        drain_rate = self.concurrency / seconds_per_call
+        if LLM_REQUESTS_PER_MINUTE > 0:
+            drain_rate = min(drain_rate, LLM_REQUESTS_PER_MINUTE / 60.0)
+
+        def remaining_calls(generation):
+            if generation['status'] == "processing" and generation.get('planned_calls'):
+                return max(0, generation['planned_calls'] - (generation.get('completed_calls') or 0))
+            return job_cost("generation", {"questions_per_client": generation['questions_per_client']})
+
+        new_cost = job_cost("generation", {"questions_per_client": questions_per_client})
+        backlog_calls = sum(remaining_calls(g) for g in active)
+        backlog_seconds = (backlog_calls + new_cost) / drain_rate
+        self.last_backlog_seconds = backlog_seconds
+
+        if self.max_active_per_user > 0:
+            mine = [g for g in active if g['user_id'] == user_id]
+            if len(mine) >= self.max_active_per_user:
+                # A slot frees up when the user's nearest-to-done generation finishes; it runs
+                # at one job slot's share of the drain rate
+                nearest = min(remaining_calls(g) for g in mine)
+                return self._reject(
+                    "user_limit", 429,
+                    f"{len(mine)} generations already pending or processing (limit {self.max_active_per_user})",
+                    nearest * self.concurrency / drain_rate, backlog_seconds
+                )
+
+        if self.max_queued > 0:
+            queued = [g for g in active if g['status'] == "pending"]
+            if len(queued) >= self.max_queued:
+                # Queued jobs start as running ones finish; wait for the excess to start
+                excess = len(queued) - self.max_queued + 1
+                average_cost = sum(remaining_calls(g) for g in queued) / len(queued)
+                return self._reject(
+                    "queue_depth", 503,
+                    f"{len(queued)} generations queued (limit {self.max_queued})",
+                    excess * average_cost / drain_rate, backlog_seconds
+                )
+
+        if self.max_backlog_seconds > 0 and backlog_seconds > self.max_backlog_seconds:
+            return self._reject(
+                "backlog", 503,
+                f"estimated backlog {backlog_seconds:.0f}s exceeds {self.max_backlog_seconds:.0f}s",
+                backlog_seconds - self.max_backlog_seconds, backlog_seconds
+            )
+
+        self.counts["admitted"] += 1
+        return AdmissionDecision(True, "admitted", backlog_seconds=backlog_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        rejected = {key[len("rejected_"):]: count for key, count in self.counts.items() if key.startswith("rejected_")}
+        return {
+            "admitted": self.counts["admitted"],
+            "rejected": sum(rejected.values()),
+            "rejected_by_reason": rejected,
+            "last_backlog_seconds": round(self.last_backlog_seconds, 1),
+            "limits": {
+                "max_active_per_user": self.max_active_per_user,
+                "max_queued": self.max_queued,
+                "max_backlog_seconds": self.max_backlog_seconds,
+                "concurrency": self.concurrency,
+            },
+        }
+
+
+admission = AdmissionController()
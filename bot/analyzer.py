@@ -2,22 +2,26 @@ import os
 import argparse
 import json
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional
 import re
 import glob
 from datetime import datetime
 
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 from pydantic import BaseModel, Field
 
 from .utils import setup_logger
+from .cancellation import CancelToken, GenerationCancelled, raise_if_cancelled
+from .llm import get_client, generate_text, get_backend, set_backend, LLM_BACKEND
 
 load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
 
 logger = setup_logger(__name__)
 
+# Models rating each client type and writing the overall report
+CLIENT_TYPE_ANALYSIS_MODEL = "gemini-2.0-flash"
+SUMMARY_ANALYSIS_MODEL = "gemini-2.5-pro-exp-03-25"
+
 class ClientTypeAnalysis(BaseModel):
     client_type: str = Field(description="The client type being analyzed")
     description_quality: int = Field(description="Rating of description quality (1-10)")
@@ -43,8 +47,8 @@ def init_llm():
         if not api_key:
             raise ValueError("GOOGLE_API_KEY environment variable not set")
         
-        client = genai.Client(api_key=api_key)
-        logger.info("Successfully initialized Google Gemini client for analysis")
+        client = get_client(api_key)
+        logger.info("Using shared Google Gemini client for analysis")
         return client
     except Exception as e:
         logger.error(f"Failed to initialize LLM: {e}", exc_info=True)
@@ -96,7 +100,7 @@ def read_client_type_data(client_dir: Path) -> Dict[str, Any]:
         logger.error(f"Failed to read client type data from {client_dir}: {e}", exc_info=True)
         return None
 
-def analyze_client_type(client: genai.Client, prompt_data: Dict[str, Any]) -> ClientTypeAnalysis:
+def analyze_client_type(prompt_data: Dict[str, Any]) -> ClientTypeAnalysis:
     logger.info(f"Analyzing client type: {prompt_data['client_type']}")
     
     try:
@@ -157,17 +161,15 @@ Key Points: {', '.join(qa['key_points'])}
         }}
         """
         
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.2,
-                top_p=0.95,
-                max_output_tokens=8192
-            )
-        )
-        
-        result = response.text.strip()
+        result = generate_text(
+            model=CLIENT_TYPE_ANALYSIS_MODEL,
+            prompt=prompt,
+            config={
+                "temperature": 0.2,
+                "top_p": 0.95,
+                "max_output_tokens": 8192
+            }
+        ).strip()
         
         start_idx = result.find('{')
         end_idx = result.rfind('}') + 1
@@ -211,7 +213,6 @@ Key Points: {', '.join(qa['key_points'])}
         )
 
 def create_overall_analysis(
-    client: genai.Client, 
     username: str, 
     client_analyses: List[ClientTypeAnalysis]
 ) -> PromptSetAnalysis:
@@ -260,17 +261,15 @@ Improvement Suggestions: {', '.join(analysis.improvement_suggestions)}
         }}
         """
         
-        response = client.models.generate_content(
-            model="gemini-2.5-pro-exp-03-25",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.2,
-                top_p=0.95,
-                max_output_tokens=16000
-            )
-        )
-        
-        result = response.text.strip()
+        result = generate_text(
+            model=SUMMARY_ANALYSIS_MODEL,
+            prompt=prompt,
+            config={
+                "temperature": 0.2,
+                "top_p": 0.95,
+                "max_output_tokens": 16000
+            }
+        ).strip()
         
         start_idx = result.find('{')
         end_idx = result.rfind('}') + 1
@@ -364,7 +363,13 @@ def save_analysis_report(analysis: PromptSetAnalysis, output_file: Path):
         logger.error(f"Failed to save analysis report: {e}", exc_info=True)
         raise
 
-def analyze_prompts(username: str, prompts_dir: Optional[Path] = None, output_dir: Optional[Path] = None):
+def analyze_prompts(
+    username: str,
+    prompts_dir: Optional[Path] = None,
+    output_dir: Optional[Path] = None,
+    progress: Optional[Callable[..., None]] = None,
+    cancel: Optional[CancelToken] = None
+):
     try:
         logger.info(f"Starting analysis for user: {username}")
         
@@ -393,7 +398,9 @@ def analyze_prompts(username: str, prompts_dir: Optional[Path] = None, output_di
         
         logger.info(f"Found {len(client_type_dirs)} client type directories to analyze")
         
-        client = init_llm()
+        # Fail fast on a missing API key before reading any prompt data
+        if get_backend().name == "gemini":
+            init_llm()
         
         client_analyses = []
         for client_dir in client_type_dirs:
@@ -401,15 +408,21 @@ def analyze_prompts(username: str, prompts_dir: Optional[Path] = None, output_di
             
             if not prompt_data:
                 continue
-                
-            analysis = analyze_client_type(client, prompt_data)
+            
+            raise_if_cancelled(cancel)
+            analysis = analyze_client_type(prompt_data)
             client_analyses.append(analysis)
+            if progress:
+                progress("analysis_call", done=len(client_analyses), total=len(client_type_dirs) + 1)
         
         if not client_analyses:
             logger.error("No client types could be analyzed")
             raise ValueError("No client types could be analyzed")
         
-        overall_analysis = create_overall_analysis(client, username, client_analyses)
+        raise_if_cancelled(cancel)
+        overall_analysis = create_overall_analysis(username, client_analyses)
+        if progress:
+            progress("analysis_call", done=len(client_type_dirs) + 1, total=len(client_type_dirs) + 1)
         
         timestamp = int(datetime.now().timestamp())
         report_file = output_dir / f"{username}_analysis_{timestamp}.md"
@@ -417,6 +430,9 @@ def analyze_prompts(username: str, prompts_dir: Optional[Path] = None, output_di
         
         logger.info(f"Analysis completed for user: {username}. Report saved to {report_file}")
         return report_file
+    except GenerationCancelled:
+        logger.info(f"Analysis cancelled for user: {username}")
+        raise
     except Exception as e:
         logger.error(f"Failed to analyze prompts for user {username}: {e}", exc_info=True)
         raise
@@ -426,8 +442,10 @@ if __name__ == "__main__":
     parser.add_argument("--username", type=str, required=True, help="Username to analyze prompts for.")
     parser.add_argument("--prompts_dir", type=str, help="Directory containing prompt files.")
     parser.add_argument("--output_dir", type=str, help="Directory to save analysis reports.")
+    parser.add_argument("--backend", type=str, default=LLM_BACKEND, choices=["gemini", "fake"], help="LLM backend to use.")
     
     args = parser.parse_args()
+    set_backend(args.backend)
     
     prompts_dir = Path(args.prompts_dir) if args.prompts_dir else None
     output_dir = Path(args.output_dir) if args.output_dir else None
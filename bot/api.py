@@ -1,46 +1,80 @@
 import os
+import json
 import uuid
 import asyncio
 import shutil
+import sqlite3
 from datetime import datetime
 from typing import List, Optional
 import tempfile
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, BackgroundTasks, Request, Header, Response, Query
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordRequestForm, APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
 import psycopg
 from psycopg.errors import Error as PsycopgError
-from pathlib import Path
 
-from .database import (
-    get_db, init_db, get_db_connection,
+from .database import db_pool_stats, close_db_connections
+from .async_database import (
+    init_db,
     # User operations
     create_user, get_user_by_username, get_user_by_email,
     # Document operations
-    create_document, get_document, get_documents_by_user, update_document_processed, 
-    update_document_error, delete_document,
+    create_document, get_document, get_documents_by_user, count_documents_by_user, delete_document,
     # Generation operations
-    create_generation, get_generation, get_generations_by_user, update_generation_status,
-    update_generation_counts, delete_generation,
+    create_generation, get_generation, get_generations_by_user, count_generations_by_user, update_generation_status,
+    delete_generation, cancel_generation, get_generation_backlog,
+    get_idempotency_key, find_reusable_generation, get_user_stats,
     # Client type operations
-    create_client_type, get_client_types_by_generation,
+    get_client_types_by_generation,
+    mark_interrupted_generations,
+    # Job queue operations
+    enqueue_job, get_job_counts, get_job_queue_positions,
     # Analysis operations
-    update_generation_analysis, complete_generation_analysis, update_generation_analysis_error
+    update_generation_analysis
 )
 from .schemas import (
     UserCreate, UserResponse, DocumentResponse, GenerationCreate, 
     GenerationResponse, GenerationDetailResponse, AnalysisCreate, 
-    AnalysisResponse, Token
+    AnalysisResponse, ReusableGenerationResponse, StatsResponse, Token
 )
 from .auth import (
     get_current_active_user, get_password_hash, generate_api_key,
     authenticate_user, create_access_token, verify_api_key
 )
 from .utils import setup_logger
-from .parser import parse_document
-from .creator import create_prompts, format_final_outputs
-from .analyzer import analyze_prompts
+from .tasks import run_document_processing, TASKS
+from .llm import client_stats, close_clients
+from .cache import cache_stats
+from .retrieval import retrieval_stats
+from .ratelimit import rate_limit_stats
+from .digest import remove_digests
+from .executor import run_blocking, run_task, executor_stats, shutdown_executors, loop_monitor
+from .events import broker, TERMINAL_STATUSES
+from . import cancellation
+from .scheduler import scheduler, job_cost, PRIORITIES
+from .admission import admission
+from .reuse import request_signature, request_hash, clone_generation, IDEMPOTENCY_KEY_TTL_SECONDS
+from .stats import stats_cache
+
+# "inline" runs work in this process (fair-queued by bot.scheduler), "worker" queues it for python -m bot.worker
+JOB_QUEUE_MODE = os.getenv("JOB_QUEUE_MODE", "inline").lower()
+
+# Resume generations interrupted by a restart automatically instead of waiting for POST /generations/{id}/resume
+GENERATION_AUTO_RESUME = os.getenv("GENERATION_AUTO_RESUME", "false").lower() in ("1", "true", "yes")
+
+# Inline mode assumes one API process per database: on startup every pending or processing generation
+# is flagged interrupted. When several API processes share it, only flag those without progress for this long
+GENERATION_INTERRUPT_AFTER_SECONDS = float(os.getenv("GENERATION_INTERRUPT_AFTER_SECONDS", "0"))
+
+# Seconds an event stream waits for a published event before re-checking the database
+# (the only signal when a worker process runs the job) and sending a keep-alive
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "5"))
+
+# Page size of GET /documents and GET /generations when no limit is given, and the largest allowed
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "50"))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "200"))
 
 # Setup logger
 logger = setup_logger("api")
@@ -59,6 +93,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Retry-After", "Idempotent-Replayed"],
 )
 
 # API Key header for alternative authentication
@@ -67,7 +102,8 @@ API_KEY_HEADER = APIKeyHeader(name="X-API-Key", auto_error=False)
 # Initialize database
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    loop_monitor.start()
+    await init_db()
     logger.info("Database initialized")
     
     # Create data directories if they don't exist
@@ -76,15 +112,72 @@ async def startup_event():
     os.makedirs("data/prompts", exist_ok=True)
     os.makedirs("data/analysis", exist_ok=True)
     logger.info("Data directories created")
+    
+    # Queued jobs survive restarts and workers reclaim expired leases, so only inline mode loses work
+    if JOB_QUEUE_MODE == "worker":
+        logger.info(f"Job queue mode: worker, jobs by status: {await get_job_counts()}")
+        return
+    
+    # Background tasks do not survive a restart; flag their generations so they can be resumed
+    interrupted = await mark_interrupted_generations(GENERATION_INTERRUPT_AFTER_SECONDS)
+    if interrupted:
+        shown = ", ".join(str(generation_id) for generation_id in interrupted[:10])
+        more = f" and {len(interrupted) - 10} more" if len(interrupted) > 10 else ""
+        logger.warning(f"Marked {len(interrupted)} generation(s) as interrupted: {shown}{more}")
+    if GENERATION_AUTO_RESUME:
+        for generation_id in interrupted:
+            generation = await get_generation(generation_id)
+            task_args = await _generation_task_args(generation) if generation else None
+            if task_args:
+                logger.info(f"Auto-resuming generation {generation_id}")
+                await update_generation_status(generation_id, "pending")
+                await dispatch_task(
+                    None, "generation", **_generation_payload(*task_args), resume=True,
+                    user_id=generation['user_id'], priority=generation.get('priority') or "normal"
+                )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    logger.info(f"Closing shared LLM clients: {client_stats()}")
+    close_clients()
+    loop_monitor.stop()
+    shutdown_executors()
+    close_db_connections()
+
+
+@app.get("/health")
+async def health():
+    """Liveness plus event loop lag and executor load; lag near zero means nothing blocks the loop."""
+    return {
+        "status": "ok",
+        "job_queue_mode": JOB_QUEUE_MODE,
+        "event_loop_lag": loop_monitor.stats(),
+        "executors": executor_stats(),
+        "scheduler": scheduler.stats(),
+        "database": db_pool_stats(),
+        "admission": admission.stats(),
+        "stats_cache": stats_cache.stats(),
+        "events": broker.stats()
+    }
+
+
+@app.get("/llm/stats")
+async def get_llm_stats(current_user = Depends(get_current_active_user)):
+    return {
+        "clients": client_stats(),
+        "cache": cache_stats(),
+        "retrieval": retrieval_stats(),
+        "rate_limit": rate_limit_stats()
+    }
 
 
 # Authentication routes
 @app.post("/token", response_model=Token)
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(),
-    conn = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends()
 ):
-    user = authenticate_user(conn, form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         logger.warning(f"Failed login attempt for username: {form_data.username}")
         raise HTTPException(
@@ -100,8 +193,7 @@ async def login_for_access_token(
 # Helper function to get user from API key or JWT token
 async def get_user_from_auth(
     api_key: str = Depends(API_KEY_HEADER),
-    user = Depends(get_current_active_user),
-    conn = Depends(get_db)
+    user = Depends(get_current_active_user)
 ):
     # If JWT token is valid, return the user
     if user:
@@ -109,7 +201,7 @@ async def get_user_from_auth(
     
     # If API key is provided, verify it
     if api_key:
-        api_user = verify_api_key(api_key)
+        api_user = await verify_api_key(api_key)
         if api_user:
             return api_user
     
@@ -123,22 +215,22 @@ async def get_user_from_auth(
 
 # User routes
 @app.post("/users", response_model=UserResponse)
-async def create_user_route(user: UserCreate, conn = Depends(get_db)):
-    db_user = get_user_by_username(user.username)
+async def create_user_route(user: UserCreate):
+    db_user = await get_user_by_username(user.username)
     if db_user:
         logger.warning(f"Attempted to create duplicate username: {user.username}")
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_email = get_user_by_email(user.email)
+    db_email = await get_user_by_email(user.email)
     if db_email:
         logger.warning(f"Attempted to create user with existing email: {user.email}")
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Hash the password
-    password_hash = get_password_hash(user.password)
+    password_hash = await run_blocking(get_password_hash, user.password)
     
     try:
-        new_user = create_user(user.username, user.email, password_hash)
+        new_user = await create_user(user.username, user.email, password_hash)
         logger.info(f"New user created: {user.username}")
         return new_user
     except PsycopgError as e:
@@ -152,13 +244,28 @@ async def read_users_me(current_user = Depends(get_user_from_auth)):
 
 
 # Document routes
+def _save_upload(source, file_path: str):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(source, buffer)
+
+
+def _remove_document_files(document):
+    if os.path.exists(document['file_path']):
+        os.remove(document['file_path'])
+    
+    # Remove the processed file if it exists
+    if document.get('output_path') and os.path.exists(document['output_path']):
+        os.remove(document['output_path'])
+    if document.get('output_path'):
+        remove_digests(document['output_path'])
+
+
 @app.post("/documents/upload", response_model=DocumentResponse)
 async def upload_document(
     document_type: str = Form(...),
     file: UploadFile = File(...),
     background_tasks: BackgroundTasks = None,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    current_user = Depends(get_user_from_auth)
 ):
     # Validate document type
     if document_type not in ["knowledge_base", "agent_persona"]:
@@ -170,15 +277,14 @@ async def upload_document(
     
     # Save the uploaded file
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await run_blocking(_save_upload, file.file, file_path)
     except Exception as e:
         logger.error(f"Error saving file: {str(e)}")
         raise HTTPException(status_code=500, detail="Error saving file")
     
     # Create document record
     try:
-        document = create_document(
+        document = await create_document(
             current_user['id'], 
             file.filename, 
             file_path, 
@@ -188,10 +294,7 @@ async def upload_document(
         logger.info(f"Document uploaded: {document['id']} - {document['filename']}")
         
         # Process document in background
-        if background_tasks:
-            background_tasks.add_task(
-                process_document_task, document['id']
-            )
+        await dispatch_task(background_tasks, "document", document_id=document['id'])
         
         return document
     except PsycopgError as e:
@@ -201,90 +304,90 @@ async def upload_document(
 
 async def process_document_task(document_id: int):
     """Process document in background."""
-    # Create a new database connection specific to this background task
-    with get_db_connection() as conn:
-        # Create a cursor to use for database operations
-        cursor = conn.cursor()
-        
-        # Get document using cursor directly instead of get_document function
-        cursor.execute("SELECT * FROM documents WHERE id = ?", (document_id,))
-        db_document = cursor.fetchone()
-        if not db_document:
-            logger.error(f"Document not found: {document_id}")
-            return
-        
-        db_document = dict(db_document)  # Convert to dictionary
-    
     try:
-        # Construct a proper output path for the parsed document
-        # e.g., data/parsed/user_<user_id>_doc_<document_id>_<filename>.md
-        original_filename = os.path.basename(db_document['file_path'])
-        parsed_filename = f"user_{db_document['user_id']}_doc_{document_id}_{original_filename}.md"
-        parsed_output_dir = os.path.join("data", "parsed")
-        os.makedirs(parsed_output_dir, exist_ok=True) # Ensure directory exists
-        output_path = os.path.join(parsed_output_dir, parsed_filename)
-
-        # Process document using parser with the correct output_path
-        parse_document(db_document['file_path'], output_path)
-        
-        # Get content preview (strictly < 512 chars)
-        content_preview = None
-        preview_max_len = 500 # Max length for the content part
-        try:
-            with open(output_path, "r", encoding="utf-8") as f: # Added encoding
-                content = f.read(preview_max_len)
-            if len(content) >= preview_max_len:
-                content_preview = content[:preview_max_len - 3] + "..." # Ensure total length is <= preview_max_len
-            else:
-                content_preview = content
-        except Exception as e:
-            logger.error(f"Error reading content preview from {output_path}: {str(e)}") # Log output_path
-        
-        # Update document record with a new connection
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            now = datetime.utcnow().isoformat()
-            cursor.execute("""
-                UPDATE documents 
-                SET processed = 1, processed_at = ?, output_path = ?, content_preview = ?
-                WHERE id = ?
-            """, (now, output_path, content_preview, document_id))
-            conn.commit()
-            
-        logger.info(f"Document processed successfully: {document_id}")
-    except Exception as e:
-        logger.error(f"Error processing document {document_id}: {str(e)}")
-        # Update error with a new connection
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE documents 
-                SET processing_error = ?
-                WHERE id = ?
-            """, (str(e), document_id))
-            conn.commit()
+        await run_task(run_document_processing, document_id)
+    except Exception:
+        # Already logged and recorded on the document
+        pass
+
+
+# Stored as 0/1; the response models turn them into booleans, which sparse responses skip
+_BOOLEAN_FIELDS = {"processed", "analysis_completed"}
+
+
+def _list_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    """Fields requested with ?fields=a,b (None for all); 400 for a field the response model lacks."""
+    if not fields:
+        return None
+    requested = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in requested if field not in model.__fields__]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def _check_order(order: str):
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid order, expected asc or desc")
+
+
+def _list_page(response: Response, items: list, limit: int, total: int, fields: Optional[List[str]]):
+    """
+    Trim the extra row fetched to tell whether another page follows, and set X-Next-Cursor
+    (the `after` of the next page, absent on the last one) and X-Total-Count. With fields,
+    only those are returned, bypassing the response model.
+    """
+    headers = {"X-Total-Count": str(total)}
+    if len(items) > limit:
+        items = items[:limit]
+        headers["X-Next-Cursor"] = str(items[-1]['id'])
+    if fields is None:
+        response.headers.update(headers)
+        return items
+    narrowed = [
+        {field: bool(item.get(field)) if field in _BOOLEAN_FIELDS else item.get(field) for field in fields}
+        for item in items
+    ]
+    return JSONResponse(content=jsonable_encoder(narrowed), headers=headers)
 
 
 @app.get("/documents", response_model=List[DocumentResponse])
 async def get_documents(
+    response: Response,
     document_type: Optional[str] = None,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    processed: Optional[bool] = None,
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    order: str = "desc",
+    fields: Optional[str] = None,
+    current_user = Depends(get_user_from_auth)
 ):
+    """
+    A page of the user's documents, newest first (order=asc for oldest first). Pass a
+    response's X-Next-Cursor header as `after` to get the next page. fields is a
+    comma-separated subset of the response fields.
+    """
     if document_type and document_type not in ["knowledge_base", "agent_persona"]:
         raise HTTPException(status_code=400, detail="Invalid document type")
-    
-    documents = get_documents_by_user(current_user['id'], document_type)
-    return documents
+    _check_order(order)
+    requested = _list_fields(fields, DocumentResponse)
+    
+    documents, total = await asyncio.gather(
+        get_documents_by_user(
+            current_user['id'], document_type, processed,
+            limit=limit + 1, after=after, order=order, fields=requested
+        ),
+        count_documents_by_user(current_user['id'], document_type, processed)
+    )
+    return _list_page(response, documents, limit, total, requested)
 
 
 @app.get("/documents/{document_id}", response_model=DocumentResponse)
 async def get_document_route(
     document_id: int,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    current_user = Depends(get_user_from_auth)
 ):
-    document = get_document(document_id, current_user['id'])
+    document = await get_document(document_id, current_user['id'])
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -295,26 +398,20 @@ async def get_document_route(
 @app.delete("/documents/{document_id}")
 async def delete_document_route(
     document_id: int,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    current_user = Depends(get_user_from_auth)
 ):
     # First, get the document to check if it exists and get file paths
-    document = get_document(document_id, current_user['id'])
+    document = await get_document(document_id, current_user['id'])
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
     try:
-        # Remove the file
-        if os.path.exists(document['file_path']):
-            os.remove(document['file_path'])
-        
-        # Remove the processed file if it exists
-        if document.get('output_path') and os.path.exists(document['output_path']):
-            os.remove(document['output_path'])
+        # Remove the file and its parsed output
+        await run_blocking(_remove_document_files, document)
         
         # Delete document from database
-        result = delete_document(document_id, current_user['id'])
+        result = await delete_document(document_id, current_user['id'])
         logger.info(f"Document deleted: {document_id}")
         
         return {"detail": "Document deleted successfully"}
@@ -328,12 +425,17 @@ async def delete_document_route(
 async def create_generation_route(
     generation: GenerationCreate,
     background_tasks: BackgroundTasks,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user = Depends(get_user_from_auth)
 ):
+    """
+    Start a generation. A repeated Idempotency-Key returns the generation the first request
+    created; reuse_existing copies a completed generation with identical inputs.
+    """
     # Check if knowledge base and agent persona documents exist and belong to the user
-    kb_doc = get_document(generation.knowledge_base_id, current_user['id'])
-    persona_doc = get_document(generation.agent_persona_id, current_user['id'])
+    kb_doc = await get_document(generation.knowledge_base_id, current_user['id'])
+    persona_doc = await get_document(generation.agent_persona_id, current_user['id'])
     
     if not kb_doc or kb_doc['document_type'] != "knowledge_base" or not kb_doc['processed']:
         raise HTTPException(
@@ -347,267 +449,441 @@ async def create_generation_route(
             detail="Agent persona document not found or not processed"
         )
     
-    # Create output directory
-    output_dir = os.path.join("data/prompts", f"{current_user['username']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
-    os.makedirs(output_dir, exist_ok=True)
+    if generation.priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid priority, expected one of: {', '.join(PRIORITIES)}")
     
-    try:
-        # Create generation record
-        gen_record = create_generation(
-            current_user['id'],
-            generation.knowledge_base_id,
-            generation.agent_persona_id,
-            generation.questions_per_client,
-            output_dir
-        )
+    body_hash = request_hash(generation.dict()) if idempotency_key else None
+    
+    # A retry of an earlier request replays it before any file is hashed or copied
+    if idempotency_key:
+        replayed = await _idempotent_replay(current_user['id'], idempotency_key, body_hash, response)
+        if replayed:
+            return replayed
+    
+    # Hashing documents and copying a generation happen outside admission.lock so one
+    # user's disk I/O does not hold up everyone else's submissions
+    signature = await run_blocking(request_signature, kb_doc, persona_doc, generation.questions_per_client)
+    # The suffix keeps requests within the same second (a double-click) out of each other's directory
+    output_dir = os.path.join(
+        "data/prompts", f"{current_user['username']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    )
+    
+    if generation.reuse_existing:
+        source = await find_reusable_generation(signature, exclude_output_directory=output_dir)
+        if source and os.path.isdir(source['output_directory']):
+            # No LLM work, so no admission check
+            try:
+                return await run_blocking(
+                    clone_generation, source, current_user['id'], current_user['username'],
+                    generation.knowledge_base_id, generation.agent_persona_id, output_dir,
+                    priority=generation.priority, idempotency_key=idempotency_key, body_hash=body_hash
+                )
+            except sqlite3.IntegrityError:
+                # A concurrent request with the same Idempotency-Key recorded it first
+                replayed = await _idempotent_replay(current_user['id'], idempotency_key, body_hash, response) if idempotency_key else None
+                if replayed:
+                    return replayed
+                raise
+    
+    # Held until the pending row exists so concurrent submissions see each other
+    async with admission.lock:
+        if idempotency_key:
+            replayed = await _idempotent_replay(current_user['id'], idempotency_key, body_hash, response)
+            if replayed:
+                return replayed
         
-        logger.info(f"Generation task created: {gen_record['id']}")
+        await _admit_generation(current_user['id'], generation.questions_per_client)
         
-        # Start generation in background
-        background_tasks.add_task(
-            process_generation_task,
-            gen_record['id'], 
-            kb_doc['output_path'], 
-            persona_doc['output_path'],
-            output_dir,
-            generation.questions_per_client
-        )
+        # Create output directory
+        os.makedirs(output_dir, exist_ok=True)
         
-        return gen_record
-    except PsycopgError as e:
-        logger.error(f"Database error creating generation: {str(e)}")
-        raise HTTPException(status_code=500, detail="Error creating generation task")
+        try:
+            # Create generation record
+            gen_record = await create_generation(
+                current_user['id'],
+                generation.knowledge_base_id,
+                generation.agent_persona_id,
+                generation.questions_per_client,
+                output_dir,
+                generation.priority,
+                request_signature=signature,
+                idempotency_key=idempotency_key,
+                request_hash=body_hash
+            )
+        except sqlite3.IntegrityError:
+            # Another process recorded the same Idempotency-Key first
+            replayed = await _idempotent_replay(current_user['id'], idempotency_key, body_hash, response) if idempotency_key else None
+            if replayed:
+                return replayed
+            raise
+        except PsycopgError as e:
+            logger.error(f"Database error creating generation: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error creating generation task")
+    
+    logger.info(f"Generation task created: {gen_record['id']}")
+    
+    # Start generation in background
+    await dispatch_task(
+        background_tasks,
+        "generation",
+        generation_id=gen_record['id'],
+        kb_path=kb_doc['output_path'],
+        persona_path=persona_doc['output_path'],
+        output_dir=output_dir,
+        questions_per_client=generation.questions_per_client,
+        user_id=current_user['id'],
+        priority=generation.priority
+    )
+    
+    return await _with_queue_positions(gen_record)
 
 
-async def process_generation_task(
-    generation_id: int,
-    kb_path: str,
-    persona_path: str,
-    output_dir: str,
-    questions_per_client: int
+async def _idempotent_replay(user_id: int, idempotency_key: str, body_hash: str, response: Response):
+    """The generation created earlier with this Idempotency-Key, or None if the key is new."""
+    stored = await get_idempotency_key(user_id, idempotency_key, IDEMPOTENCY_KEY_TTL_SECONDS)
+    if not stored:
+        return None
+    if stored['request_hash'] != body_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    generation = await get_generation(stored['generation_id'], user_id)
+    if not generation:
+        return None
+    response.headers["Idempotent-Replayed"] = "true"
+    logger.info(f"Idempotency-Key replay for generation {generation['id']}")
+    return await _with_queue_positions(generation)
+
+
+@app.get("/generations/reusable", response_model=ReusableGenerationResponse)
+async def get_reusable_generation_route(
+    knowledge_base_id: int,
+    agent_persona_id: int,
+    questions_per_client: int = 5,
+    current_user = Depends(get_user_from_auth)
 ):
-    # Create a new database connection specific to this background task
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM generations WHERE id = ?", (generation_id,))
-        db_generation = cursor.fetchone()
-        if not db_generation:
-            logger.error(f"Generation not found: {generation_id}")
-            return
-        
-        db_generation = dict(db_generation)
-        
-        # Get username for this generation
-        cursor.execute("SELECT username FROM users WHERE id = ?", (db_generation['user_id'],))
-        user_result = cursor.fetchone()
-        log_username = user_result['username'] if user_result else f"user_{db_generation['user_id']}"
+    """Whether POST /generations with reuse_existing would copy a completed generation, and how old it is."""
+    kb_doc = await get_document(knowledge_base_id, current_user['id'])
+    persona_doc = await get_document(agent_persona_id, current_user['id'])
+    if not kb_doc or not kb_doc['processed'] or not persona_doc or not persona_doc['processed']:
+        raise HTTPException(status_code=404, detail="Documents not found or not processed")
+    signature = await run_blocking(request_signature, kb_doc, persona_doc, questions_per_client)
+    source = await find_reusable_generation(signature)
+    if not source or not os.path.isdir(source['output_directory']):
+        return {"available": False}
+    # The source may be another user's generation, so nothing identifying it is returned
+    completed_at = datetime.fromisoformat(source['completed_at'])
+    return {
+        "available": True,
+        "completed_at": completed_at,
+        "age_seconds": round((datetime.utcnow() - completed_at).total_seconds(), 1)
+    }
+
+
+async def _admit_generation(user_id: int, questions_per_client: int):
+    """Raise 429 (user over their limit) or 503 (server backlog full) with Retry-After unless admitted."""
+    backlog = await get_generation_backlog()
+    decision = admission.check(user_id, questions_per_client, backlog)
+    if not decision.admitted:
+        raise HTTPException(
+            status_code=decision.status_code,
+            detail=f"Generation not accepted: {decision.detail}",
+            headers=decision.headers
+        )
 
-    try:
-        # Update status to processing
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE generations 
-                SET status = ?
-                WHERE id = ?
-            """, ("processing", generation_id))
-            conn.commit()
-        
-        # Ensure output_dir (which is specific to this generation) is a Path object for creator
-        generation_specific_output_dir = Path(output_dir)
-
-        # Run creator script with the new signature
-        client_type_objects = create_prompts(
-            knowledge_base_path=kb_path,
-            agent_persona_path=persona_path,
-            questions_per_client=questions_per_client,
-            output_dir=generation_specific_output_dir,
-            username_for_logging=log_username
+
+async def dispatch_task(
+    background_tasks: Optional[BackgroundTasks],
+    kind: str,
+    user_id: Optional[int] = None,
+    priority: str = "normal",
+    **payload
+):
+    """
+    Run a task in this process, or queue it for a worker in JOB_QUEUE_MODE=worker.
+    
+    Generation and analysis jobs go through fair queuing across users either way: the
+    in-process scheduler inline, claim_job's ordering with workers. Document parsing runs
+    after the response via BackgroundTasks.
+    """
+    if JOB_QUEUE_MODE == "worker":
+        job = await enqueue_job(
+            kind, payload,
+            user_id=user_id, priority=priority, cost=job_cost(kind, payload)
         )
-        
-        if not client_type_objects:
-            logger.error(f"create_prompts returned no client types for generation_id: {generation_id}")
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE generations 
-                    SET status = ?, error_message = ?
-                    WHERE id = ?
-                """, ("failed", "Failed to generate client types in creator module", generation_id))
-                conn.commit()
-            return
-
-        # Create client type records and count questions
-        client_type_count = 0
-        question_count = 0
-        
-        for client_obj in client_type_objects:
-            client_output_filename = generation_specific_output_dir / f"{client_obj.client_type}_prompt.txt"
-
-            # Create client_type with new connection
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                now = datetime.utcnow().isoformat()
-                cursor.execute("""
-                    INSERT INTO client_types 
-                    (generation_id, name, description, question_count, output_file, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    generation_id, 
-                    client_obj.client_type, 
-                    client_obj.description, 
-                    len(getattr(client_obj, 'questions', [])),
-                    str(client_output_filename),
-                    now
-                ))
-                conn.commit()
-            
-            client_type_count += 1
-            question_count += len(getattr(client_obj, 'questions', []))
-        
-        # Update generation with counts
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE generations 
-                SET client_types_count = ?, questions_count = ?
-                WHERE id = ?
-            """, (client_type_count, question_count, generation_id))
-            conn.commit()
-        
-        # Create the final output files
-        server_bot_persona, kb_qa_path, _ = format_final_outputs(
-            generation_specific_output_dir, 
-            log_username
+        logger.info(f"Queued {kind} job {job['id']}")
+        return
+    if kind == "document":
+        background_tasks.add_task(process_document_task, **payload)
+        return
+    scheduler.submit(
+        user_id, payload['generation_id'], kind, job_cost(kind, payload), priority, TASKS[kind], **payload
+    )
+
+
+async def _queue_positions() -> dict:
+    if JOB_QUEUE_MODE == "worker":
+        return await get_job_queue_positions()
+    return scheduler.queue_positions()
+
+
+async def _with_queue_positions(generations):
+    """Add queue_position to pending generation(s) waiting for a job slot."""
+    single = isinstance(generations, dict)
+    items = [generations] if single else generations
+    positions = await _queue_positions() if any(g.get('status') == "pending" for g in items) else {}
+    items = [{**g, "queue_position": positions.get(g['id']) if g.get('status') == "pending" else None} for g in items]
+    return items[0] if single else items
+
+
+def _generation_payload(generation_id, kb_path, persona_path, output_dir, questions_per_client):
+    return {
+        "generation_id": generation_id,
+        "kb_path": kb_path,
+        "persona_path": persona_path,
+        "output_dir": output_dir,
+        "questions_per_client": questions_per_client,
+    }
+
+
+async def _generation_task_args(generation):
+    """Arguments for run_generation rebuilt from a stored generation, or None if its documents are gone."""
+    kb_doc = await get_document(generation['knowledge_base_id'])
+    persona_doc = await get_document(generation['agent_persona_id'])
+    if not kb_doc or not persona_doc or not kb_doc.get('output_path') or not persona_doc.get('output_path'):
+        return None
+    return (
+        generation['id'],
+        kb_doc['output_path'],
+        persona_doc['output_path'],
+        generation['output_directory'],
+        generation['questions_per_client']
+    )
+
+
+@app.post("/generations/{generation_id}/resume", response_model=GenerationResponse)
+async def resume_generation_route(
+    generation_id: int,
+    background_tasks: BackgroundTasks,
+    current_user = Depends(get_user_from_auth)
+):
+    generation = await get_generation(generation_id, current_user['id'])
+    
+    if not generation:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    
+    if generation['status'] not in ("failed", "interrupted", "cancelled"):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Only failed, interrupted or cancelled generations can be resumed (status: {generation['status']})"
         )
-        
-        # Perform analysis automatically
-        try:
-            # Create analysis output path
-            analysis_dir = Path("data/analysis")
-            os.makedirs(analysis_dir, exist_ok=True)
-            timestamp = int(datetime.now().timestamp())
-            analysis_path = analysis_dir / f"{log_username}_analysis_{timestamp}.md"
-            
-            # Update generation record with analysis path
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE generations 
-                    SET analysis_path = ?
-                    WHERE id = ?
-                """, (str(analysis_path), generation_id))
-                conn.commit()
-            
-            # Run analyzer
-            from .analyzer import analyze_prompts
-            analyze_prompts(
-                username=log_username,
-                prompts_dir=generation_specific_output_dir,
-                output_dir=analysis_dir
-            )
-            
-            # Mark analysis as completed
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                now = datetime.utcnow().isoformat()
-                cursor.execute("""
-                    UPDATE generations 
-                    SET analysis_completed = 1, analysis_completed_at = ?
-                    WHERE id = ?
-                """, (now, generation_id))
-                conn.commit()
-            
-            logger.info(f"Analysis completed automatically for generation {generation_id}")
-        except Exception as e:
-            logger.error(f"Error in automatic analysis for generation {generation_id}: {str(e)}")
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE generations 
-                    SET analysis_error = ?
-                    WHERE id = ?
-                """, (str(e), generation_id))
-                conn.commit()
-        
-        # Update generation status to completed
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            now = datetime.utcnow().isoformat()
-            cursor.execute("""
-                UPDATE generations 
-                SET status = ?, completed_at = ?
-                WHERE id = ?
-            """, ("completed", now, generation_id))
-            conn.commit()
-            
-        logger.info(f"Generation completed for {generation_id}. Created {client_type_count} client types with {question_count} questions.")
-        logger.info(f"Final outputs: Persona: {server_bot_persona}, KB: {kb_qa_path}")
+    
+    task_args = await _generation_task_args(generation)
+    if not task_args or not generation.get('output_directory'):
+        raise HTTPException(status_code=409, detail="Generation documents or output directory no longer exist")
+    
+    os.makedirs(generation['output_directory'], exist_ok=True)
+    async with admission.lock:
+        await _admit_generation(current_user['id'], generation['questions_per_client'])
+        generation = await update_generation_status(generation_id, "pending")
+    await dispatch_task(
+        background_tasks, "generation", **_generation_payload(*task_args), resume=True,
+        user_id=current_user['id'], priority=generation.get('priority') or "normal"
+    )
+    logger.info(f"Generation {generation_id} queued for resume")
+    return await _with_queue_positions(generation)
+
+
+@app.post("/generations/{generation_id}/cancel", response_model=GenerationResponse)
+async def cancel_generation_route(
+    generation_id: int,
+    current_user = Depends(get_user_from_auth)
+):
+    generation = await get_generation(generation_id, current_user['id'])
+    
+    if not generation:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    
+    cancelled = await cancel_generation(generation_id)
+    if not cancelled:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Only pending or processing generations can be cancelled (status: {generation['status']})"
+        )
+    
+    # Stops a job running in this process before its next LLM call; workers notice the stored status
+    scheduler.discard(generation_id)
+    running_here = cancellation.cancel(generation_id)
+    broker.publish(generation_id, "status", {"status": "cancelled"})
+    logger.info(f"Generation {generation_id} cancelled ({'running in this process' if running_here else 'not running here'})")
+    return cancelled
 
-    except Exception as e:
-        # Handle errors
-        logger.error(f"Error in generation task {generation_id}: {str(e)}", exc_info=True)
-        # Update status with new connection
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE generations 
-                SET status = ?, error_message = ?
-                WHERE id = ?
-            """, ("failed", str(e), generation_id))
-            conn.commit()
 
 @app.get("/generations", response_model=List[GenerationResponse])
 async def get_generations_route(
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    response: Response,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    analysis_completed: Optional[bool] = None,
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    order: str = "desc",
+    fields: Optional[str] = None,
+    current_user = Depends(get_user_from_auth)
 ):
-    generations = get_generations_by_user(current_user['id'])
-    return generations
+    """
+    A page of the user's generations, paged and narrowed like GET /documents. status takes
+    one status or a comma-separated list (e.g. pending,processing).
+    """
+    _check_order(order)
+    requested = _list_fields(fields, GenerationResponse)
+    statuses = [s.strip() for s in status_filter.split(",") if s.strip()] if status_filter else None
+    columns = None
+    if requested:
+        # queue_position is not stored; it is looked up for pending generations
+        columns = [f for f in requested if f != "queue_position"] + (["status"] if "queue_position" in requested else [])
+    
+    generations, total = await asyncio.gather(
+        get_generations_by_user(
+            current_user['id'], statuses, analysis_completed,
+            limit=limit + 1, after=after, order=order, fields=columns
+        ),
+        count_generations_by_user(current_user['id'], statuses, analysis_completed)
+    )
+    return _list_page(response, await _with_queue_positions(generations), limit, total, requested)
 
 
 @app.get("/generations/{generation_id}", response_model=GenerationDetailResponse)
 async def get_generation_route(
     generation_id: int,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    current_user = Depends(get_user_from_auth)
 ):
-    generation = get_generation(generation_id, current_user['id'])
+    generation = await get_generation(generation_id, current_user['id'])
     
     if not generation:
         raise HTTPException(status_code=404, detail="Generation not found")
     
     # Get client types
-    client_types = get_client_types_by_generation(generation_id)
+    client_types = await get_client_types_by_generation(generation_id)
     
     # Create a GenerationDetailResponse
-    response = {**generation, "client_types": client_types}
+    response = {**await _with_queue_positions(generation), "client_types": client_types}
     
     return response
 
 
+def _sse(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _generation_snapshot(generation) -> dict:
+    return {
+        "status": generation['status'],
+        "client_types_count": generation.get('client_types_count'),
+        "questions_count": generation.get('questions_count'),
+        "analysis_completed": bool(generation.get('analysis_completed')),
+        "error_message": generation.get('error_message'),
+        "planned_calls": generation.get('planned_calls'),
+        "completed_calls": generation.get('completed_calls'),
+        "current_stage": generation.get('current_stage'),
+        "eta_seconds": generation.get('eta_seconds'),
+        "progress_updated_at": generation.get('progress_updated_at')
+    }
+
+
+@app.get("/generations/{generation_id}/events")
+async def generation_events_route(
+    generation_id: int,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user = Depends(get_user_from_auth)
+):
+    """
+    Server-Sent Events stream of a generation's progress.
+    
+    Starts with a "snapshot" of the stored generation, then relays stage, client type,
+    question, response and analysis events as they are published, and ends after a
+    terminal "status" event. Reconnecting with Last-Event-ID replays missed events.
+    """
+    generation = await get_generation(generation_id, current_user['id'])
+    if not generation:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    subscription = broker.subscribe(generation_id, after_id)
+    
+    async def stream():
+        status_seen = generation['status']
+        progress_seen = generation.get('progress_updated_at')
+        try:
+            yield _sse("snapshot", _generation_snapshot(generation))
+            if status_seen in TERMINAL_STATUSES:
+                return
+            while True:
+                message = await subscription.get(timeout=EVENTS_POLL_SECONDS)
+                if message:
+                    yield _sse(message['event'], message['data'], message['id'])
+                    if message['event'] == "status":
+                        status_seen = message['data'].get('status', status_seen)
+                        if status_seen in TERMINAL_STATUSES:
+                            return
+                    continue
+                
+                if await request.is_disconnected():
+                    return
+                
+                # Nothing published in this process (e.g. a worker runs the job); fall back to the stored status
+                current = await get_generation(generation_id)
+                if not current:
+                    return
+                if current['status'] != status_seen:
+                    status_seen = current['status']
+                    yield _sse("status", _generation_snapshot(current))
+                    if status_seen in TERMINAL_STATUSES:
+                        return
+                elif current.get('progress_updated_at') != progress_seen:
+                    progress_seen = current.get('progress_updated_at')
+                    yield _sse("progress", _generation_snapshot(current))
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            subscription.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _remove_generation_files(generation):
+    if generation['output_directory'] and os.path.exists(generation['output_directory']):
+        shutil.rmtree(generation['output_directory'])
+    
+    # Remove analysis file if it exists
+    if generation.get('analysis_path') and os.path.exists(generation['analysis_path']):
+        os.remove(generation['analysis_path'])
+
+
 @app.delete("/generations/{generation_id}")
 async def delete_generation_route(
     generation_id: int,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    current_user = Depends(get_user_from_auth)
 ):
-    generation = get_generation(generation_id, current_user['id'])
+    generation = await get_generation(generation_id, current_user['id'])
     
     if not generation:
         raise HTTPException(status_code=404, detail="Generation not found")
     
+    if generation['status'] in ("pending", "processing"):
+        # Stop spending LLM calls on output that is about to be deleted
+        await cancel_generation(generation_id)
+        cancellation.cancel(generation_id)
+    
     try:
-        # Remove output directory and files
-        if generation['output_directory'] and os.path.exists(generation['output_directory']):
-            shutil.rmtree(generation['output_directory'])
-        
-        # Remove analysis file if it exists
-        if generation.get('analysis_path') and os.path.exists(generation['analysis_path']):
-            os.remove(generation['analysis_path'])
+        # Remove output directory, files and analysis report
+        await run_blocking(_remove_generation_files, generation)
         
         # Delete generation from database (this also deletes client types due to cascade)
-        result = delete_generation(generation_id, current_user['id'])
+        result = await delete_generation(generation_id, current_user['id'])
         
         logger.info(f"Generation deleted: {generation_id}")
         
@@ -617,16 +893,31 @@ async def delete_generation_route(
         raise HTTPException(status_code=500, detail="Error deleting generation")
 
 
+# Dashboard routes
+@app.get("/stats", response_model=StatsResponse)
+async def get_stats_route(current_user = Depends(get_user_from_auth)):
+    """
+    The user's document and generation counts, total questions, average generation duration
+    and analysis completion rate. Served from a per-user cache for up to
+    STATS_CACHE_TTL_SECONDS, cleared when this process writes to the user's rows.
+    """
+    stats = stats_cache.get(current_user['id'])
+    if stats is None:
+        version = stats_cache.version(current_user['id'])
+        stats = await get_user_stats(current_user['id'])
+        stats_cache.put(current_user['id'], version, stats)
+    return stats
+
+
 # Analysis routes
 @app.post("/analysis", response_model=AnalysisResponse)
 async def create_analysis(
     analysis: AnalysisCreate,
     background_tasks: BackgroundTasks,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    current_user = Depends(get_user_from_auth)
 ):
     # Check if generation exists and belongs to the user
-    generation = get_generation(analysis.generation_id, current_user['id'])
+    generation = await get_generation(analysis.generation_id, current_user['id'])
     
     if not generation or generation['status'] != "completed":
         raise HTTPException(
@@ -652,14 +943,17 @@ async def create_analysis(
     
     try:
         # Update generation record
-        updated = update_generation_analysis(generation['id'], analysis_path)
+        updated = await update_generation_analysis(generation['id'], analysis_path)
         
         # Start analysis in background
-        background_tasks.add_task(
-            process_analysis_task,
-            generation['id'],
-            generation['output_directory'],
-            analysis_path
+        await dispatch_task(
+            background_tasks,
+            "analysis",
+            generation_id=generation['id'],
+            prompts_dir=generation['output_directory'],
+            analysis_path=analysis_path,
+            user_id=current_user['id'],
+            priority=generation.get('priority') or "normal"
         )
         
         return {
@@ -672,60 +966,13 @@ async def create_analysis(
         raise HTTPException(status_code=500, detail="Error creating analysis task")
 
 
-async def process_analysis_task(
-    generation_id: int,
-    prompts_dir: str,
-    analysis_path: str
-):
-    """Process analysis in background."""
-    # Create a new database connection specific to this background task
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM generations WHERE id = ?", (generation_id,))
-        generation = cursor.fetchone()
-        if not generation:
-            logger.error(f"Generation not found: {generation_id}")
-            return
-        
-        generation = dict(generation)
-    
-    try:
-        # Run analyzer script
-        analyze_prompts(prompts_dir, analysis_path)
-        
-        # Update generation record with new connection
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            now = datetime.utcnow().isoformat()
-            cursor.execute("""
-                UPDATE generations 
-                SET analysis_completed = 1, analysis_completed_at = ?
-                WHERE id = ?
-            """, (now, generation_id))
-            conn.commit()
-        
-        logger.info(f"Analysis task completed for generation: {generation_id}")
-    except Exception as e:
-        # Handle errors with new connection
-        logger.error(f"Error in analysis task for generation {generation_id}: {str(e)}")
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE generations 
-                SET analysis_error = ?
-                WHERE id = ?
-            """, (str(e), generation_id))
-            conn.commit()
-
-
 @app.get("/analysis/{generation_id}")
 async def get_analysis(
     generation_id: int,
-    current_user = Depends(get_user_from_auth),
-    conn = Depends(get_db)
+    current_user = Depends(get_user_from_auth)
 ):
     # Check if generation exists and belongs to the user
-    generation = get_generation(generation_id, current_user['id'])
+    generation = await get_generation(generation_id, current_user['id'])
     
     if not generation:
         raise HTTPException(status_code=404, detail="Generation not found")
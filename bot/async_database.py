@@ -0,0 +1,84 @@
+import functools
+from typing import Any, Awaitable, Callable
+
+from . import database
+from .executor import run_db
+
+
+def _async(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """Async version of a bot.database operation, run on the database threads."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_db(fn, *args, **kwargs)
+    return wrapper
+
+
+async def run_in_unit_of_work(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run fn, which calls several bot.database helpers, as one transaction on a database thread."""
+    def run():
+        with database.unit_of_work():
+            return fn(*args, **kwargs)
+    return await run_db(run)
+
+
+# Same operations as bot.database, for async code (the API); the sync functions stay for
+# background tasks and workers, which already run off the event loop.
+
+# Schema
+init_db = _async(database.init_db)
+get_schema_version = _async(database.get_schema_version)
+
+# User operations
+create_user = _async(database.create_user)
+get_user_by_username = _async(database.get_user_by_username)
+get_user_by_email = _async(database.get_user_by_email)
+get_user_by_api_key = _async(database.get_user_by_api_key)
+
+# Document operations
+create_document = _async(database.create_document)
+get_document = _async(database.get_document)
+get_documents_by_user = _async(database.get_documents_by_user)
+count_documents_by_user = _async(database.count_documents_by_user)
+update_document_processed = _async(database.update_document_processed)
+set_document_content_hash = _async(database.set_document_content_hash)
+update_document_error = _async(database.update_document_error)
+delete_document = _async(database.delete_document)
+
+# Generation operations
+create_generation = _async(database.create_generation)
+update_generation_status = _async(database.update_generation_status)
+update_generation_progress = _async(database.update_generation_progress)
+update_generation_counts = _async(database.update_generation_counts)
+get_generation = _async(database.get_generation)
+get_generations_by_user = _async(database.get_generations_by_user)
+count_generations_by_user = _async(database.count_generations_by_user)
+get_idempotency_key = _async(database.get_idempotency_key)
+find_reusable_generation = _async(database.find_reusable_generation)
+create_cloned_generation = _async(database.create_cloned_generation)
+get_generation_backlog = _async(database.get_generation_backlog)
+get_user_stats = _async(database.get_user_stats)
+delete_generation = _async(database.delete_generation)
+cancel_generation = _async(database.cancel_generation)
+get_generation_status = _async(database.get_generation_status)
+mark_interrupted_generations = _async(database.mark_interrupted_generations)
+
+# Client type operations
+create_client_type = _async(database.create_client_type)
+create_client_types = _async(database.create_client_types)
+delete_client_types_by_generation = _async(database.delete_client_types_by_generation)
+get_client_types_by_generation = _async(database.get_client_types_by_generation)
+
+# Analysis operations
+update_generation_analysis = _async(database.update_generation_analysis)
+complete_generation_analysis = _async(database.complete_generation_analysis)
+update_generation_analysis_error = _async(database.update_generation_analysis_error)
+
+# Job queue operations
+enqueue_job = _async(database.enqueue_job)
+claim_job = _async(database.claim_job)
+heartbeat_job = _async(database.heartbeat_job)
+complete_job = _async(database.complete_job)
+fail_job = _async(database.fail_job)
+get_job = _async(database.get_job)
+get_job_queue_positions = _async(database.get_job_queue_positions)
+get_job_counts = _async(database.get_job_counts)
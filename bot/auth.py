@@ -8,9 +8,10 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import psycopg
 
-from .database import get_db, get_user_by_username, get_user_by_api_key
+from .async_database import get_user_by_username, get_user_by_api_key
 from .schemas import TokenData
 from .utils import setup_logger
+from .executor import run_blocking
 
 # Setup logger
 logger = setup_logger("auth")
@@ -40,9 +41,9 @@ def generate_api_key():
     return secrets.token_urlsafe(32)
 
 
-def authenticate_user(conn, username: str, password: str):
-    user = get_user_by_username(username)
-    if not user or not verify_password(password, user['password_hash']):
+async def authenticate_user(username: str, password: str):
+    user = await get_user_by_username(username)
+    if not user or not await run_blocking(verify_password, password, user['password_hash']):
         return False
     return user
 
@@ -58,7 +59,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), conn = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -74,7 +75,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), conn = Depends(g
         logger.error("JWT token validation failed")
         raise credentials_exception
     
-    user = get_user_by_username(username)
+    user = await get_user_by_username(username)
     if user is None:
         logger.error(f"User {token_data.username} not found in database")
         raise credentials_exception
@@ -88,8 +89,8 @@ async def get_current_active_user(current_user = Depends(get_current_user)):
     return current_user
 
 
-def verify_api_key(api_key: str):
+async def verify_api_key(api_key: str):
     """Verify API key and return user if valid."""
-    user = get_user_by_api_key(api_key)
+    user = await get_user_by_api_key(api_key)
     if not user or not user['is_active']:
         return None 
\ No newline at end of file
@@ -0,0 +1,434 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import random
+import tempfile
+import itertools
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List
+
+from .utils import setup_logger
+from .llm import set_backend
+from .cache import set_cache_enabled
+from .ratelimit import RateLimiter, set_limiter
+from .fake_llm import FakeBackend, classify_prompt, FAKE_LLM_LATENCY, FAKE_LLM_FAILURE_RATE, FAKE_LLM_SEED
+from .creator import create_prompts, format_final_outputs
+from .analyzer import analyze_prompts
+from .events import TERMINAL_STATUSES
+
+logger = setup_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+class TimedBackend:
+    """Wraps a backend and records the latency of every call, grouped by pipeline call kind."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_completed: Dict[str, float] = {}
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _record(self, prompt: str, started: float, failed: bool):
+        now = time.perf_counter()
+        kind = classify_prompt(prompt)
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(now - started)
+            if failed:
+                self.failures += 1
+            else:
+                self.first_completed.setdefault(kind, now)
+
+    def generate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        started = time.perf_counter()
+        try:
+            text = self.backend.generate(model, prompt, config)
+        except Exception:
+            self._record(prompt, started, failed=True)
+            raise
+        self._record(prompt, started, failed=False)
+        return text
+
+    async def agenerate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        started = time.perf_counter()
+        try:
+            text = await self.backend.agenerate(model, prompt, config)
+        except Exception:
+            self._record(prompt, started, failed=True)
+            raise
+        self._record(prompt, started, failed=False)
+        return text
+
+    def generate_stream(self, model: str, prompt: str, config: Dict[str, Any]) -> Iterator[str]:
+        started = time.perf_counter()
+        try:
+            yield from self.backend.generate_stream(model, prompt, config)
+        except GeneratorExit:
+            # The caller stopped reading once it had every item it needed
+            self._record(prompt, started, failed=False)
+            raise
+        except Exception:
+            self._record(prompt, started, failed=True)
+            raise
+        self._record(prompt, started, failed=False)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run_pipeline(
+    kb_path: Path,
+    persona_path: Path,
+    client_types: int,
+    questions: int,
+    concurrency: int,
+    parallel_client_types: bool,
+    kb_mode: str,
+    stream: bool,
+    latency: str,
+    failure_rate: float,
+    seed: int
+) -> Dict[str, Any]:
+    """Run create_prompts -> format_final_outputs -> analyze_prompts once against a timed fake backend."""
+    backend = TimedBackend(FakeBackend(latency=latency, failure_rate=failure_rate, seed=seed))
+    set_backend(backend)
+    # Fresh limiter per run so one run's backoff does not slow the next
+    limiter = set_limiter(RateLimiter())
+
+    stages = {}
+    error = None
+    with tempfile.TemporaryDirectory(prefix="bfsi_bench_") as tmp:
+        output_dir = Path(tmp) / "prompts" / "bench"
+        analysis_dir = Path(tmp) / "analysis"
+
+        started = time.perf_counter()
+        stage_started = started
+        client_type_objects = create_prompts(
+            knowledge_base_path=str(kb_path),
+            agent_persona_path=str(persona_path),
+            questions_per_client=questions,
+            output_dir=output_dir,
+            username_for_logging="bench",
+            max_concurrency=concurrency,
+            num_client_types=client_types,
+            parallel_client_types=parallel_client_types,
+            kb_mode=kb_mode,
+            digest_mode="off",
+            stream=stream
+        )
+        stages["create_prompts"] = time.perf_counter() - stage_started
+
+        stage_started = time.perf_counter()
+        format_final_outputs(output_dir, "bench")
+        stages["format_final_outputs"] = time.perf_counter() - stage_started
+
+        stage_started = time.perf_counter()
+        try:
+            analyze_prompts(username="bench", prompts_dir=output_dir, output_dir=analysis_dir)
+        except Exception as e:
+            # Injected failures can leave nothing to analyze; keep the run and report why
+            error = f"analyze_prompts failed: {e}"
+        stages["analyze_prompts"] = time.perf_counter() - stage_started
+
+        wall = time.perf_counter() - started
+
+    calls = sum(len(v) for v in backend.latencies.values())
+    return {
+        "client_types": client_types,
+        "questions_per_client": questions,
+        "concurrency": concurrency,
+        "parallel_client_types": parallel_client_types,
+        "kb_mode": kb_mode,
+        "stream": stream,
+        "client_types_generated": len(client_type_objects or []),
+        "questions_generated": sum(len(getattr(c, "questions", [])) for c in client_type_objects or []),
+        "wall_seconds": round(wall, 4),
+        "first_response_seconds": round(backend.first_completed["response"] - started, 4) if "response" in backend.first_completed else None,
+        "llm_calls": calls,
+        "llm_failures": backend.failures,
+        "calls_per_second": round(calls / wall, 2) if wall else 0.0,
+        "stage_seconds": {name: round(seconds, 4) for name, seconds in stages.items()},
+        "call_latency": {kind: summarize(values) for kind, values in sorted(backend.latencies.items())},
+        "rate_limit": limiter.stats(),
+        "peak_rss_mb": peak_rss_mb(),
+        "error": error,
+    }
+
+
+def run_api_probe(kb_path: Path, persona_path: Path, questions: int, latency: str, seed: int, samples: int = 50) -> Dict[str, Any]:
+    """
+    Measure API latency (GET /users/me) idle and until a generation run inline in the same process finishes.
+
+    Runs against a throwaway database and working directory; if background work blocked the
+    event loop, the "during_generation" latencies and the loop lag would climb with it.
+    """
+    from fastapi.testclient import TestClient
+    from . import database
+    from .auth import create_access_token
+
+    set_backend(FakeBackend(latency=latency, failure_rate=0.0, seed=seed))
+    set_limiter(RateLimiter())
+    previous_cwd = os.getcwd()
+    previous_db = database.DATABASE_PATH
+
+    with tempfile.TemporaryDirectory(prefix="bfsi_probe_") as tmp:
+        os.chdir(tmp)
+        database.DATABASE_PATH = Path(tmp) / "probe.db"
+        try:
+            from .api import app
+            database.init_db()
+            user = database.create_user("probe", "probe@example.com", "unused")
+            doc_ids = {}
+            for doc_type, source in (("knowledge_base", kb_path), ("agent_persona", persona_path)):
+                doc = database.create_document(user['id'], source.name, str(source), doc_type)
+                database.update_document_processed(doc['id'], str(source))
+                doc_ids[doc_type] = doc['id']
+            headers = {"Authorization": f"Bearer {create_access_token({'sub': 'probe'})}"}
+
+            with TestClient(app) as client:
+                def probe() -> float:
+                    started = time.perf_counter()
+                    client.get("/users/me", headers=headers).raise_for_status()
+                    return time.perf_counter() - started
+
+                idle = [probe() for _ in range(samples)]
+
+                # The generation is queued on the in-process scheduler and POST returns at once;
+                # sample until it reaches a terminal status, while its input files still exist
+                started = time.perf_counter()
+                generation = client.post("/generations", headers=headers, json={
+                    "knowledge_base_id": doc_ids["knowledge_base"],
+                    "agent_persona_id": doc_ids["agent_persona"],
+                    "questions_per_client": questions
+                }).json()
+                busy = []
+                while generation["status"] not in TERMINAL_STATUSES:
+                    busy.append(probe())
+                    time.sleep(0.01)
+                    generation = client.get(f"/generations/{generation['id']}", headers=headers).json()
+                generation_seconds = time.perf_counter() - started
+                health = client.get("/health").json()
+        finally:
+            os.chdir(previous_cwd)
+            database.DATABASE_PATH = previous_db
+
+    return {
+        "questions_per_client": questions,
+        "generation_status": generation["status"],
+        "generation_seconds": round(generation_seconds, 4),
+        "idle": summarize(idle),
+        "during_generation": summarize(busy),
+        "event_loop_lag": health["event_loop_lag"],
+        "executors": health["executors"],
+    }
+
+
+def _seed_database(conn, rows: int, users: int):
+    """Bulk-load users, documents (rows // 4), generations (rows) and client types (rows) with realistic spread."""
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executemany(
+        "INSERT INTO users (id, username, email, password_hash, api_key) VALUES (?, ?, ?, 'x', ?)",
+        ((i, f"user{i}", f"user{i}@example.com", f"key{i}") for i in range(1, users + 1))
+    )
+    doc_types = ("knowledge_base", "agent_persona")
+    conn.executemany(
+        "INSERT INTO documents (user_id, filename, file_path, document_type, processed) VALUES (?, ?, ?, ?, 1)",
+        ((rng.randint(1, users), f"doc{i}.pdf", f"/tmp/doc{i}.pdf", doc_types[i % 2]) for i in range(rows // 4))
+    )
+    statuses = ("completed",) * 8 + ("failed", "processing")
+    conn.executemany(
+        "INSERT INTO generations (user_id, knowledge_base_id, agent_persona_id, status, started_at, questions_per_client) "
+        "VALUES (?, 1, 2, ?, ?, 5)",
+        ((rng.randint(1, users), rng.choice(statuses), (now - timedelta(seconds=rows - i)).isoformat()) for i in range(rows))
+    )
+    conn.executemany(
+        "INSERT INTO client_types (generation_id, name, description, question_count) VALUES (?, ?, 'segment', 5)",
+        ((rng.randint(1, rows), f"client_type_{i % 7}") for i in range(rows))
+    )
+    conn.commit()
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+def run_db_bench(rows: int, users: int, samples: int = 200) -> Dict[str, Any]:
+    """
+    Latency of the list endpoints (GET /documents, GET /generations, GET /generations/{id}) and
+    the helpers behind them on a database with `rows` generations, with and without the
+    lookup indexes of migration 2.
+
+    Runs against a throwaway database; the unindexed pass drops those indexes first.
+    """
+    from fastapi.testclient import TestClient
+    from . import database
+    from .auth import create_access_token
+
+    previous_cwd = os.getcwd()
+    previous_db = database.DATABASE_PATH
+    rng = random.Random(1)
+    results: Dict[str, Any] = {"rows": rows, "users": users, "samples": samples}
+
+    with tempfile.TemporaryDirectory(prefix="bfsi_db_bench_") as tmp:
+        os.chdir(tmp)
+        database.DATABASE_PATH = Path(tmp) / "bench.db"
+        try:
+            from .api import app
+            database.init_db()
+            started = time.perf_counter()
+            with database.get_db_connection() as conn:
+                _seed_database(conn, rows, users)
+                conn.execute("ANALYZE")
+                conn.commit()
+            results["seed_seconds"] = round(time.perf_counter() - started, 2)
+            indexes = (
+                "idx_documents_user_type", "idx_documents_user", "idx_generations_user",
+                "idx_generations_user_status", "idx_generations_user_started", "idx_client_types_generation"
+            )
+
+            def measure() -> Dict[str, Dict[str, float]]:
+                timings: Dict[str, List[float]] = {}
+                with TestClient(app) as client:
+                    for _ in range(samples):
+                        user_id = rng.randint(1, users)
+                        generation_id = rng.randint(1, rows)
+                        headers = {"Authorization": f"Bearer {create_access_token({'sub': f'user{user_id}'})}"}
+                        calls = {
+                            "get_documents_by_user": lambda: database.get_documents_by_user(user_id, "knowledge_base"),
+                            "get_generations_by_user": lambda: database.get_generations_by_user(user_id),
+                            "get_client_types_by_generation": lambda: database.get_client_types_by_generation(generation_id),
+                            "GET /documents": lambda: client.get("/documents", headers=headers).raise_for_status(),
+                            "GET /generations": lambda: client.get("/generations", headers=headers).raise_for_status(),
+                        }
+                        for name, call in calls.items():
+                            call_started = time.perf_counter()
+                            call()
+                            timings.setdefault(name, []).append(time.perf_counter() - call_started)
+                return {name: summarize(values) for name, values in timings.items()}
+
+            with database.get_db_connection() as conn:
+                for name in indexes:
+                    conn.execute(f"DROP INDEX {name}")
+                conn.commit()
+            results["unindexed"] = measure()
+            with database.get_db_connection() as conn:
+                database.create_lookup_indexes(conn.cursor())
+                database.create_pagination_indexes(conn.cursor())
+                database.restore_started_index(conn.cursor())
+                conn.execute("ANALYZE")
+                conn.commit()
+            results["indexed"] = measure()
+        finally:
+            os.chdir(previous_cwd)
+            database.DATABASE_PATH = previous_db
+
+    return results
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against the fake LLM backend.")
+    parser.add_argument("--kb_path", type=str, default=str(BASE_DIR / "knowledge_base"), help="Knowledge base file.")
+    parser.add_argument("--persona_path", type=str, default=str(BASE_DIR / "agent_persona"), help="Agent persona file.")
+    parser.add_argument("--client_types", type=_int_list, default=[2], help="Comma-separated client type counts to sweep.")
+    parser.add_argument("--questions", type=_int_list, default=[10], help="Comma-separated questions_per_client values to sweep.")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8], help="Comma-separated max_concurrency values to sweep.")
+    parser.add_argument("--parallel_client_types", action="store_true", help="Process client types concurrently.")
+    parser.add_argument("--stream", action="store_true", help="Stream questions and pipeline response generation.")
+    parser.add_argument("--kb_mode", type=str, default="full", choices=["full", "bm25"], help="Knowledge base context mode.")
+    parser.add_argument("--latency", type=str, default=FAKE_LLM_LATENCY, help="Fake LLM latency spec, e.g. lognormal:0.8,0.4.")
+    parser.add_argument("--failure_rate", type=float, default=FAKE_LLM_FAILURE_RATE, help="Fraction of fake calls that fail.")
+    parser.add_argument("--seed", type=int, default=FAKE_LLM_SEED, help="Seed for the fake backend.")
+    parser.add_argument("--use_cache", action="store_true", help="Leave the LLM response cache on (off by default so every call is measured).")
+    parser.add_argument("--output", type=str, default="bench_results.json", help="JSON file to write results to.")
+    parser.add_argument("--api_probe", action="store_true", help="Measure API latency while a generation runs instead of sweeping the pipeline.")
+    parser.add_argument("--db_bench", action="store_true", help="Measure list endpoint latency on a large database instead of sweeping the pipeline.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Generations (and client types) to load for --db_bench.")
+    parser.add_argument("--users", type=int, default=10_000, help="Users the --db_bench rows are spread over.")
+    args = parser.parse_args()
+
+    set_cache_enabled(args.use_cache)
+
+    if args.db_bench:
+        result = run_db_bench(args.rows, args.users)
+        for name in result["indexed"]:
+            logger.info(f"  {name} p50 unindexed={result['unindexed'][name]['p50']}s indexed={result['indexed'][name]['p50']}s")
+        with open(args.output, "w") as f:
+            json.dump({"created_at": datetime.now().isoformat(timespec="seconds"), "db_bench": result}, f, indent=2)
+        logger.info(f"Wrote database benchmark results to {args.output}")
+        return
+
+    if args.api_probe:
+        result = run_api_probe(Path(args.kb_path).resolve(), Path(args.persona_path).resolve(), args.questions[0], args.latency, args.seed)
+        logger.info(
+            f"  /users/me p95 idle={result['idle']['p95']}s during_generation={result['during_generation']['p95']}s "
+            f"loop_lag_max={result['event_loop_lag']['max']}s"
+        )
+        with open(args.output, "w") as f:
+            json.dump({"created_at": datetime.now().isoformat(timespec="seconds"), "latency": args.latency, "api_probe": result}, f, indent=2)
+        logger.info(f"Wrote API probe results to {args.output}")
+        return
+
+    runs = []
+    for client_types, questions, concurrency in itertools.product(args.client_types, args.questions, args.concurrency):
+        logger.info(f"Benchmark run: client_types={client_types} questions={questions} concurrency={concurrency}")
+        result = run_pipeline(
+            Path(args.kb_path), Path(args.persona_path), client_types, questions, concurrency,
+            args.parallel_client_types, args.kb_mode, args.stream, args.latency, args.failure_rate, args.seed
+        )
+        logger.info(
+            f"  wall={result['wall_seconds']}s first_response={result['first_response_seconds']}s calls={result['llm_calls']} "
+            f"calls/s={result['calls_per_second']} peak_rss={result['peak_rss_mb']}MB"
+        )
+        runs.append(result)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "latency": args.latency,
+        "failure_rate": args.failure_rate,
+        "seed": args.seed,
+        "cache_enabled": args.use_cache,
+        "runs": runs,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {len(runs)} benchmark run(s) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
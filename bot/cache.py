@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", str(Path(__file__).parent.parent / "data" / "llm_cache.db")))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Skip the cache for sampled (temperature > 0) calls when varied outputs are wanted
+LLM_CACHE_BYPASS_SAMPLED = os.getenv("LLM_CACHE_BYPASS_SAMPLED", "false").lower() in ("1", "true", "yes")
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of LLM responses stored in SQLite.
+
+    Entries are keyed on a SHA-256 of (model, prompt, generation config), expire after
+    ttl_seconds and are evicted least-recently-used first once the stored text exceeds
+    max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: Path = LLM_CACHE_PATH,
+        max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+        bypass_sampled: bool = LLM_CACHE_BYPASS_SAMPLED
+    ):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.bypass_sampled = bypass_sampled
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "writes": 0, "evictions": 0, "expired": 0}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_accessed REAL NOT NULL
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache(last_accessed)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, prompt: str, config: Dict[str, Any]) -> str:
+        payload = json.dumps({"model": model, "prompt": prompt, "config": config}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def should_use(self, config: Dict[str, Any], use_cache: Optional[bool] = None) -> bool:
+        """Decide whether a call may be served from or stored in the cache."""
+        if use_cache is None:
+            use_cache = not (self.bypass_sampled and (config.get("temperature") or 0) > 0)
+        if not use_cache:
+            with self._lock:
+                self._stats["bypassed"] += 1
+        return use_cache
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, size, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            value, size, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET last_accessed = ? WHERE key = ?", (now, key))
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: str, model: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("""
+            INSERT OR REPLACE INTO llm_cache (key, model, value, size, created_at, last_accessed)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, (key, model, value, size, now, now))
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._stats["writes"] += 1
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            row = self._conn.execute("DELETE FROM llm_cache WHERE key = ? RETURNING size", (key,)).fetchone()
+            if row:
+                self._total_bytes -= row[0]
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes. Caller holds the lock."""
+        if self.ttl_seconds:
+            cursor = self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self._stats["expired"] += cursor.rowcount
+
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        # Evict down to 90% of the budget so a burst of writes does not evict on every put
+        target = int(self.max_bytes * 0.9)
+        if self._total_bytes <= target:
+            return
+
+        to_free = self._total_bytes - target
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_accessed ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        self._total_bytes -= freed
+        self._stats["evictions"] += len(victims)
+        logger.debug(f"Evicted {len(victims)} LLM cache entries ({freed} bytes)")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None when LLM_CACHE_ENABLED is off."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+            logger.info(f"LLM response cache opened at {_cache.path}")
+        return _cache
+
+
+def set_cache_enabled(enabled: bool):
+    """Turn the process-wide cache on or off at runtime, e.g. for benchmarks that must miss."""
+    global LLM_CACHE_ENABLED
+    LLM_CACHE_ENABLED = enabled
+
+
+def cache_stats() -> Dict[str, Any]:
+    cache = get_cache()
+    return cache.stats() if cache else {"enabled": False}
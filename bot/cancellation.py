@@ -0,0 +1,96 @@
+import os
+import time
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# How often a running generation re-reads its stored status to notice a cancel made by another process
+CANCEL_CHECK_SECONDS = float(os.getenv("CANCEL_CHECK_SECONDS", "2"))
+
+
+class GenerationCancelled(Exception):
+    """Raised inside a generation once its cancel token is set."""
+
+
+class CancelToken:
+    """
+    Cooperative cancellation flag for one generation.
+
+    Generation code calls raise_if_cancelled() between LLM calls. cancel() sets the flag
+    directly when the API runs the job in-process; check, if given, is polled at most every
+    check_seconds so a job run by a worker process also sees a cancel recorded in the database.
+    """
+
+    def __init__(self, check: Optional[Callable[[], bool]] = None, check_seconds: float = CANCEL_CHECK_SECONDS):
+        self._event = threading.Event()
+        self._check = check
+        self._check_seconds = check_seconds
+        self._last_check = time.monotonic()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self._check is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_check < self._check_seconds:
+                return False
+            self._last_check = now
+        try:
+            if self._check():
+                self._event.set()
+        except Exception as e:
+            logger.error(f"Cancellation check failed: {e}")
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled("Generation cancelled")
+
+
+def raise_if_cancelled(token: Optional[CancelToken]):
+    """raise_if_cancelled for an optional token."""
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+_tokens: Dict[int, CancelToken] = {}
+_tokens_lock = threading.Lock()
+
+
+def register(generation_id: int, check: Optional[Callable[[], bool]] = None) -> CancelToken:
+    """Create the cancel token for a generation starting in this process."""
+    token = CancelToken(check)
+    with _tokens_lock:
+        _tokens[generation_id] = token
+    return token
+
+
+def unregister(generation_id: int, token: CancelToken):
+    with _tokens_lock:
+        if _tokens.get(generation_id) is token:
+            del _tokens[generation_id]
+
+
+def cancel(generation_id: int) -> bool:
+    """Cancel a generation running in this process; False if it is not running here."""
+    with _tokens_lock:
+        token = _tokens.get(generation_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
@@ -0,0 +1,93 @@
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .utils import setup_logger
+
+logger = setup_logger(__name__)
+
+CLIENT_TYPES_FILE = "client_types.json"
+RESPONSES_LOG_FILE = "responses.jsonl"
+
+
+def save_client_types(output_dir: Path, client_types: List[Dict[str, str]]):
+    """Persist the identified client types so a resumed generation does not re-identify them."""
+    path = Path(output_dir) / CLIENT_TYPES_FILE
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(client_types, f, indent=2)
+    tmp_path.replace(path)
+
+
+def load_client_types(output_dir: Path) -> Optional[List[Dict[str, str]]]:
+    path = Path(output_dir) / CLIENT_TYPES_FILE
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Ignoring unreadable client types checkpoint {path}: {e}")
+        return None
+
+
+def save_questions(client_dir: Path, questions: List[Dict[str, str]]):
+    """Persist a client type's questions so a resumed generation answers the same ones."""
+    path = Path(client_dir) / "questions.json"
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(questions, f, indent=2)
+    tmp_path.replace(path)
+
+
+def load_questions(client_dir: Path) -> Optional[List[Dict[str, str]]]:
+    """Questions of a client type whose question generation already finished, if any."""
+    path = Path(client_dir) / "questions.json"
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Ignoring unreadable questions checkpoint {path}: {e}")
+        return None
+
+
+class ResponseCheckpoint:
+    """
+    Append-only log of completed responses for one client type (responses.jsonl).
+
+    Each successful response is appended as one JSON line the moment it finishes, so a
+    restarted generation can skip every question already answered. Lines are keyed by
+    question text, which stays stable across resumes because questions.json is reused.
+    A truncated last line from a crash mid-write is ignored.
+    """
+
+    def __init__(self, client_dir: Path, resume: bool = False):
+        self.path = Path(client_dir) / RESPONSES_LOG_FILE
+        self._lock = threading.Lock()
+        self.completed: Dict[str, Dict[str, Any]] = {}
+
+        if not resume:
+            self.path.unlink(missing_ok=True)
+        elif self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if entry.get("question"):
+                        self.completed[entry["question"]] = entry
+            logger.info(f"Loaded {len(self.completed)} checkpointed responses from {self.path}")
+
+    def get(self, question: str) -> Optional[Dict[str, Any]]:
+        return self.completed.get(question)
+
+    def record(self, entry: Dict[str, Any]):
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+            self.completed[entry["question"]] = entry
@@ -1,15 +1,25 @@
 import os
 import json
+import time
 import argparse
+import itertools
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import Callable, List, Tuple, Dict, Iterator, Optional
 from datetime import datetime
 
 from dotenv import load_dotenv
 from google import genai
-from google.genai import types
 
-from .utils import setup_logger
+from .utils import setup_logger, JSONArrayStream
+from .llm import get_client, generate_text, stream_text, set_backend, LLM_BACKEND
+from .retrieval import KnowledgeBaseIndex, build_index, KB_CONTEXT_MODE, KB_TOP_K
+from .digest import get_digest, should_use_digest, KB_DIGEST_MODE
+from .checkpoint import ResponseCheckpoint, save_client_types, load_client_types, save_questions, load_questions
+from .events import ProgressCallback
+from .cancellation import CancelToken, GenerationCancelled, raise_if_cancelled
 
 
 load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
@@ -17,6 +27,17 @@ load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
 logger = setup_logger(__name__, level="DEBUG")
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# Model for client types, questions and responses
+GENERATION_MODEL = os.getenv("CREATOR_MODEL", "gemini-2.0-flash")
+# Maximum number of response generations in flight per client type
+MAX_CONCURRENCY = int(os.getenv("CREATOR_MAX_CONCURRENCY", "8"))
+# Number of client types to identify per generation
+NUM_CLIENT_TYPES = int(os.getenv("CREATOR_NUM_CLIENT_TYPES", "2"))
+# Process client types concurrently under one shared LLM concurrency budget
+PARALLEL_CLIENT_TYPES = os.getenv("CREATOR_PARALLEL_CLIENT_TYPES", "false").lower() in ("1", "true", "yes")
+# Stream question generation and start each response as soon as its question is parsed
+STREAM_QUESTIONS = os.getenv("CREATOR_STREAM_QUESTIONS", "false").lower() in ("1", "true", "yes")
+
 class ClientType:
     def __init__(self, client_type, description):
         self.client_type = client_type
@@ -34,10 +55,12 @@ class Question:
         return {"question": self.question, "context": self.context}
 
 class Response:
-    def __init__(self, question="", response="", key_points=None):
+    def __init__(self, question="", response="", key_points=None, failed=False):
         self.question = question
         self.response = response
         self.key_points = key_points or []
+        # Fallback answers after an error are kept in the output but never checkpointed
+        self.failed = failed
         
     def dict(self):
         return {"question": self.question, "response": self.response, "key_points": self.key_points}
@@ -53,31 +76,44 @@ def read_content_file(file_path: str) -> str:
         raise
 
 def init_llm(api_key: str) -> genai.Client:
-    client = genai.Client(api_key=api_key)
-    return client
+    # Shared per-process client so HTTP connections are reused across calls
+    return get_client(api_key)
+
+def _is_json_answer(text: str) -> bool:
+    """Whether a response completion contains a parseable JSON object, i.e. is worth caching."""
+    start_idx, end_idx = text.find('{'), text.rfind('}') + 1
+    if start_idx == -1 or end_idx == 0:
+        return False
+    try:
+        json.loads(text[start_idx:end_idx])
+        return True
+    except json.JSONDecodeError:
+        return False
 
 def generate_response(
     question: str,
     knowledge_base: str, 
     persona: str, 
     model: str,
-    client_type: ClientType
+    client_type: ClientType,
+    kb_index: Optional[KnowledgeBaseIndex] = None
 ) -> Response:
     try:
-        client = init_llm(GOOGLE_API_KEY)
-        
         if not knowledge_base or not persona or not client_type.description or not question:
             logger.warning(f"One or more critical inputs to generate_response for client '{client_type.client_type}' are empty.")
             
         logger.debug(f"Preparing to generate response for client '{client_type.client_type}', question '{question[:50]}...'")
         
+        # Only the knowledge base sections relevant to this question when an index is given
+        kb_context = kb_index.context_for(question) if kb_index else knowledge_base
+        
         prompt = f"""
         You are a financial services sales assistant responding to a client question.
         Use the knowledge base to provide accurate information and follow the agent persona 
         for tone and style. Tailor your response to the specific client type.
         
         Knowledge Base:
-        {knowledge_base}
+        {kb_context}
         
         Agent Persona:
         {persona}
@@ -93,17 +129,17 @@ def generate_response(
         {{"response": "Your detailed response", "key_points": ["point 1", "point 2", ...]}}
         """
         
-        generation_response = client.models.generate_content(
+        result = generate_text(
             model=model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.7,
-                top_p=0.95,
-                max_output_tokens=8192
-            )
-        )
-        
-        result = generation_response.text.strip()
+            prompt=prompt,
+            config={
+                "temperature": 0.7,
+                "top_p": 0.95,
+                "max_output_tokens": 8192
+            },
+            # Unparseable answers are not cached, so a resume asks again instead of replaying them
+            accept=_is_json_answer
+        ).strip()
         
         try:
             start_idx = result.find('{')
@@ -114,7 +150,8 @@ def generate_response(
                 return Response(
                     question=question,
                     response=result,
-                    key_points=["Response was not properly formatted"]
+                    key_points=["Response was not properly formatted"],
+                    failed=True
                 )
             
             json_str = result[start_idx:end_idx]
@@ -130,34 +167,40 @@ def generate_response(
             return Response(
                 question=question,
                 response="I apologize, but I'm unable to process your request at this time. Please contact our customer service for assistance.",
-                key_points=["Error parsing response", "Redirected to customer service"]
+                key_points=["Error parsing response", "Redirected to customer service"],
+                failed=True
             )
     except Exception as e:
         logger.error(f"Failed to generate response for question '{question}': {e}", exc_info=True)
         return Response(
             question=question,
             response=f"I apologize, but I'm unable to provide a specific answer to this question at this time. Please contact our customer service for more detailed information.",
-            key_points=["Error generating response", "Redirected to customer service"]
+            key_points=["Error generating response", "Redirected to customer service"],
+            failed=True
         )
 
-def generate_questions(
-    knowledge_base: str, 
-    persona: str, 
+QUESTIONS_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "max_output_tokens": 4096
+}
+
+def _questions_prompt(
+    knowledge_base: str,
+    persona: str,
     client_type: ClientType,
-    model: str,
-    num_questions: int = 5
-) -> List[Question]:
-    try:
-        client = init_llm(GOOGLE_API_KEY)
-        
-        logger.debug(f"Preparing to generate {num_questions} questions for client '{client_type.client_type}'")
-        
-        prompt = f"""
+    num_questions: int,
+    kb_index: Optional[KnowledgeBaseIndex] = None
+) -> str:
+    # Questions should range over the knowledge base, so retrieve more sections than for a single answer
+    kb_context = kb_index.context_for(client_type.description, k=KB_TOP_K * 2) if kb_index else knowledge_base
+    
+    return f"""
         You are a financial services sales assistant. Generate exactly {num_questions} specific questions that the following client type might ask.
         Create questions that are relevant to the knowledge base and can be answered by the agent persona.
         
         Knowledge Base:
-        {knowledge_base}
+        {kb_context}
         
         Agent Persona:
         {persona}
@@ -181,18 +224,41 @@ def generate_questions(
             ...
         ]
         """
+
+def _generic_questions(client_type: ClientType, needed: int) -> List[Dict[str, str]]:
+    """Fallback questions used to top up a generation that returned too few."""
+    generic_questions = [
+        {"question": f"What services do you offer for {client_type.client_type}?", 
+         "context": f"The {client_type.client_type} needs basic information about available services."},
+        {"question": "How secure is my data with your financial institution?", 
+         "context": "Security is a common concern for all financial service users."},
+        {"question": "What fees are associated with your services?", 
+         "context": "Cost is an important factor in financial decision-making."},
+        {"question": "How can I contact customer support if I need help?", 
+         "context": "Access to support is essential for resolving issues."},
+        {"question": "What makes your financial services better than competitors?", 
+         "context": "Comparing options is a standard practice before committing to a financial service."}
+    ]
+    return generic_questions[:needed]
+
+def generate_questions(
+    knowledge_base: str, 
+    persona: str, 
+    client_type: ClientType,
+    model: str,
+    num_questions: int = 5,
+    kb_index: Optional[KnowledgeBaseIndex] = None
+) -> List[Question]:
+    try:
+        logger.debug(f"Preparing to generate {num_questions} questions for client '{client_type.client_type}'")
         
-        generation_response = client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.7,
-                top_p=0.95,
-                max_output_tokens=4096
-            )
-        )
+        prompt = _questions_prompt(knowledge_base, persona, client_type, num_questions, kb_index)
         
-        result = generation_response.text.strip()
+        result = generate_text(
+            model=model,
+            prompt=prompt,
+            config=QUESTIONS_CONFIG
+        ).strip()
         start_idx = result.find('[')
         end_idx = result.rfind(']') + 1
         
@@ -210,21 +276,7 @@ def generate_questions(
         # If we don't have enough questions, add generic ones
         if len(questions_data) < num_questions:
             logger.warning(f"Only generated {len(questions_data)} questions, adding generic ones to reach {num_questions}")
-            generic_questions = [
-                {"question": f"What services do you offer for {client_type.client_type}?", 
-                 "context": f"The {client_type.client_type} needs basic information about available services."},
-                {"question": "How secure is my data with your financial institution?", 
-                 "context": "Security is a common concern for all financial service users."},
-                {"question": "What fees are associated with your services?", 
-                 "context": "Cost is an important factor in financial decision-making."},
-                {"question": "How can I contact customer support if I need help?", 
-                 "context": "Access to support is essential for resolving issues."},
-                {"question": "What makes your financial services better than competitors?", 
-                 "context": "Comparing options is a standard practice before committing to a financial service."}
-            ]
-            
-            needed = num_questions - len(questions_data)
-            questions_data.extend(generic_questions[:needed])
+            questions_data.extend(_generic_questions(client_type, num_questions - len(questions_data)))
         
         questions = [Question(q.get("question", ""), q.get("context", "")) for q in questions_data]
         
@@ -234,60 +286,343 @@ def generate_questions(
         logger.error(f"Failed to generate questions for {client_type.client_type}: {e}", exc_info=True)
         return []
 
+def stream_questions(
+    knowledge_base: str,
+    persona: str,
+    client_type: ClientType,
+    model: str,
+    num_questions: int = 5,
+    kb_index: Optional[KnowledgeBaseIndex] = None
+) -> Iterator[Question]:
+    """
+    Yield questions one by one while the model is still writing the JSON array.
+    
+    Stops after num_questions. Unlike generate_questions, this neither pads short results
+    nor swallows errors; the caller decides how to handle both.
+    """
+    prompt = _questions_prompt(knowledge_base, persona, client_type, num_questions, kb_index)
+    parser = JSONArrayStream()
+    count = 0
+    chunks = stream_text(model=model, prompt=prompt, config=QUESTIONS_CONFIG)
+    try:
+        for chunk in chunks:
+            for item in parser.feed(chunk):
+                if not isinstance(item, dict) or not item.get("question"):
+                    continue
+                yield Question(item.get("question", ""), item.get("context", ""))
+                count += 1
+                if count >= num_questions:
+                    return
+    finally:
+        chunks.close()
+
+def _checkpointed_response(
+    question: Question,
+    checkpoint: Optional[ResponseCheckpoint],
+    llm_slots: Optional[threading.Semaphore],
+    label: str,
+    knowledge_base: str,
+    persona: str,
+    client_type: ClientType,
+    model: str,
+    kb_index: Optional[KnowledgeBaseIndex],
+    cancel: Optional[CancelToken] = None
+) -> Response:
+    done = checkpoint.get(question.question) if checkpoint else None
+    if done:
+        logger.debug(f"Using checkpointed response for {label}")
+        return Response(question=done["question"], response=done["response"], key_points=done.get("key_points", []))
+    
+    raise_if_cancelled(cancel)
+    with llm_slots or nullcontext():
+        # Checked again after waiting for a slot, so a cancelled call hands the slot straight back
+        raise_if_cancelled(cancel)
+        logger.info(f"Generating response for {label}")
+        response = generate_response(
+            question=question.question,
+            knowledge_base=knowledge_base,
+            persona=persona,
+            client_type=client_type,
+            model=model,
+            kb_index=kb_index
+        )
+    if checkpoint and response and not response.failed:
+        checkpoint.record(response.dict())
+    return response
+
+def generate_responses(
+    questions: List[Question],
+    knowledge_base: str,
+    persona: str,
+    client_type: ClientType,
+    model: str,
+    max_concurrency: int = MAX_CONCURRENCY,
+    llm_slots: Optional[threading.Semaphore] = None,
+    kb_index: Optional[KnowledgeBaseIndex] = None,
+    checkpoint: Optional[ResponseCheckpoint] = None,
+    progress: Optional[ProgressCallback] = None,
+    cancel: Optional[CancelToken] = None
+) -> List[Response]:
+    """
+    Generate responses for a list of questions with at most max_concurrency calls in flight.
+    
+    Results are returned in the same order as the input questions. A max_concurrency
+    of 1 (or less) generates responses serially on the calling thread. When llm_slots
+    is given, every call also holds one slot of that shared semaphore, which bounds
+    the total number of LLM calls across client types processed in parallel.
+    With a checkpoint, questions it already holds are not sent to the model and every
+    new successful response is appended to it as soon as it finishes. progress, if given,
+    is called with a "response" event as each response completes. Once cancel is set,
+    pending responses are dropped and GenerationCancelled is raised.
+    """
+    completed = itertools.count(1)
+    
+    def _generate(indexed_question):
+        i, question = indexed_question
+        checkpointed = bool(checkpoint and checkpoint.get(question.question))
+        response = _checkpointed_response(
+            question, checkpoint, llm_slots, f"question {i+1}/{len(questions)}",
+            knowledge_base, persona, client_type, model, kb_index, cancel
+        )
+        if progress:
+            progress(
+                "response", client_type=client_type.client_type, done=next(completed), total=len(questions),
+                failed=response.failed, checkpointed=checkpointed
+            )
+        return response
+    
+    if max_concurrency <= 1 or len(questions) <= 1:
+        return [_generate(item) for item in enumerate(questions)]
+    
+    workers = min(max_concurrency, len(questions))
+    logger.debug(f"Generating {len(questions)} responses for '{client_type.client_type}' with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="creator") as executor:
+        futures = [executor.submit(_generate, item) for item in enumerate(questions)]
+        try:
+            # Results in submission order
+            return [future.result() for future in futures]
+        except GenerationCancelled:
+            for future in futures:
+                future.cancel()
+            raise
+
+def generate_questions_and_responses(
+    knowledge_base: str,
+    persona: str,
+    client_type: ClientType,
+    model: str,
+    num_questions: int,
+    max_concurrency: int = MAX_CONCURRENCY,
+    llm_slots: Optional[threading.Semaphore] = None,
+    kb_index: Optional[KnowledgeBaseIndex] = None,
+    question_knowledge_base: Optional[str] = None,
+    checkpoint: Optional[ResponseCheckpoint] = None,
+    progress: Optional[ProgressCallback] = None,
+    cancel: Optional[CancelToken] = None,
+    on_questions: Optional[Callable[[List[Question]], None]] = None
+) -> Tuple[List[Question], List[Response]]:
+    """
+    Pipelined question and response generation.
+    
+    Questions are streamed and each one is handed to the response pool as soon as it is
+    parsed, so the first answers are generated while the model is still writing the rest
+    of the questions. Short streams are padded with generic questions like
+    generate_questions. Returns ([], []) if no question could be generated.
+    
+    question_knowledge_base replaces knowledge_base (and disables kb_index) for question
+    generation, e.g. with a digest. progress, if given, gets a "question" event per parsed
+    question and a "response" event per completed response. on_questions is called with
+    the final question list as soon as the stream ends, before waiting on the responses,
+    so it can be checkpointed while answers are still being generated.
+    """
+    started = time.perf_counter()
+    questions: List[Question] = []
+    futures = []
+    first_answer = []
+    completed = itertools.count(1)
+    
+    def _generate(i, question):
+        checkpointed = bool(checkpoint and checkpoint.get(question.question))
+        response = _checkpointed_response(
+            question, checkpoint, llm_slots, f"streamed question {i+1}/{num_questions}",
+            knowledge_base, persona, client_type, model, kb_index, cancel
+        )
+        if not first_answer:
+            first_answer.append(time.perf_counter() - started)
+        if progress:
+            progress(
+                "response", client_type=client_type.client_type, done=next(completed), total=num_questions,
+                failed=response.failed, checkpointed=checkpointed
+            )
+        return response
+    
+    # One worker minimum so responses still overlap the question stream when max_concurrency is 1
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="creator") as executor:
+        def _dispatch(question):
+            futures.append(executor.submit(_generate, len(questions), question))
+            questions.append(question)
+            if progress:
+                progress("question", client_type=client_type.client_type, done=len(questions), total=num_questions)
+        
+        try:
+            try:
+                with llm_slots or nullcontext():
+                    raise_if_cancelled(cancel)
+                    for question in stream_questions(
+                        knowledge_base=question_knowledge_base or knowledge_base,
+                        persona=persona,
+                        client_type=client_type,
+                        model=model,
+                        num_questions=num_questions,
+                        kb_index=None if question_knowledge_base else kb_index
+                    ):
+                        _dispatch(question)
+                        raise_if_cancelled(cancel)
+            except GenerationCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"Question stream failed for {client_type.client_type} after {len(questions)} questions: {e}", exc_info=True)
+            
+            if not questions:
+                return [], []
+            
+            if len(questions) < num_questions:
+                logger.warning(f"Only streamed {len(questions)} questions, adding generic ones to reach {num_questions}")
+                for q in _generic_questions(client_type, num_questions - len(questions)):
+                    _dispatch(Question(q["question"], q["context"]))
+            
+            if on_questions:
+                on_questions(list(questions))
+            responses = [future.result() for future in futures]
+        except GenerationCancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    
+    if first_answer:
+        logger.info(f"First response for '{client_type.client_type}' after {min(first_answer):.2f}s, all {len(responses)} after {time.perf_counter() - started:.2f}s")
+    return questions, responses
+
 def process_client_type(
     knowledge_base: str,
     persona: str,
     client_type: ClientType,
     model: str,
     output_dir: Path,
-    questions_per_client: int = 10
+    questions_per_client: int = 10,
+    max_concurrency: int = MAX_CONCURRENCY,
+    llm_slots: Optional[threading.Semaphore] = None,
+    kb_index: Optional[KnowledgeBaseIndex] = None,
+    kb_digest: Optional[str] = None,
+    stream: bool = STREAM_QUESTIONS,
+    resume: bool = False,
+    progress: Optional[ProgressCallback] = None,
+    cancel: Optional[CancelToken] = None
 ) -> bool:
     try:
+        raise_if_cancelled(cancel)
         client_dir = output_dir / client_type.client_type
         os.makedirs(client_dir, exist_ok=True)
         
         with open(client_dir / "client_type.json", "w") as f:
             json.dump({"client_type": client_type.client_type, "description": client_type.description}, f, indent=2)
         
-        logger.info(f"Generating questions for client type: {client_type.client_type}")
-        
-        questions = generate_questions(
-            knowledge_base=knowledge_base,
-            persona=persona,
-            client_type=client_type,
-            model=model,
-            num_questions=questions_per_client
-        )
-        
-        if not questions:
-            logger.error(f"Failed to generate questions for client type: {client_type.client_type}")
-            return False
-        
-        logger.info(f"Generated {len(questions)} questions for client type: {client_type.client_type}")
-        
-        with open(client_dir / "questions.json", "w") as f:
-            json.dump([q.dict() for q in questions], f, indent=2)
-        
-        logger.info(f"Generating responses for client type: {client_type.client_type}")
-        
-        responses = []
-        for i, question in enumerate(questions):
-            logger.info(f"Generating response for question {i+1}/{len(questions)}")
-            
-            response = generate_response(
-                question=question.question,
+        checkpoint = ResponseCheckpoint(client_dir, resume=resume)
+        saved_questions = load_questions(client_dir) if resume else None
+        
+        if saved_questions:
+            questions = [Question(q.get("question", ""), q.get("context", "")) for q in saved_questions]
+            missing = sum(1 for q in questions if not checkpoint.get(q.question))
+            logger.info(f"Resuming '{client_type.client_type}': {len(questions) - missing}/{len(questions)} responses checkpointed")
+            if progress:
+                progress("questions", client_type=client_type.client_type, count=len(questions), checkpointed=True)
+            generated = generate_responses(
+                questions=questions,
+                knowledge_base=knowledge_base,
+                persona=persona,
+                client_type=client_type,
+                model=model,
+                max_concurrency=max_concurrency,
+                llm_slots=llm_slots,
+                kb_index=kb_index,
+                checkpoint=checkpoint,
+                progress=progress,
+                cancel=cancel
+            )
+        elif stream:
+            logger.info(f"Streaming questions and responses for client type: {client_type.client_type}")
+            questions, generated = generate_questions_and_responses(
                 knowledge_base=knowledge_base,
                 persona=persona,
                 client_type=client_type,
-                model=model
+                model=model,
+                num_questions=questions_per_client,
+                max_concurrency=max_concurrency,
+                llm_slots=llm_slots,
+                kb_index=kb_index,
+                question_knowledge_base=kb_digest,
+                checkpoint=checkpoint,
+                progress=progress,
+                cancel=cancel,
+                # Saved before the responses finish, so an interrupted run resumes with the same questions
+                on_questions=lambda streamed: save_questions(client_dir, [q.dict() for q in streamed])
             )
+            if not questions:
+                logger.error(f"Failed to generate questions for client type: {client_type.client_type}")
+                return False
+            if progress:
+                progress("questions", client_type=client_type.client_type, count=len(questions))
+        else:
+            logger.info(f"Generating questions for client type: {client_type.client_type}")
+            
+            with llm_slots or nullcontext():
+                raise_if_cancelled(cancel)
+                # A digest, when available, replaces the raw knowledge base for question generation
+                questions = generate_questions(
+                    knowledge_base=kb_digest or knowledge_base,
+                    persona=persona,
+                    client_type=client_type,
+                    model=model,
+                    num_questions=questions_per_client,
+                    kb_index=None if kb_digest else kb_index
+                )
+            
+            if not questions:
+                logger.error(f"Failed to generate questions for client type: {client_type.client_type}")
+                return False
+            
+            logger.info(f"Generated {len(questions)} questions for client type: {client_type.client_type}")
+            if progress:
+                progress("questions", client_type=client_type.client_type, count=len(questions))
+            
+            save_questions(client_dir, [q.dict() for q in questions])
+            
+            logger.info(f"Generating responses for client type: {client_type.client_type}")
             
+            generated = generate_responses(
+                questions=questions,
+                knowledge_base=knowledge_base,
+                persona=persona,
+                client_type=client_type,
+                model=model,
+                max_concurrency=max_concurrency,
+                llm_slots=llm_slots,
+                kb_index=kb_index,
+                checkpoint=checkpoint,
+                progress=progress,
+                cancel=cancel
+            )
+        
+        responses = []
+        for question, response in zip(questions, generated):
             if response:
                 responses.append(Response(question=question.question, response=response.response, key_points=response.key_points))
             else:
                 logger.warning(f"Failed to generate response for question: {question.question}")
         
         logger.info(f"Generated {len(responses)} responses for client type: {client_type.client_type}")
+        if progress:
+            progress("client_type_done", client_type=client_type.client_type, responses=len(responses))
         
         with open(client_dir / "responses.json", "w") as f:
             json.dump([r.dict() for r in responses], f, indent=2)
@@ -308,6 +643,9 @@ def process_client_type(
                 f.write("\n" + "-" * 80 + "\n\n")
         
         return True
+    except GenerationCancelled:
+        logger.info(f"Cancelled processing of client type {client_type.client_type}")
+        raise
     except Exception as e:
         logger.error(f"Failed to process client type {client_type.client_type}: {e}", exc_info=True)
         return False
@@ -399,10 +737,51 @@ def create_prompts(
     knowledge_base_path: str, 
     agent_persona_path: str, 
     questions_per_client: int = 5,
-    model: str = "gemini-2.0-flash",
+    model: str = GENERATION_MODEL,
     output_dir: Path = None,
-    username_for_logging: str = "api_user"
+    username_for_logging: str = "api_user",
+    max_concurrency: int = MAX_CONCURRENCY,
+    num_client_types: int = NUM_CLIENT_TYPES,
+    parallel_client_types: bool = PARALLEL_CLIENT_TYPES,
+    kb_mode: str = KB_CONTEXT_MODE,
+    digest_mode: str = KB_DIGEST_MODE,
+    stream: bool = STREAM_QUESTIONS,
+    resume: bool = False,
+    progress: Optional[ProgressCallback] = None,
+    cancel: Optional[CancelToken] = None
 ):
+    """
+    Identify client types and generate questions and responses for each of them.
+    
+    Args:
+        knowledge_base_path: Path to the parsed knowledge base markdown.
+        agent_persona_path: Path to the parsed agent persona markdown.
+        questions_per_client: Number of questions to generate per client type.
+        model: Gemini model used for all generation calls.
+        output_dir: Directory to write outputs to (defaults to prompts/<user>_<timestamp>).
+        username_for_logging: Username used in logs and final output file names.
+        max_concurrency: Maximum number of LLM calls in flight for the whole generation
+            when client types run in parallel, or per client type otherwise.
+        num_client_types: Number of client types to identify.
+        parallel_client_types: Process all client types concurrently, sharing one
+            max_concurrency budget for their LLM calls.
+        kb_mode: "full" to send the whole knowledge base with every question and response
+            call, or "bm25" to send only the most relevant sections.
+        digest_mode: "auto" uses a cached map-reduce digest of the knowledge base for client
+            type and question generation once it exceeds KB_DIGEST_THRESHOLD_CHARS, "always"
+            uses it for any size and "off" never does. Responses always use the source text.
+        stream: Stream question generation and start each response as soon as its
+            question has been parsed instead of waiting for the whole question list.
+        resume: Continue an interrupted generation in output_dir, reusing its checkpointed
+            client types, questions and responses and only issuing the missing LLM calls.
+        progress: Optional callback, called as progress(event, **data) from generation threads
+            for stage transitions, client types found, questions generated and responses done.
+        cancel: Optional CancelToken checked between LLM calls; once set, no further calls
+            are started and GenerationCancelled is raised.
+        
+    Returns:
+        List of ClientType objects with a questions attribute attached.
+    """
     try:
         logger.info(f"Starting prompt creation for user: {username_for_logging}")
         
@@ -421,16 +800,26 @@ def create_prompts(
         knowledge_base = read_content_file(knowledge_base_path)
         persona = read_content_file(agent_persona_path)
         
-        client = init_llm(GOOGLE_API_KEY)
+        raise_if_cancelled(cancel)
+        # One LLM concurrency budget for the digest and, when parallel, all client types
+        llm_slots = threading.BoundedSemaphore(max(max_concurrency, 1))
+        kb_digest = None
+        if should_use_digest(knowledge_base, digest_mode):
+            if progress:
+                progress("stage", stage="digest")
+            kb_digest = get_digest(
+                knowledge_base_path, knowledge_base, max_concurrency=max_concurrency, llm_slots=llm_slots, cancel=cancel
+            )
+        kb_overview = kb_digest or knowledge_base
         
         prompt = f"""
-        Based on the following knowledge base and agent persona information, identify exactly 2 distinct 
+        Based on the following knowledge base and agent persona information, identify exactly {num_client_types} distinct 
         client types that would use these financial services. For each client type, provide:
         1. A short identifier (2-3 words with underscores, e.g., "rookie_trader")
         2. A detailed description of this client type (150-200 words)
         
         Knowledge Base:
-        {knowledge_base}
+        {kb_overview}
         
         Agent Persona:
         {persona}
@@ -444,54 +833,92 @@ def create_prompts(
             {{
                 "client_type": "second_client_type",
                 "description": "Detailed description of second client type"
-            }}
+            }},
+            ...
         ]
         """
         
-        try:
-            logger.info("Generating client types...")
-            response = client.models.generate_content(
-                model=model,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.7,
-                    max_output_tokens=4096
-                )
-            )
-            
-            result = response.text.strip()
-            start_idx = result.find('[')
-            end_idx = result.rfind(']') + 1
+        checkpointed = load_client_types(output_dir) if resume else None
+        if checkpointed:
+            client_types_list = [ClientType(data.get("client_type", ""), data.get("description", "")) for data in checkpointed]
+            logger.info(f"Resuming with {len(client_types_list)} checkpointed client types")
+        else:
+            raise_if_cancelled(cancel)
+            try:
+                logger.info("Generating client types...")
+                if progress:
+                    progress("stage", stage="client_types")
+                result = generate_text(
+                    model=model,
+                    prompt=prompt,
+                    config={
+                        "temperature": 0.7,
+                        "max_output_tokens": 4096
+                    }
+                ).strip()
+                start_idx = result.find('[')
+                end_idx = result.rfind(']') + 1
             
-            if start_idx == -1 or end_idx == 0:
-                logger.error(f"Failed to extract JSON from response: {result}")
-                result = f'[{result}]'
-            else:
-                result = result[start_idx:end_idx]
+                if start_idx == -1 or end_idx == 0:
+                    logger.error(f"Failed to extract JSON from response: {result}")
+                    result = f'[{result}]'
+                else:
+                    result = result[start_idx:end_idx]
             
-            client_types_data = json.loads(result)
-            # Ensure we only have 2 client types
-            client_types_data = client_types_data[:2]
-            client_types_list = [ClientType(data.get("client_type", ""), data.get("description", "")) for data in client_types_data]
+                client_types_data = json.loads(result)
+                # Ensure we only have the requested number of client types
+                client_types_data = client_types_data[:num_client_types]
+                client_types_list = [ClientType(data.get("client_type", ""), data.get("description", "")) for data in client_types_data]
             
-            if not client_types_list:
-                logger.error("No client types were generated")
-                return []
+                if not client_types_list:
+                    logger.error("No client types were generated")
+                    return []
                 
-            logger.info(f"Successfully generated {len(client_types_list)} client types")
-        except Exception as e:
-            logger.error(f"Failed to generate client types: {e}", exc_info=True)
-            return []
+                logger.info(f"Successfully generated {len(client_types_list)} client types")
+                save_client_types(output_dir, [c.dict() for c in client_types_list])
+            except Exception as e:
+                logger.error(f"Failed to generate client types: {e}", exc_info=True)
+                return []
         
-        results = []
+        if progress:
+            progress(
+                "client_types", client_types=[c.client_type for c in client_types_list],
+                questions_per_client=questions_per_client, checkpointed=bool(checkpointed)
+            )
+            progress("stage", stage="questions_and_responses")
+        
+        kb_index = build_index(knowledge_base, kb_mode)
+        
+        valid_client_types = []
         for client_type_obj in client_types_list:
             if not hasattr(client_type_obj, 'client_type') or not hasattr(client_type_obj, 'description'):
                 logger.error(f"Invalid object in client_types_list: {client_type_obj}")
                 continue
-
-            success = process_client_type(
-                knowledge_base, persona, client_type_obj, model, output_dir, questions_per_client
-            )
+            valid_client_types.append(client_type_obj)
+        
+        if parallel_client_types and len(valid_client_types) > 1:
+            logger.info(f"Processing {len(valid_client_types)} client types in parallel with {max_concurrency} LLM slots")
+            with ThreadPoolExecutor(max_workers=len(valid_client_types), thread_name_prefix="client-type") as executor:
+                successes = list(executor.map(
+                    lambda client_type_obj: process_client_type(
+                        knowledge_base, persona, client_type_obj, model, output_dir, questions_per_client,
+                        max_concurrency=max_concurrency, llm_slots=llm_slots, kb_index=kb_index,
+                        kb_digest=kb_digest, stream=stream, resume=resume, progress=progress, cancel=cancel
+                    ),
+                    valid_client_types
+                ))
+        else:
+            successes = [
+                process_client_type(
+                    knowledge_base, persona, client_type_obj, model, output_dir, questions_per_client,
+                    max_concurrency=max_concurrency, kb_index=kb_index, kb_digest=kb_digest,
+                    stream=stream, resume=resume, progress=progress, cancel=cancel
+                )
+                for client_type_obj in valid_client_types
+            ]
+        
+        results = []
+        for client_type_obj, success in zip(valid_client_types, successes):
             results.append((client_type_obj.client_type, success))
             
             # Add questions attribute to client_type_obj for compatibility with the API
@@ -508,10 +935,19 @@ def create_prompts(
             status_msg = "Success" if success_status else "Failed"
             logger.info(f"Client type '{client_name}': {status_msg}")
         
+        if kb_index:
+            logger.info(f"Knowledge base retrieval stats: {kb_index.stats()}")
+        
         # Generate final output files
+        raise_if_cancelled(cancel)
+        if progress:
+            progress("stage", stage="formatting")
         format_final_outputs(output_dir, username_for_logging)
         
         return client_types_list
+    except GenerationCancelled:
+        logger.info(f"Prompt creation cancelled for user: {username_for_logging}")
+        raise
     except Exception as e:
         logger.error(f"Failed to create prompts: {e}", exc_info=True)
         raise
@@ -523,8 +959,19 @@ if __name__ == "__main__":
     parser.add_argument("--questions", type=int, default=10, help="Number of questions per client type.")
     parser.add_argument("--output_dir", type=str, help="Directory to save prompts to.")
     parser.add_argument("--log_user", type=str, default="script_user", help="Username for logging.")
+    parser.add_argument("--kb_mode", type=str, default=KB_CONTEXT_MODE, choices=["full", "bm25"], help="Send the full knowledge base or only relevant sections.")
+    parser.add_argument("--digest_mode", type=str, default=KB_DIGEST_MODE, choices=["off", "auto", "always"], help="When to use a knowledge base digest for client type and question generation.")
+    parser.add_argument("--stream", action="store_true", default=STREAM_QUESTIONS, help="Stream questions and start responses as each question arrives.")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted generation in --output_dir, skipping completed work.")
+    parser.add_argument("--backend", type=str, default=LLM_BACKEND, choices=["gemini", "fake"], help="LLM backend to use.")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY, help="Maximum concurrent response generations per client type (1 = serial).")
+    parser.add_argument("--client_types", type=int, default=NUM_CLIENT_TYPES, help="Number of client types to identify.")
+    parser.add_argument("--parallel_client_types", action="store_true", default=PARALLEL_CLIENT_TYPES, help="Process client types concurrently, sharing the --concurrency budget.")
 
     args = parser.parse_args()
+    if args.resume and not args.output_dir:
+        parser.error("--resume requires --output_dir")
+    set_backend(args.backend)
     
     output_dir_path = Path(args.output_dir) if args.output_dir else None
     
@@ -532,9 +979,16 @@ if __name__ == "__main__":
         args.kb_path, 
         args.persona_path, 
         args.questions, 
-        model="gemini-2.0-flash",
+        model=GENERATION_MODEL,
         output_dir=output_dir_path,
-        username_for_logging=args.log_user
+        username_for_logging=args.log_user,
+        max_concurrency=args.concurrency,
+        num_client_types=args.client_types,
+        parallel_client_types=args.parallel_client_types,
+        kb_mode=args.kb_mode,
+        digest_mode=args.digest_mode,
+        stream=args.stream,
+        resume=args.resume
     )
     
     if not generated_client_types:
@@ -1,43 +1,196 @@
 import os
+import json
 import uuid
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from contextlib import contextmanager
 from dotenv import load_dotenv
 from pathlib import Path
 
+from .scheduler import fair_tags, SCHEDULER_MAX_JOBS_PER_USER
+from .stats import stats_cache
+
 # Load environment variables
 load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
 
-# Database path
-DATABASE_PATH = Path(__file__).parent.parent / "data" / "bfsi_bot.db"
+# Database path (workers on other nodes point this at the shared database file)
+DATABASE_PATH = Path(os.getenv("DATABASE_PATH", str(Path(__file__).parent.parent / "data" / "bfsi_bot.db")))
 
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections."""
-    conn = None
-    try:
+# Attempts a job gets before it is marked failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Journal mode: WAL lets readers run alongside the writer; use DELETE when workers on other
+# hosts share the file over a network filesystem, where WAL's shared memory does not work
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "wal").upper()
+# NORMAL is durable across application crashes in WAL mode and skips an fsync per commit
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "normal").upper()
+# Page cache per connection (KiB) and memory-mapped I/O size (bytes)
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+# How long a writer waits for the lock before "database is locked"
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+
+class ConnectionPool:
+    """
+    One reusable sqlite3 connection per thread.
+
+    Each thread keeps its connection and skips the open, schema read and pragma setup on
+    every helper call. Short-lived threads (per-call pools in the creator and digest) exit
+    with theirs still registered, so connections of exited threads are closed whenever a
+    new one is opened. A connection is handed out again only after the previous user
+    returned it with no open transaction; a nested checkout on the same thread (a helper
+    called while another holds the thread's connection) gets a temporary connection so it
+    cannot commit or roll back the outer transaction.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "reused": 0, "dedicated": 0, "closed": 0}
+
+    def _connect(self) -> sqlite3.Connection:
         # Ensure data directory exists
         DATABASE_PATH.parent.mkdir(parents=True, exist_ok=True)
         
-        # Connect to SQLite database
-        conn = sqlite3.connect(str(DATABASE_PATH))
+        # close_idle closes connections from the shutdown thread; a connection is still
+        # only used by one thread at a time.
+        conn = sqlite3.connect(str(DATABASE_PATH), check_same_thread=False, timeout=DB_BUSY_TIMEOUT_MS / 1000)
         
         # Enable dictionary cursor
         conn.row_factory = sqlite3.Row
         
-        yield conn
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        raise e
-    finally:
-        if conn:
+        conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self._stats["opened"] += 1
+        return conn
+
+    @contextmanager
+    def dedicated(self):
+        """A connection of its own, closed on exit; may be released from another thread."""
+        conn = self._connect()
+        with self._lock:
+            self._stats["dedicated"] += 1
+        try:
+            yield conn
+        finally:
             conn.close()
+            with self._lock:
+                self._stats["closed"] += 1
+
+    @contextmanager
+    def connection(self):
+        if getattr(self._local, "in_use", False):
+            with self.dedicated() as conn:
+                yield conn
+            return
+
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.path != DATABASE_PATH:
+            # DATABASE_PATH was repointed (benchmarks, tests); drop the old file's connection
+            with self._lock:
+                self._connections.pop(threading.get_ident(), None)
+                self._stats["closed"] += 1
+            conn.close()
+            conn = None
+        if conn is None:
+            # Anything registered under this thread's id was left by an exited thread it was reused from
+            self._close_exited(include_current=True)
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.path = DATABASE_PATH
+            with self._lock:
+                self._connections[threading.get_ident()] = conn
+        else:
+            with self._lock:
+                self._stats["reused"] += 1
+        self._local.in_use = True
+        try:
+            yield conn
+        finally:
+            self._local.in_use = False
+            # Closing used to discard uncommitted work; keep that behaviour for the next user
+            if conn.in_transaction:
+                conn.rollback()
+
+    def _close_exited(self, include_current=False):
+        """Close connections of threads that have exited, plus this thread's with include_current."""
+        alive = {thread.ident for thread in threading.enumerate()}
+        if include_current:
+            alive.discard(threading.get_ident())
+        with self._lock:
+            stale = [ident for ident in self._connections if ident not in alive]
+            conns = [self._connections.pop(ident) for ident in stale]
+            self._stats["closed"] += len(conns)
+        for conn in conns:
+            conn.close()
+
+    def close_idle(self):
+        """Close connections of threads that have exited, plus this thread's if it is idle."""
+        idle = not getattr(self._local, "in_use", False) and getattr(self._local, "conn", None) is not None
+        self._close_exited(include_current=idle)
+        if idle:
+            self._local.conn = None
+
+    def stats(self):
+        alive = {thread.ident for thread in threading.enumerate()}
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = sum(1 for ident in self._connections if ident in alive)
+        stats["journal_mode"] = DB_JOURNAL_MODE.lower()
+        return stats
+
+
+_pool = ConnectionPool()
+
+
+@contextmanager
+def get_db_connection():
+    """Context manager for database connections (this thread's pooled connection)."""
+    with _pool.connection() as conn:
+        try:
+            yield conn
+        except Exception as e:
+            conn.rollback()
+            raise e
+
+def db_pool_stats():
+    """Connections opened, reused and open now, for /health."""
+    return _pool.stats()
+
+def close_db_connections():
+    _pool.close_idle()
+
+def _stats_changed(user_id):
+    """Note a write to user_id's rows (None: any user's); their cached /stats is dropped once it commits."""
+    pending = getattr(_pool._local, "stats_changed", None)
+    if pending is None:
+        pending = _pool._local.stats_changed = set()
+    pending.add(user_id)
+
+def _flush_stats_changed(committed):
+    pending = getattr(_pool._local, "stats_changed", None)
+    if not pending:
+        return
+    _pool._local.stats_changed = set()
+    if committed:
+        for user_id in pending:
+            stats_cache.invalidate(user_id)
 
 @contextmanager
 def get_db_cursor():
-    """Context manager for database cursors with automatic commit/rollback."""
+    """Context manager for database cursors with automatic commit/rollback (deferred to an enclosing unit_of_work)."""
+    unit = getattr(_pool._local, "unit_cursor", None)
+    if unit is not None:
+        yield unit
+        return
     with get_db_connection() as conn:
         cursor = conn.cursor()
         try:
@@ -45,95 +198,295 @@ def get_db_cursor():
             conn.commit()
         except Exception as e:
             conn.rollback()
+            _flush_stats_changed(False)
             raise e
+    _flush_stats_changed(True)
+
+@contextmanager
+def unit_of_work():
+    """
+    Run several write helpers in one transaction on this thread.
 
-# FastAPI dependency
-def get_db():
-    """Dependency for FastAPI to get a database connection."""
+    Every helper that uses get_db_cursor inside the block joins the transaction, which is
+    committed once at the end or rolled back entirely on an exception. A nested block joins
+    the outer one. Helpers that open their own connection (the job queue functions) must not
+    be called inside, as they would wait on this transaction's write lock.
+    """
+    if getattr(_pool._local, "unit_cursor", None) is not None:
+        yield _pool._local.unit_cursor
+        return
     with get_db_connection() as conn:
-        yield conn
+        # Take the write lock up front; upgrading a read transaction can fail instead of waiting
+        conn.execute("BEGIN IMMEDIATE")
+        _pool._local.unit_cursor = conn.cursor()
+        try:
+            yield _pool._local.unit_cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            _flush_stats_changed(False)
+            raise
+        finally:
+            _pool._local.unit_cursor = None
+    _flush_stats_changed(True)
 
-# Database initialization with table creation functions
-def create_users_table():
+# Database initialization with table creation functions, applied through MIGRATIONS
+def create_users_table(cursor):
     """Create users table if it doesn't exist."""
-    with get_db_cursor() as cursor:
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            is_active INTEGER DEFAULT 1,
-            api_key TEXT UNIQUE NOT NULL
-        )
-        """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        is_active INTEGER DEFAULT 1,
+        api_key TEXT UNIQUE NOT NULL
+    )
+    """)
 
-def create_documents_table():
+def create_documents_table(cursor):
     """Create documents table if it doesn't exist."""
-    with get_db_cursor() as cursor:
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER REFERENCES users(id),
-            filename TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            document_type TEXT NOT NULL,
-            uploaded_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            processed INTEGER DEFAULT 0,
-            processed_at TEXT,
-            content_preview TEXT,
-            output_path TEXT,
-            processing_error TEXT
-        )
-        """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users(id),
+        filename TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        document_type TEXT NOT NULL,
+        uploaded_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        processed INTEGER DEFAULT 0,
+        processed_at TEXT,
+        content_preview TEXT,
+        output_path TEXT,
+        processing_error TEXT
+    )
+    """)
+    # SHA-256 of the parsed content, filled in on first use by bot.reuse
+    _add_missing_columns(cursor, "documents", {"content_hash": "TEXT"})
 
-def create_generations_table():
+def create_generations_table(cursor):
     """Create generations table if it doesn't exist."""
-    with get_db_cursor() as cursor:
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS generations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users(id),
+        knowledge_base_id INTEGER REFERENCES documents(id),
+        agent_persona_id INTEGER REFERENCES documents(id),
+        status TEXT DEFAULT 'pending',
+        started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        completed_at TEXT,
+        client_types_count INTEGER DEFAULT 0,
+        questions_count INTEGER DEFAULT 0,
+        questions_per_client INTEGER DEFAULT 50,
+        output_directory TEXT,
+        error_message TEXT,
+        analysis_path TEXT,
+        analysis_completed INTEGER DEFAULT 0,
+        analysis_completed_at TEXT,
+        analysis_error TEXT
+    )
+    """)
+    # Progress and scheduling columns, added in place on databases created before they existed
+    _add_missing_columns(cursor, "generations", GENERATION_PROGRESS_COLUMNS)
+    _add_missing_columns(cursor, "generations", {"priority": "TEXT DEFAULT 'normal'"})
+    # Identical requests share a signature (see bot.reuse); clones point at their source
+    _add_missing_columns(cursor, "generations", {"request_signature": "TEXT", "cloned_from": "INTEGER"})
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_generations_signature ON generations(request_signature, status)
+    """)
+
+# Live progress of a running generation, written in batches by bot.progress
+GENERATION_PROGRESS_COLUMNS = {
+    "planned_calls": "INTEGER DEFAULT 0",
+    "completed_calls": "INTEGER DEFAULT 0",
+    "current_stage": "TEXT",
+    "avg_seconds_per_call": "REAL",
+    "eta_seconds": "REAL",
+    "progress_updated_at": "TEXT",
+}
+
+def _add_missing_columns(cursor, table, columns):
+    """ALTER TABLE ADD COLUMN for each of columns (name -> definition) the table lacks."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row["name"] for row in cursor.fetchall()}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def create_client_types_table(cursor):
+    """Create client_types table if it doesn't exist."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS client_types (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        generation_id INTEGER REFERENCES generations(id),
+        name TEXT NOT NULL,
+        description TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        question_count INTEGER DEFAULT 0,
+        output_file TEXT
+    )
+    """)
+
+def create_jobs_table(cursor):
+    """Create jobs table (durable work queue) if it doesn't exist."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT DEFAULT 'queued',
+        attempts INTEGER DEFAULT 0,
+        max_attempts INTEGER DEFAULT 3,
+        run_after TEXT NOT NULL,
+        lease_owner TEXT,
+        lease_expires_at TEXT,
+        heartbeat_at TEXT,
+        last_error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        started_at TEXT,
+        completed_at TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after)
+    """)
+    # Fair scheduling: owner, priority and start/finish tags (see scheduler.fair_tags)
+    _add_missing_columns(cursor, "jobs", JOB_SCHEDULING_COLUMNS)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON jobs(user_id, vfinish)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_vstart ON jobs(vstart)
+    """)
+
+JOB_SCHEDULING_COLUMNS = {
+    "user_id": "INTEGER",
+    "priority": "TEXT DEFAULT 'normal'",
+    "vstart": "REAL DEFAULT 0",
+    "vfinish": "REAL DEFAULT 0",
+}
+
+def create_idempotency_keys_table(cursor):
+    """Create idempotency_keys table (Idempotency-Key header -> generation) if it doesn't exist."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        idempotency_key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        generation_id INTEGER REFERENCES generations(id),
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, idempotency_key)
+    )
+    """)
+
+def create_tables(cursor):
+    """Base schema. Idempotent, so it also brings databases created before migrations up to date."""
+    create_users_table(cursor)
+    create_documents_table(cursor)
+    create_generations_table(cursor)
+    create_client_types_table(cursor)
+    create_jobs_table(cursor)
+    create_idempotency_keys_table(cursor)
+
+def create_lookup_indexes(cursor):
+    """Indexes for the per-user list queries and per-generation lookups."""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_documents_user_type ON documents(user_id, document_type)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_generations_user_started ON generations(user_id, started_at)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_generations_status ON generations(status)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_client_types_generation ON client_types(generation_id)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_idempotency_keys_generation ON idempotency_keys(generation_id)
+    """)
+
+def create_pagination_indexes(cursor):
+    """Indexes that return a user's rows in id order, so list pages are read straight off the index."""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_documents_user ON documents(user_id)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_generations_user_status ON generations(user_id, status)
+    """)
+    # Replaces (user_id, started_at): lists page by id now, which only (user_id) keeps in order
+    cursor.execute("""
+    DROP INDEX IF EXISTS idx_generations_user_started
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_generations_user ON generations(user_id)
+    """)
+
+def restore_started_index(cursor):
+    """Bring back (user_id, started_at), dropped by migration 3, for queries that filter or order by start time."""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_generations_user_started ON generations(user_id, started_at)
+    """)
+
+# Schema migrations in order: (version, name, function(cursor)). Append new ones; never edit applied ones.
+MIGRATIONS = [
+    (1, "base tables", create_tables),
+    (2, "lookup indexes", create_lookup_indexes),
+    (3, "pagination indexes", create_pagination_indexes),
+    (4, "restore user started_at index", restore_started_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate(conn):
+    """
+    Apply migrations newer than the database's schema version, in one transaction.
+
+    BEGIN IMMEDIATE takes the write lock first, so an API process and workers starting
+    together run each migration once. Returns the versions applied.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
         cursor.execute("""
-        CREATE TABLE IF NOT EXISTS generations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER REFERENCES users(id),
-            knowledge_base_id INTEGER REFERENCES documents(id),
-            agent_persona_id INTEGER REFERENCES documents(id),
-            status TEXT DEFAULT 'pending',
-            started_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            completed_at TEXT,
-            client_types_count INTEGER DEFAULT 0,
-            questions_count INTEGER DEFAULT 0,
-            questions_per_client INTEGER DEFAULT 50,
-            output_directory TEXT,
-            error_message TEXT,
-            analysis_path TEXT,
-            analysis_completed INTEGER DEFAULT 0,
-            analysis_completed_at TEXT,
-            analysis_error TEXT
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
         )
         """)
+        current = cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+        applied = []
+        for version, name, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            apply(cursor)
+            cursor.execute("""
+            INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)
+            """, (version, name, datetime.utcnow().isoformat()))
+            applied.append(version)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if applied:
+        # Refresh the query planner's statistics for the new indexes
+        conn.execute("PRAGMA optimize")
+    return applied
 
-def create_client_types_table():
-    """Create client_types table if it doesn't exist."""
+def get_schema_version():
     with get_db_cursor() as cursor:
         cursor.execute("""
-        CREATE TABLE IF NOT EXISTS client_types (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            generation_id INTEGER REFERENCES generations(id),
-            name TEXT NOT NULL,
-            description TEXT NOT NULL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            question_count INTEGER DEFAULT 0,
-            output_file TEXT
-        )
+        SELECT COALESCE(MAX(version), 0) FROM schema_migrations
         """)
+        return cursor.fetchone()[0]
 
 def init_db():
-    """Initialize the database by creating all tables."""
-    create_users_table()
-    create_documents_table()
-    create_generations_table()
-    create_client_types_table()
-    print("Database tables created.")
+    """Initialize the database by applying pending schema migrations."""
+    with get_db_connection() as conn:
+        applied = migrate(conn)
+    print(f"Database schema at version {SCHEMA_VERSION}" + (f" (applied {applied})" if applied else ""))
 
 # User operations
 def create_user(username, email, password_hash):
@@ -143,17 +496,8 @@ def create_user(username, email, password_hash):
         cursor.execute("""
         INSERT INTO users (username, email, password_hash, api_key)
         VALUES (?, ?, ?, ?)
+        RETURNING id, username, email, created_at, is_active, api_key
         """, (username, email, password_hash, api_key))
-        
-        # Get the last inserted id
-        cursor.execute("SELECT last_insert_rowid()")
-        user_id = cursor.fetchone()[0]
-        
-        # Get the new user data
-        cursor.execute("""
-        SELECT id, username, email, created_at, is_active, api_key
-        FROM users WHERE id = ?
-        """, (user_id,))
         return dict(cursor.fetchone())
 
 def get_user_by_username(username):
@@ -191,17 +535,9 @@ def create_document(user_id, filename, file_path, document_type):
         cursor.execute("""
         INSERT INTO documents (user_id, filename, file_path, document_type, uploaded_at)
         VALUES (?, ?, ?, ?, ?)
+        RETURNING id, user_id, filename, file_path, document_type, uploaded_at, processed, processed_at, content_preview
         """, (user_id, filename, file_path, document_type, now))
-        
-        # Get the last inserted id
-        cursor.execute("SELECT last_insert_rowid()")
-        doc_id = cursor.fetchone()[0]
-        
-        # Get the new document data
-        cursor.execute("""
-        SELECT id, user_id, filename, file_path, document_type, uploaded_at, processed, processed_at, content_preview
-        FROM documents WHERE id = ?
-        """, (doc_id,))
+        _stats_changed(user_id)
         return dict(cursor.fetchone())
 
 def get_document(document_id, user_id=None):
@@ -218,18 +554,63 @@ def get_document(document_id, user_id=None):
         result = cursor.fetchone()
         return dict(result) if result else None
 
-def get_documents_by_user(user_id, document_type=None):
-    """Get all documents for a user, optionally filtering by type."""
+def _select_columns(cursor, table, fields):
+    """SELECT list for fields (all columns when None); id is always included as the page key."""
+    if not fields:
+        return "*"
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = {row["name"] for row in cursor.fetchall()}
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f"Unknown {table} fields: {', '.join(unknown)}")
+    return ", ".join(["id"] + [field for field in dict.fromkeys(fields) if field != "id"])
+
+def _keyset_page(cursor, table, columns, where, params, limit, after, order):
+    """
+    One page of rows matching where, ordered by id, starting after the id `after`.
+
+    Seeking past the last id seen reads only the rows on the page, unlike OFFSET, which
+    reads and discards every row before it.
+    """
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Invalid order: {order}")
+    if after is not None:
+        where = where + [f"id {'<' if order == 'desc' else '>'} ?"]
+        params = params + [after]
+    query = f"SELECT {columns} FROM {table} WHERE {' AND '.join(where)} ORDER BY id {order.upper()}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params = params + [limit]
+    cursor.execute(query, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+def _document_filters(user_id, document_type=None, processed=None):
+    where, params = ["user_id = ?"], [user_id]
+    if document_type:
+        where.append("document_type = ?")
+        params.append(document_type)
+    if processed is not None:
+        where.append("processed = ?")
+        params.append(1 if processed else 0)
+    return where, params
+
+def get_documents_by_user(user_id, document_type=None, processed=None, limit=None, after=None, order="desc", fields=None):
+    """
+    Get a user's documents, newest first unless order="asc", optionally filtered by type and
+    processed state. limit and after (the last id of the previous page) page through them;
+    fields limits the columns returned.
+    """
+    where, params = _document_filters(user_id, document_type, processed)
     with get_db_cursor() as cursor:
-        if document_type:
-            cursor.execute("""
-            SELECT * FROM documents WHERE user_id = ? AND document_type = ?
-            """, (user_id, document_type))
-        else:
-            cursor.execute("""
-            SELECT * FROM documents WHERE user_id = ?
-            """, (user_id,))
-        return [dict(row) for row in cursor.fetchall()]
+        columns = _select_columns(cursor, "documents", fields)
+        return _keyset_page(cursor, "documents", columns, where, params, limit, after, order)
+
+def count_documents_by_user(user_id, document_type=None, processed=None):
+    """Number of a user's documents matching the get_documents_by_user filters."""
+    where, params = _document_filters(user_id, document_type, processed)
+    with get_db_cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM documents WHERE {' AND '.join(where)}", params)
+        return cursor.fetchone()[0]
 
 def update_document_processed(document_id, output_path, content_preview=None):
     """Update a document's processed status."""
@@ -239,15 +620,20 @@ def update_document_processed(document_id, output_path, content_preview=None):
         UPDATE documents 
         SET processed = 1, processed_at = ?, output_path = ?, content_preview = ?
         WHERE id = ?
+        RETURNING *
         """, (now, output_path, content_preview, document_id))
-        
-        # Get the updated document
-        cursor.execute("""
-        SELECT * FROM documents WHERE id = ?
-        """, (document_id,))
         result = cursor.fetchone()
+        if result:
+            _stats_changed(result['user_id'])
         return dict(result) if result else None
 
+def set_document_content_hash(document_id, content_hash):
+    """Store the hash of a document's parsed content."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        UPDATE documents SET content_hash = ? WHERE id = ?
+        """, (content_hash, document_id))
+
 def update_document_error(document_id, error_message):
     """Update a document with processing error."""
     with get_db_cursor() as cursor:
@@ -255,56 +641,49 @@ def update_document_error(document_id, error_message):
         UPDATE documents 
         SET processing_error = ?
         WHERE id = ?
+        RETURNING *
         """, (error_message, document_id))
-        
-        # Get the updated document
-        cursor.execute("""
-        SELECT * FROM documents WHERE id = ?
-        """, (document_id,))
         result = cursor.fetchone()
+        if result:
+            _stats_changed(result['user_id'])
         return dict(result) if result else None
 
 def delete_document(document_id, user_id):
     """Delete a document by ID and user_id."""
     with get_db_cursor() as cursor:
-        # Get the document first
-        cursor.execute("""
-        SELECT * FROM documents
-        WHERE id = ? AND user_id = ?
-        """, (document_id, user_id))
-        result = cursor.fetchone()
-        
-        if not result:
-            return None
-            
-        # Then delete it
         cursor.execute("""
         DELETE FROM documents
         WHERE id = ? AND user_id = ?
+        RETURNING *
         """, (document_id, user_id))
-        
-        return dict(result)
+        result = cursor.fetchone()
+        if result:
+            _stats_changed(result['user_id'])
+        return dict(result) if result else None
 
 # Generation operations
-def create_generation(user_id, knowledge_base_id, agent_persona_id, questions_per_client, output_directory):
-    """Create a new generation record."""
+def create_generation(user_id, knowledge_base_id, agent_persona_id, questions_per_client, output_directory, priority="normal",
+                      request_signature=None, idempotency_key=None, request_hash=None):
+    """
+    Create a new generation record.
+    
+    With idempotency_key the key is recorded in the same transaction, so a concurrent request
+    with the same key fails with sqlite3.IntegrityError instead of creating a second generation.
+    """
     now = datetime.utcnow().isoformat()
     with get_db_cursor() as cursor:
         cursor.execute("""
         INSERT INTO generations 
-        (user_id, knowledge_base_id, agent_persona_id, questions_per_client, output_directory, status, started_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, knowledge_base_id, agent_persona_id, questions_per_client, output_directory, 'pending', now))
-        
-        # Get the last inserted id
-        cursor.execute("SELECT last_insert_rowid()")
-        gen_id = cursor.fetchone()[0]
+        (user_id, knowledge_base_id, agent_persona_id, questions_per_client, output_directory, status, started_at, priority, request_signature)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING *
+        """, (user_id, knowledge_base_id, agent_persona_id, questions_per_client, output_directory, 'pending', now, priority, request_signature))
+        generation = dict(cursor.fetchone())
+        _stats_changed(user_id)
         
-        # Get the new generation data
-        cursor.execute("""
-        SELECT * FROM generations WHERE id = ?
-        """, (gen_id,))
-        return dict(cursor.fetchone())
+        if idempotency_key:
+            _record_idempotency_key(cursor, user_id, idempotency_key, request_hash, generation['id'])
+        return generation
 
 def update_generation_status(generation_id, status, error_message=None):
     """Update a generation's status."""
@@ -315,27 +694,38 @@ def update_generation_status(generation_id, status, error_message=None):
             UPDATE generations 
             SET status = ?, completed_at = ?
             WHERE id = ?
+            RETURNING *
             """, (status, now, generation_id))
         elif status == 'failed':
             cursor.execute("""
             UPDATE generations 
             SET status = ?, error_message = ?
             WHERE id = ?
+            RETURNING *
             """, (status, error_message, generation_id))
         else:
             cursor.execute("""
             UPDATE generations 
             SET status = ?
             WHERE id = ?
+            RETURNING *
             """, (status, generation_id))
-        
-        # Get the updated generation
-        cursor.execute("""
-        SELECT * FROM generations WHERE id = ?
-        """, (generation_id,))
         result = cursor.fetchone()
+        if result:
+            _stats_changed(result['user_id'])
         return dict(result) if result else None
 
+def update_generation_progress(generation_id, planned_calls, completed_calls, current_stage, avg_seconds_per_call=None, eta_seconds=None):
+    """Store a generation's progress snapshot."""
+    now = datetime.utcnow().isoformat()
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        UPDATE generations 
+        SET planned_calls = ?, completed_calls = ?, current_stage = ?,
+            avg_seconds_per_call = ?, eta_seconds = ?, progress_updated_at = ?
+        WHERE id = ?
+        """, (planned_calls, completed_calls, current_stage, avg_seconds_per_call, eta_seconds, now, generation_id))
+
 def update_generation_counts(generation_id, client_types_count, questions_count):
     """Update a generation's counts."""
     with get_db_cursor() as cursor:
@@ -343,13 +733,11 @@ def update_generation_counts(generation_id, client_types_count, questions_count)
         UPDATE generations 
         SET client_types_count = ?, questions_count = ?
         WHERE id = ?
+        RETURNING *
         """, (client_types_count, questions_count, generation_id))
-        
-        # Get the updated generation
-        cursor.execute("""
-        SELECT * FROM generations WHERE id = ?
-        """, (generation_id,))
         result = cursor.fetchone()
+        if result:
+            _stats_changed(result['user_id'])
         return dict(result) if result else None
 
 def get_generation(generation_id, user_id=None):
@@ -370,41 +758,273 @@ def get_generation(generation_id, user_id=None):
         result = cursor.fetchone()
         return dict(result) if result else None
 
-def get_generations_by_user(user_id):
-    """Get all generations for a user."""
+def _generation_filters(user_id, statuses=None, analysis_completed=None):
+    where, params = ["user_id = ?"], [user_id]
+    if statuses:
+        where.append(f"status IN ({', '.join('?' for _ in statuses)})")
+        params.extend(statuses)
+    if analysis_completed is not None:
+        where.append("analysis_completed = ?")
+        params.append(1 if analysis_completed else 0)
+    return where, params
+
+def get_generations_by_user(user_id, statuses=None, analysis_completed=None, limit=None, after=None, order="desc", fields=None):
+    """
+    Get a user's generations, newest first unless order="asc", optionally filtered to some
+    statuses or by analysis state. Paged and narrowed like get_documents_by_user.
+    """
+    where, params = _generation_filters(user_id, statuses, analysis_completed)
+    with get_db_cursor() as cursor:
+        columns = _select_columns(cursor, "generations", fields)
+        return _keyset_page(cursor, "generations", columns, where, params, limit, after, order)
+
+def count_generations_by_user(user_id, statuses=None, analysis_completed=None):
+    """Number of a user's generations matching the get_generations_by_user filters."""
+    where, params = _generation_filters(user_id, statuses, analysis_completed)
+    with get_db_cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM generations WHERE {' AND '.join(where)}", params)
+        return cursor.fetchone()[0]
+
+def get_user_stats(user_id):
+    """
+    Dashboard aggregates of a user's documents and generations, one GROUP BY query per table.
+
+    Average duration covers completed generations that ran (not clones); the analysis
+    completion rate is the share of completed generations with a finished analysis.
+    """
     with get_db_cursor() as cursor:
         cursor.execute("""
-        SELECT * FROM generations WHERE user_id = ?
+        SELECT document_type, COUNT(*) AS total, SUM(processed = 1) AS processed,
+               SUM(processed = 0 AND processing_error IS NOT NULL) AS failed
+        FROM documents WHERE user_id = ?
+        GROUP BY document_type
         """, (user_id,))
-        return [dict(row) for row in cursor.fetchall()]
+        documents = {"total": 0, "processed": 0, "pending": 0, "failed": 0, "by_type": {}}
+        for row in cursor.fetchall():
+            counts = {"total": row['total'], "processed": row['processed'], "failed": row['failed'],
+                      "pending": row['total'] - row['processed'] - row['failed']}
+            documents['by_type'][row['document_type']] = counts
+            for key, value in counts.items():
+                documents[key] += value
+        
+        cursor.execute("""
+        SELECT status, COUNT(*) AS total,
+               COALESCE(SUM(questions_count), 0) AS questions,
+               COALESCE(SUM(client_types_count), 0) AS client_types,
+               COALESCE(SUM(analysis_completed), 0) AS analyses,
+               SUM(duration) AS duration_sum, COUNT(duration) AS duration_count
+        FROM (
+            SELECT status, questions_count, client_types_count, analysis_completed,
+                   CASE WHEN status = 'completed' AND cloned_from IS NULL AND completed_at IS NOT NULL
+                        THEN (julianday(completed_at) - julianday(started_at)) * 86400 END AS duration
+            FROM generations WHERE user_id = ?
+        )
+        GROUP BY status
+        """, (user_id,))
+        rows = cursor.fetchall()
+    
+    by_status = {row['status']: row['total'] for row in rows}
+    completed = by_status.get('completed', 0)
+    analyses = sum(row['analyses'] for row in rows)
+    duration_count = sum(row['duration_count'] for row in rows)
+    generations = {
+        "total": sum(by_status.values()),
+        "by_status": by_status,
+        "questions_total": sum(row['questions'] for row in rows),
+        "client_types_total": sum(row['client_types'] for row in rows),
+        "average_duration_seconds": round(sum(row['duration_sum'] or 0 for row in rows) / duration_count, 1) if duration_count else None,
+        "analyses_completed": analyses,
+        "analysis_completion_rate": round(analyses / completed, 3) if completed else None,
+    }
+    return {"documents": documents, "generations": generations}
+
+def _record_idempotency_key(cursor, user_id, idempotency_key, request_hash, generation_id):
+    cursor.execute("""
+    INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash, generation_id, created_at)
+    VALUES (?, ?, ?, ?, ?)
+    """, (user_id, idempotency_key, request_hash, generation_id, datetime.utcnow().isoformat()))
+
+def get_idempotency_key(user_id, idempotency_key, ttl_seconds):
+    """The stored request for a user's Idempotency-Key, or None; keys older than ttl_seconds are deleted."""
+    cutoff = (datetime.utcnow() - timedelta(seconds=ttl_seconds)).isoformat()
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        DELETE FROM idempotency_keys WHERE created_at < ?
+        """, (cutoff,))
+        cursor.execute("""
+        SELECT * FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?
+        """, (user_id, idempotency_key))
+        result = cursor.fetchone()
+        return dict(result) if result else None
+
+def find_reusable_generation(request_signature, exclude_output_directory=None):
+    """
+    Most recent completed generation with the same request signature and an output directory, or None.
+    
+    Original generations are preferred over clones; exclude_output_directory skips the one a
+    clone would be written to.
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        SELECT * FROM generations
+        WHERE request_signature = ? AND status = 'completed' AND output_directory IS NOT NULL
+          AND output_directory != COALESCE(?, '')
+        ORDER BY cloned_from IS NOT NULL, completed_at DESC LIMIT 1
+        """, (request_signature, exclude_output_directory))
+        result = cursor.fetchone()
+        return dict(result) if result else None
+
+def create_cloned_generation(source, user_id, knowledge_base_id, agent_persona_id, output_directory, analysis_path,
+                             priority="normal", idempotency_key=None, request_hash=None):
+    """
+    Record a completed generation whose artifacts were copied from source (a generation dict).
+    
+    Counts, progress and client types are copied, with client type output files moved under
+    output_directory.
+    """
+    now = datetime.utcnow().isoformat()
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        INSERT INTO generations
+        (user_id, knowledge_base_id, agent_persona_id, status, started_at, completed_at, client_types_count,
+         questions_count, questions_per_client, output_directory, analysis_path, analysis_completed,
+         analysis_completed_at, planned_calls, completed_calls, current_stage, progress_updated_at,
+         priority, request_signature, cloned_from)
+        VALUES (?, ?, ?, 'completed', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'completed', ?, ?, ?, ?)
+        RETURNING *
+        """, (
+            user_id, knowledge_base_id, agent_persona_id, now, now, source['client_types_count'],
+            source['questions_count'], source['questions_per_client'], output_directory, analysis_path,
+            1 if analysis_path else 0, now if analysis_path else None, source.get('planned_calls') or 0,
+            source.get('completed_calls') or 0, now, priority, source['request_signature'], source['id']
+        ))
+        generation = dict(cursor.fetchone())
+        _stats_changed(user_id)
+        
+        cursor.execute("""
+        SELECT * FROM client_types WHERE generation_id = ?
+        """, (source['id'],))
+        cursor.executemany("""
+        INSERT INTO client_types (generation_id, name, description, question_count, output_file)
+        VALUES (?, ?, ?, ?, ?)
+        """, [
+            (generation['id'], row['name'], row['description'], row['question_count'],
+             str(Path(output_directory) / Path(row['output_file']).name) if row['output_file'] else None)
+            for row in cursor.fetchall()
+        ])
+        
+        if idempotency_key:
+            _record_idempotency_key(cursor, user_id, idempotency_key, request_hash, generation['id'])
+        return generation
+
+def get_generation_backlog(recent=20):
+    """
+    Pending and processing generations plus recent seconds per LLM call, for admission control.
+
+    Returns {"active": [rows with user_id, status, questions_per_client, planned_calls,
+    completed_calls], "seconds_per_call": average over the last `recent` generations that
+    recorded one, or None}.
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        SELECT id, user_id, status, questions_per_client, planned_calls, completed_calls
+        FROM generations WHERE status IN ('pending', 'processing')
+        """)
+        active = [dict(row) for row in cursor.fetchall()]
+        cursor.execute("""
+        SELECT AVG(avg_seconds_per_call) FROM (
+            SELECT avg_seconds_per_call FROM generations
+            WHERE avg_seconds_per_call IS NOT NULL
+            ORDER BY progress_updated_at DESC LIMIT ?
+        )
+        """, (recent,))
+        return {"active": active, "seconds_per_call": cursor.fetchone()[0]}
 
 def delete_generation(generation_id, user_id):
     """Delete a generation by ID and user_id."""
     with get_db_cursor() as cursor:
-        # First delete related client types
+        cursor.execute("""
+        DELETE FROM generations
+        WHERE id = ? AND user_id = ?
+        RETURNING *
+        """, (generation_id, user_id))
+        result = cursor.fetchone()
+        
+        if not result:
+            return None
+        _stats_changed(result['user_id'])
+        
+        # Then its client types, and any Idempotency-Key that would replay it
         cursor.execute("""
         DELETE FROM client_types
         WHERE generation_id = ?
         """, (generation_id,))
+        cursor.execute("""
+        DELETE FROM idempotency_keys WHERE generation_id = ?
+        """, (generation_id,))
         
-        # Get the generation first
+        return dict(result)
+
+def cancel_generation(generation_id):
+    """
+    Mark a pending or processing generation as cancelled and drop its queued jobs.
+    
+    Returns the updated generation, or None if it was not in a cancellable state. A job
+    already running notices the cancelled status at its next check and stops.
+    """
+    now = datetime.utcnow().isoformat()
+    with get_db_cursor() as cursor:
         cursor.execute("""
-        SELECT * FROM generations
-        WHERE id = ? AND user_id = ?
-        """, (generation_id, user_id))
+        UPDATE generations 
+        SET status = 'cancelled', completed_at = ?, error_message = ?
+        WHERE id = ? AND status IN ('pending', 'processing')
+        RETURNING *
+        """, (now, "Cancelled by user", generation_id))
         result = cursor.fetchone()
-        
         if not result:
             return None
-            
-        # Then delete it
-        cursor.execute("""
-        DELETE FROM generations
-        WHERE id = ? AND user_id = ?
-        """, (generation_id, user_id))
+        _stats_changed(result['user_id'])
         
+        cursor.execute("""
+        UPDATE jobs 
+        SET status = 'cancelled', completed_at = ?
+        WHERE status = 'queued' AND kind IN ('generation', 'analysis')
+          AND json_extract(payload, '$.generation_id') = ?
+        """, (now, generation_id))
         return dict(result)
 
+def get_generation_status(generation_id):
+    """Status of a generation, or None if it does not exist."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        SELECT status FROM generations WHERE id = ?
+        """, (generation_id,))
+        result = cursor.fetchone()
+        return result['status'] if result else None
+
+def mark_interrupted_generations(stale_seconds=0):
+    """
+    Mark generations left pending or processing by a previous process as interrupted.
+    
+    With stale_seconds, only those without progress for that long, so generations another
+    live API process is running on the same database are left alone.
+    """
+    stale_filter, params = "", ["Interrupted by a server restart; resume to continue"]
+    if stale_seconds > 0:
+        stale_filter = "AND julianday(COALESCE(progress_updated_at, started_at)) < julianday(?)"
+        params.append(_utc_iso(-stale_seconds))
+    with get_db_cursor() as cursor:
+        cursor.execute(f"""
+        UPDATE generations 
+        SET status = 'interrupted', error_message = ?
+        WHERE status IN ('pending', 'processing') {stale_filter}
+        RETURNING id
+        """, params)
+        interrupted = sorted(row[0] for row in cursor.fetchall())
+        if interrupted:
+            _stats_changed(None)
+        return interrupted
+
 # Client type operations
 def create_client_type(generation_id, name, description, question_count, output_file):
     """Create a new client type record."""
@@ -414,18 +1034,35 @@ def create_client_type(generation_id, name, description, question_count, output_
         INSERT INTO client_types 
         (generation_id, name, description, question_count, output_file, created_at)
         VALUES (?, ?, ?, ?, ?, ?)
+        RETURNING *
         """, (generation_id, name, description, question_count, output_file, now))
-        
-        # Get the last inserted id
-        cursor.execute("SELECT last_insert_rowid()")
-        client_type_id = cursor.fetchone()[0]
-        
-        # Get the new client type data
-        cursor.execute("""
-        SELECT * FROM client_types WHERE id = ?
-        """, (client_type_id,))
         return dict(cursor.fetchone())
 
+def create_client_types(generation_id, client_types):
+    """
+    Insert many client types of a generation in one statement batch.
+    
+    client_types is an iterable of (name, description, question_count, output_file).
+    Returns the number of rows inserted.
+    """
+    now = datetime.utcnow().isoformat()
+    with get_db_cursor() as cursor:
+        cursor.executemany("""
+        INSERT INTO client_types 
+        (generation_id, name, description, question_count, output_file, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, [(generation_id, name, description, question_count, output_file, now)
+              for name, description, question_count, output_file in client_types])
+        return cursor.rowcount
+
+def delete_client_types_by_generation(generation_id):
+    """Delete all client type records of a generation, e.g. before a resumed run re-inserts them."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        DELETE FROM client_types WHERE generation_id = ?
+        """, (generation_id,))
+        return cursor.rowcount
+
 def get_client_types_by_generation(generation_id):
     """Get all client types for a generation."""
     with get_db_cursor() as cursor:
@@ -442,12 +1079,8 @@ def update_generation_analysis(generation_id, analysis_path):
         UPDATE generations 
         SET analysis_path = ?
         WHERE id = ?
+        RETURNING *
         """, (analysis_path, generation_id))
-        
-        # Get the updated generation
-        cursor.execute("""
-        SELECT * FROM generations WHERE id = ?
-        """, (generation_id,))
         result = cursor.fetchone()
         return dict(result) if result else None
 
@@ -459,13 +1092,11 @@ def complete_generation_analysis(generation_id):
         UPDATE generations 
         SET analysis_completed = 1, analysis_completed_at = ?
         WHERE id = ?
+        RETURNING *
         """, (now, generation_id))
-        
-        # Get the updated generation
-        cursor.execute("""
-        SELECT * FROM generations WHERE id = ?
-        """, (generation_id,))
         result = cursor.fetchone()
+        if result:
+            _stats_changed(result['user_id'])
         return dict(result) if result else None
 
 def update_generation_analysis_error(generation_id, error_message):
@@ -475,16 +1106,182 @@ def update_generation_analysis_error(generation_id, error_message):
         UPDATE generations 
         SET analysis_error = ?
         WHERE id = ?
+        RETURNING *
         """, (error_message, generation_id))
+        result = cursor.fetchone()
+        return dict(result) if result else None
+
+# Job queue operations
+def _utc_iso(offset_seconds=0):
+    """UTC timestamp with fixed precision so job times compare correctly as strings."""
+    return (datetime.utcnow() + timedelta(seconds=offset_seconds)).isoformat(timespec="microseconds")
+
+def _job_dict(row):
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+def enqueue_job(kind, payload, max_attempts=JOB_MAX_ATTEMPTS, delay_seconds=0, user_id=None, priority="normal", cost=1.0):
+    """
+    Add a job to the queue; payload must be JSON serializable.
+    
+    user_id, priority and cost (estimated LLM calls) set the job's fair queuing tags, so
+    claim_job serves users in turn rather than in submission order.
+    """
+    now = _utc_iso()
+    with get_db_connection() as conn:
+        # Serialize tag assignment with other enqueues and claims
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Virtual time: start tag of the latest job handed to a worker (cancelled jobs never were)
+            virtual_time = conn.execute("""
+            SELECT COALESCE(MAX(vstart), 0) FROM jobs WHERE status IN ('running', 'completed', 'failed')
+            """).fetchone()[0]
+            last_finish = None
+            if user_id is not None:
+                last_finish = conn.execute("""
+                SELECT MAX(vfinish) FROM jobs WHERE user_id = ? AND status != 'cancelled'
+                """, (user_id,)).fetchone()[0]
+            vstart, vfinish = fair_tags(virtual_time, last_finish, cost, priority)
+            
+            cursor = conn.execute("""
+            INSERT INTO jobs (kind, payload, status, max_attempts, run_after, created_at, user_id, priority, vstart, vfinish)
+            VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)
+            """, (kind, json.dumps(payload), max_attempts, _utc_iso(delay_seconds), now, user_id, priority, vstart, vfinish))
+            job = conn.execute("""
+            SELECT * FROM jobs WHERE id = ?
+            """, (cursor.lastrowid,)).fetchone()
+            conn.commit()
+            return _job_dict(job)
+        except Exception:
+            conn.rollback()
+            raise
+
+def claim_job(worker_id, lease_seconds, kinds=None, max_per_user=SCHEDULER_MAX_JOBS_PER_USER):
+    """
+    Atomically lease the next runnable job to worker_id, or return None.
+    
+    Runnable jobs are queued ones whose run_after has passed, and running ones whose
+    lease expired because their worker died (the visibility timeout). Expired jobs that
+    have used up their attempts are marked failed instead. Expired jobs are reclaimed
+    first; queued ones go in fair queuing finish tag order, skipping users who already
+    have max_per_user jobs running.
+    """
+    now = _utc_iso()
+    with get_db_connection() as conn:
+        # Take the write lock up front so two workers cannot claim the same row
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+            UPDATE jobs
+            SET status = 'failed', completed_at = ?, last_error = COALESCE(last_error, 'Lease expired')
+            WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts
+            """, (now, now))
+            
+            query = """
+            SELECT * FROM jobs
+            WHERE ((status = 'queued' AND run_after <= ?
+                    AND (user_id IS NULL OR user_id NOT IN (
+                        SELECT user_id FROM jobs
+                        WHERE status = 'running' AND lease_expires_at >= ? AND user_id IS NOT NULL
+                        GROUP BY user_id HAVING COUNT(*) >= ?
+                    )))
+                OR (status = 'running' AND lease_expires_at < ?))
+            """
+            params = [now, now, max_per_user, now]
+            if kinds:
+                query += " AND kind IN ({})".format(", ".join("?" for _ in kinds))
+                params.extend(kinds)
+            query += " ORDER BY status = 'running' DESC, vfinish, id LIMIT 1"
+            row = conn.execute(query, params).fetchone()
+            
+            if row is None:
+                conn.commit()
+                return None
+            
+            conn.execute("""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?,
+                heartbeat_at = ?, started_at = COALESCE(started_at, ?)
+            WHERE id = ?
+            """, (worker_id, _utc_iso(lease_seconds), now, now, row['id']))
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+            conn.commit()
+            return _job_dict(job)
+        except Exception:
+            conn.rollback()
+            raise
+
+def heartbeat_job(job_id, worker_id, lease_seconds):
+    """Extend a job's lease; returns False if the worker no longer owns it."""
+    now = _utc_iso()
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        UPDATE jobs
+        SET lease_expires_at = ?, heartbeat_at = ?
+        WHERE id = ? AND lease_owner = ? AND status = 'running'
+        """, (_utc_iso(lease_seconds), now, job_id, worker_id))
+        return cursor.rowcount == 1
+
+def complete_job(job_id, worker_id):
+    """Mark a leased job as completed; returns False if the lease was lost."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        UPDATE jobs
+        SET status = 'completed', completed_at = ?, lease_owner = NULL, lease_expires_at = NULL
+        WHERE id = ? AND lease_owner = ? AND status = 'running'
+        """, (_utc_iso(), job_id, worker_id))
+        return cursor.rowcount == 1
+
+def fail_job(job_id, worker_id, error_message, retry_delay_seconds=0):
+    """Record a failed attempt: requeue after retry_delay_seconds, or fail for good when out of attempts."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        UPDATE jobs
+        SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+            run_after = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL,
+            completed_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END
+        WHERE id = ? AND lease_owner = ? AND status = 'running'
+        """, (_utc_iso(retry_delay_seconds), error_message, _utc_iso(), job_id, worker_id))
         
-        # Get the updated generation
         cursor.execute("""
-        SELECT * FROM generations WHERE id = ?
-        """, (generation_id,))
+        SELECT status FROM jobs WHERE id = ?
+        """, (job_id,))
         result = cursor.fetchone()
-        return dict(result) if result else None
+        return result['status'] if result else None
+
+def get_job(job_id):
+    """Get a job by ID."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        SELECT * FROM jobs WHERE id = ?
+        """, (job_id,))
+        result = cursor.fetchone()
+        return _job_dict(result) if result else None
+
+def get_job_queue_positions():
+    """1-based queue position of each generation with a queued job, in fair queuing order."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        SELECT kind, json_extract(payload, '$.generation_id') AS generation_id FROM jobs
+        WHERE status = 'queued'
+        ORDER BY vfinish, id
+        """)
+        positions = {}
+        for position, row in enumerate(cursor.fetchall(), 1):
+            if row['kind'] in ("generation", "analysis") and row['generation_id'] is not None:
+                positions.setdefault(row['generation_id'], position)
+        return positions
+
+def get_job_counts():
+    """Number of jobs per status."""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+        SELECT status, COUNT(*) AS count FROM jobs GROUP BY status
+        """)
+        return {row['status']: row['count'] for row in cursor.fetchall()}
 
 if __name__ == "__main__":
     # When run directly, initialize the database
     init_db()
-    print("Database tables created.")
\ No newline at end of file
+    print("Database tables created.")
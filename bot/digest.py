@@ -0,0 +1,175 @@
+import os
+import hashlib
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+from .llm import generate_text
+from .retrieval import split_sections
+from .cancellation import CancelToken, raise_if_cancelled
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# "off" never digests, "always" digests every knowledge base, "auto" only those above the threshold
+KB_DIGEST_MODE = os.getenv("KB_DIGEST_MODE", "auto")
+KB_DIGEST_THRESHOLD_CHARS = int(os.getenv("KB_DIGEST_THRESHOLD_CHARS", "60000"))
+KB_DIGEST_CHUNK_CHARS = int(os.getenv("KB_DIGEST_CHUNK_CHARS", "12000"))
+KB_DIGEST_MODEL = os.getenv("KB_DIGEST_MODEL", "gemini-2.0-flash")
+KB_DIGEST_CONCURRENCY = int(os.getenv("KB_DIGEST_CONCURRENCY", "8"))
+
+_CONFIG = {"temperature": 0.2, "top_p": 0.95, "max_output_tokens": 4096}
+
+T = TypeVar("T")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def digest_path(kb_path: str, text_hash: str) -> Path:
+    """Digest file stored next to the parsed document, e.g. doc.md -> doc.md.digest.<hash>.md."""
+    kb_path = Path(kb_path)
+    return kb_path.with_name(f"{kb_path.name}.digest.{text_hash[:16]}.md")
+
+
+def should_use_digest(knowledge_base: str, mode: str = KB_DIGEST_MODE) -> bool:
+    mode = mode.lower()
+    if mode not in ("off", "auto", "always"):
+        raise ValueError(f"Unknown digest mode '{mode}', expected 'off', 'auto' or 'always'")
+    return mode == "always" or (mode == "auto" and len(knowledge_base) > KB_DIGEST_THRESHOLD_CHARS)
+
+
+def summarize_section(section: str, model: str = KB_DIGEST_MODEL) -> str:
+    prompt = f"""
+        You are condensing part of a financial services product knowledge base so it can be used
+        to identify customer segments and the questions they would ask.
+
+        Summarize the following section in at most 250 words. Keep every product name, feature,
+        eligibility rule, fee, limit and channel that is mentioned. Drop marketing language,
+        repetition and citations. Use short markdown bullet points under the section's heading.
+
+        Section:
+        {section}
+        """
+    return generate_text(model=model, prompt=prompt, config=_CONFIG).strip()
+
+
+def combine_summaries(summaries: List[str], model: str = KB_DIGEST_MODEL) -> str:
+    joined = "\n\n".join(summaries)
+    prompt = f"""
+        You are merging partial summaries of a financial services product knowledge base into one
+        compact digest. Group related products and features under clear markdown headings, remove
+        duplicates and keep every distinct product, feature, eligibility rule, fee and limit.
+
+        Partial summaries:
+        {joined}
+        """
+    return generate_text(model=model, prompt=prompt, config=_CONFIG).strip()
+
+
+def _batches(summaries: List[str], max_chars: int) -> List[List[str]]:
+    batches, current, size = [], [], 0
+    for summary in summaries:
+        if current and size + len(summary) > max_chars:
+            batches.append(current)
+            current, size = [], 0
+        current.append(summary)
+        size += len(summary)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _slotted(
+    fn: Callable[[T, str], str],
+    model: str,
+    llm_slots: Optional[threading.Semaphore],
+    cancel: Optional[CancelToken]
+) -> Callable[[T], str]:
+    """fn(item, model) holding one of llm_slots, skipped once cancel is set."""
+    def call(item: T) -> str:
+        raise_if_cancelled(cancel)
+        with llm_slots or nullcontext():
+            # Checked again after waiting for a slot, so a cancelled call hands the slot straight back
+            raise_if_cancelled(cancel)
+            return fn(item, model)
+    return call
+
+
+def build_digest(
+    knowledge_base: str,
+    model: str = KB_DIGEST_MODEL,
+    chunk_chars: int = KB_DIGEST_CHUNK_CHARS,
+    max_concurrency: int = KB_DIGEST_CONCURRENCY,
+    llm_slots: Optional[threading.Semaphore] = None,
+    cancel: Optional[CancelToken] = None
+) -> str:
+    """
+    Map-reduce summary of a knowledge base.
+
+    Sections are summarized in parallel (map), then summaries are merged in batches that fit
+    in chunk_chars until a single digest remains (reduce). Each call takes one of llm_slots,
+    the generation's shared LLM concurrency budget, and none starts once cancel is set.
+    """
+    sections = split_sections(knowledge_base, chunk_chars)
+    logger.info(f"Building knowledge base digest from {len(sections)} sections ({len(knowledge_base)} chars)")
+    summarize = _slotted(summarize_section, model, llm_slots, cancel)
+    combine = _slotted(combine_summaries, model, llm_slots, cancel)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(sections))), thread_name_prefix="digest") as executor:
+        summaries = list(executor.map(summarize, sections))
+
+        rounds = 0
+        while len(summaries) > 1:
+            batches = _batches(summaries, chunk_chars)
+            if len(batches) == len(summaries):
+                # Summaries too long to group by size; merge pairwise so every round makes progress
+                batches = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+            summaries = list(executor.map(combine, batches))
+            rounds += 1
+
+    digest = summaries[0] if summaries else ""
+    logger.info(f"Knowledge base digest built in {rounds} reduce round(s): {len(knowledge_base)} -> {len(digest)} chars")
+    return digest
+
+
+def get_digest(
+    kb_path: str,
+    knowledge_base: Optional[str] = None,
+    model: str = KB_DIGEST_MODEL,
+    max_concurrency: int = KB_DIGEST_CONCURRENCY,
+    llm_slots: Optional[threading.Semaphore] = None,
+    cancel: Optional[CancelToken] = None
+) -> str:
+    """Return the cached digest for this version of the knowledge base, building and storing it on first use."""
+    if knowledge_base is None:
+        with open(kb_path, "r", encoding="utf-8") as f:
+            knowledge_base = f.read()
+
+    path = digest_path(kb_path, content_hash(knowledge_base))
+    if path.exists():
+        logger.info(f"Using cached knowledge base digest {path}")
+        return path.read_text(encoding="utf-8")
+
+    digest = build_digest(knowledge_base, model=model, max_concurrency=max_concurrency, llm_slots=llm_slots, cancel=cancel)
+    if digest:
+        # Write then rename so concurrent generations never read a half-written digest
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(digest, encoding="utf-8")
+        os.replace(tmp_path, path)
+        logger.info(f"Saved knowledge base digest to {path}")
+    return digest
+
+
+def remove_digests(kb_path: str):
+    """Delete every stored digest version of a parsed document."""
+    kb_path = Path(kb_path)
+    for path in kb_path.parent.glob(f"{kb_path.name}.digest.*.md"):
+        path.unlink(missing_ok=True)
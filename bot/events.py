@@ -0,0 +1,136 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# Events kept per generation so late subscribers (or reconnects with Last-Event-ID) can catch up
+EVENTS_HISTORY = int(os.getenv("EVENTS_HISTORY", "500"))
+# Generations whose history is kept in memory; the oldest are dropped first
+EVENTS_MAX_CHANNELS = int(os.getenv("EVENTS_MAX_CHANNELS", "200"))
+
+# Generation statuses after which no further events are published
+TERMINAL_STATUSES = {"completed", "failed", "interrupted", "cancelled"}
+
+ProgressCallback = Callable[..., None]
+
+
+class Subscription:
+    """Events of one channel delivered to an asyncio consumer, in publish order."""
+
+    def __init__(self, broker: "EventBroker", channel: Any, loop: asyncio.AbstractEventLoop):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def deliver(self, event: Dict[str, Any]):
+        # Called from publisher threads; the queue itself is only touched on the loop
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # Loop already closed; the subscriber is gone
+            self.broker.unsubscribe(self)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or None if none arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """
+    In-process pub/sub for generation progress.
+
+    Publishers are the generation threads (creator, tasks) and may call publish from any
+    thread; subscribers are async SSE handlers. Each channel keeps a bounded history with
+    increasing ids so a subscriber that connects mid-generation first replays what it missed.
+    Events only reach subscribers in the same process as the publisher.
+    """
+
+    def __init__(self, history: int = EVENTS_HISTORY, max_channels: int = EVENTS_MAX_CHANNELS):
+        self.history = history
+        self.max_channels = max_channels
+        self._channels: "OrderedDict[Any, deque]" = OrderedDict()
+        self._subscribers: Dict[Any, List[Subscription]] = {}
+        self._next_id: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel: Any, event: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        with self._lock:
+            event_id = self._next_id.get(channel, 0) + 1
+            self._next_id[channel] = event_id
+            message = {
+                "id": event_id,
+                "event": event,
+                "data": data or {},
+                "time": datetime.now(timezone.utc).isoformat()
+            }
+            if channel not in self._channels:
+                self._channels[channel] = deque(maxlen=self.history)
+                while len(self._channels) > self.max_channels:
+                    dropped, _ = self._channels.popitem(last=False)
+                    if not self._subscribers.get(dropped):
+                        self._next_id.pop(dropped, None)
+            self._channels[channel].append(message)
+            self._channels.move_to_end(channel)
+            subscribers = list(self._subscribers.get(channel, []))
+
+        for subscription in subscribers:
+            subscription.deliver(message)
+        return message
+
+    def subscribe(self, channel: Any, after_id: int = 0) -> Subscription:
+        """Subscribe from the running event loop, replaying stored events newer than after_id."""
+        subscription = Subscription(self, channel, asyncio.get_running_loop())
+        with self._lock:
+            for message in self._channels.get(channel, ()):
+                if message["id"] > after_id:
+                    subscription.queue.put_nowait(message)
+            self._subscribers.setdefault(channel, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.channel, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "channels": len(self._channels),
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+                "events_buffered": sum(len(h) for h in self._channels.values()),
+            }
+
+
+broker = EventBroker()
+
+
+def generation_progress(generation_id: int) -> ProgressCallback:
+    """Progress callback for create_prompts that publishes to a generation's channel."""
+    def _publish(event: str, **data):
+        try:
+            broker.publish(generation_id, event, data)
+        except Exception as e:
+            # Progress reporting must never break a generation
+            logger.error(f"Failed to publish {event} for generation {generation_id}: {e}")
+    return _publish
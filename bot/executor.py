@@ -0,0 +1,175 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# Long-running background work (generation, analysis, document parsing) run by the API process
+EXECUTOR_TASK_WORKERS = int(os.getenv("EXECUTOR_TASK_WORKERS", "4"))
+# Short blocking calls made by request handlers: bcrypt, file I/O
+EXECUTOR_BLOCKING_WORKERS = int(os.getenv("EXECUTOR_BLOCKING_WORKERS", "16"))
+# Database threads serving bot.async_database; each keeps one pooled sqlite3 connection
+EXECUTOR_DB_WORKERS = int(os.getenv("EXECUTOR_DB_WORKERS", "4"))
+# How often the event loop lag monitor wakes up, and the lag worth a warning
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.1"))
+EVENT_LOOP_LAG_WARN_SECONDS = float(os.getenv("EVENT_LOOP_LAG_WARN_SECONDS", "0.5"))
+
+T = TypeVar("T")
+
+_POOL_SIZES = {"tasks": EXECUTOR_TASK_WORKERS, "blocking": EXECUTOR_BLOCKING_WORKERS, "database": EXECUTOR_DB_WORKERS}
+
+
+class _Pool:
+    """ThreadPoolExecutor plus counters for how much of it is busy."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"exec-{name}")
+        self.submitted = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def _run(self, fn: Callable[[], T]) -> T:
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self.completed += 1
+
+    def submit(self, fn: Callable[[], T]):
+        with self._lock:
+            self.submitted += 1
+        return self.executor.submit(self._run, fn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = self.submitted - self.completed
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - self.max_workers),
+            "completed": self.completed,
+        }
+
+
+_pools: Dict[str, _Pool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(name: str) -> _Pool:
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _Pool(name, _POOL_SIZES[name])
+            _pools[name] = pool
+        return pool
+
+
+async def _run_in(pool_name: str, fn: Callable[..., T], *args, **kwargs) -> T:
+    future = _get_pool(pool_name).submit(functools.partial(fn, *args, **kwargs))
+    return await asyncio.wrap_future(future)
+
+
+async def run_blocking(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run a short blocking call (password hash, file I/O) off the event loop."""
+    return await _run_in("blocking", fn, *args, **kwargs)
+
+
+async def run_db(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run a bot.database call on the database threads.
+
+    A few long-lived threads with a queue in front of them, so request handlers reuse a
+    handful of warm connections (WAL lets their reads run in parallel) and a burst of
+    file or password work on the blocking pool cannot delay queries.
+    """
+    return await _run_in("database", fn, *args, **kwargs)
+
+
+async def run_task(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run a long blocking job (generation, analysis, parsing) off the event loop.
+
+    Tasks get their own pool so a few minutes-long generations cannot starve the
+    blocking pool that request handlers depend on.
+    """
+    return await _run_in("tasks", fn, *args, **kwargs)
+
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {name: pools[name].stats() if name in pools else {"max_workers": size, "in_flight": 0, "queued": 0, "completed": 0}
+            for name, size in _POOL_SIZES.items()}
+
+
+def shutdown_executors(wait: bool = False):
+    """Stop accepting work; with wait=False running tasks finish in the background."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop responsiveness by timing how late a periodic sleep wakes up.
+
+    Any blocking call on the loop shows up directly as lag, so this is the number to watch
+    when checking that request latency stays flat while background work runs.
+    """
+
+    def __init__(self, interval: float = EVENT_LOOP_LAG_INTERVAL, warn_seconds: float = EVENT_LOOP_LAG_WARN_SECONDS, window: int = 600):
+        self.interval = interval
+        self.warn_seconds = warn_seconds
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.warn_seconds:
+                logger.warning(f"Event loop blocked for {lag:.3f}s")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "last": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "samples": len(samples),
+            "last": round(self.samples[-1], 4),
+            "p50": round(samples[len(samples) // 2], 4),
+            "p99": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 4),
+            "max": round(self.max_lag, 4),
+        }
+
+
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Iterator, List
+
+from .utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Latency distribution spec, in seconds: "fixed:0.2", "uniform:0.1,0.5" or "lognormal:<median>,<sigma>"
+FAKE_LLM_LATENCY = os.getenv("FAKE_LLM_LATENCY", "lognormal:0.8,0.4")
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+FAKE_LLM_SEED = int(os.getenv("FAKE_LLM_SEED", "42"))
+
+_CLIENT_TYPE_NAMES = [
+    "rural_new_adopter", "tech_savvy_millennial", "retired_pensioner", "small_business_owner",
+    "salaried_professional", "student_first_account", "nri_investor", "high_net_worth_client",
+    "homemaker_saver", "gig_economy_worker", "farmer_borrower", "first_time_home_buyer",
+]
+
+_TOPICS = [
+    "opening a savings account", "transferring money with UPI", "applying for a personal loan",
+    "investing in mutual funds", "buying term insurance", "setting up a fixed deposit",
+    "checking my credit score", "paying bills online", "keeping my account secure",
+    "tracking my monthly spending", "getting a credit card", "saving for retirement",
+]
+
+
+class FakeLLMError(Exception):
+    """Simulated API failure carrying an HTTP-like status code (429 or 503)."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def parse_latency_spec(spec: str) -> Callable[[random.Random], float]:
+    """Turn a latency spec string into a sampler returning seconds."""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()] if args else []
+    kind = kind.strip().lower()
+
+    if kind == "fixed":
+        seconds = values[0] if values else 0.0
+        return lambda rng: seconds
+    if kind == "uniform":
+        low, high = (values + [0.0, 0.0])[:2]
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = (values + [1.0, 0.5])[:2]
+        mu = math.log(median) if median > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency distribution '{kind}', expected fixed, uniform or lognormal")
+
+
+class FakeBackend:
+    """
+    Offline stand-in for Gemini that returns schema-valid JSON for every prompt the pipeline sends.
+
+    Output content depends only on the prompt, so reruns are reproducible. Latency and
+    failures are drawn from a seeded generator so a serial run replays the same sequence.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: str = FAKE_LLM_LATENCY,
+        failure_rate: float = FAKE_LLM_FAILURE_RATE,
+        seed: int = FAKE_LLM_SEED
+    ):
+        self.latency_spec = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._sample_latency = parse_latency_spec(latency)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.calls = 0
+
+    def _draw(self):
+        with self._rng_lock:
+            self.calls += 1
+            return self._sample_latency(self._rng), self._rng.random() < self.failure_rate, self._rng.random()
+
+    def _prompt_rng(self, model: str, prompt: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}:{model}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _fail(self, roll: float):
+        if roll < 0.7:
+            raise FakeLLMError(429, "RESOURCE_EXHAUSTED: simulated rate limit")
+        raise FakeLLMError(503, "UNAVAILABLE: simulated overload")
+
+    def generate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        delay, fail, roll = self._draw()
+        time.sleep(delay)
+        if fail:
+            self._fail(roll)
+        return self.render(model, prompt)
+
+    async def agenerate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        delay, fail, roll = self._draw()
+        await asyncio.sleep(delay)
+        if fail:
+            self._fail(roll)
+        return self.render(model, prompt)
+
+    def generate_stream(self, model: str, prompt: str, config: Dict[str, Any]) -> Iterator[str]:
+        """Yield the rendered text in small chunks: the first after a fifth of the latency, the rest spread evenly."""
+        delay, fail, roll = self._draw()
+        time.sleep(delay * 0.2)
+        if fail:
+            self._fail(roll)
+        text = self.render(model, prompt)
+        chunks = [text[i:i + 64] for i in range(0, len(text), 64)] or [""]
+        pause = delay * 0.8 / len(chunks)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(pause)
+            yield chunk
+
+    def render(self, model: str, prompt: str) -> str:
+        """Build the response body for a prompt, recognised by the JSON shape it asks for."""
+        rng = self._prompt_rng(model, prompt)
+        kind = classify_prompt(prompt)
+
+        if kind == "client_types":
+            count = _requested_count(prompt, r"identify exactly (\d+)", 2)
+            payload = _client_types(rng, count)
+        elif kind == "client_analysis":
+            payload = _client_analysis(rng)
+        elif kind == "overall_analysis":
+            payload = _overall_analysis(rng)
+        elif kind == "response":
+            payload = _response(rng)
+        elif kind == "questions":
+            count = _requested_count(prompt, r"Generate exactly (\d+)", 5)
+            payload = _questions(rng, count)
+        else:
+            return _paragraph(rng, sentences=6)
+
+        # Gemini usually fences JSON; keep that so callers' extraction logic is exercised
+        return "```json\n" + json.dumps(payload, indent=2) + "\n```"
+
+
+def classify_prompt(prompt: str) -> str:
+    """Name the pipeline call a prompt belongs to, based on the JSON shape it requests."""
+    if '"client_type_identifier"' in prompt:
+        return "client_types"
+    if '"description_quality"' in prompt:
+        return "client_analysis"
+    if '"overall_quality"' in prompt:
+        return "overall_analysis"
+    if '"key_points"' in prompt:
+        return "response"
+    if '"question"' in prompt and '"context"' in prompt:
+        return "questions"
+    return "text"
+
+
+def _requested_count(prompt: str, pattern: str, default: int) -> int:
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    parts = []
+    for _ in range(sentences):
+        topic = rng.choice(_TOPICS)
+        parts.append(f"Customers often ask about {topic}, and the answer depends on their goals and documents.")
+    return " ".join(parts)
+
+
+def _client_types(rng: random.Random, count: int) -> List[Dict[str, str]]:
+    names = rng.sample(_CLIENT_TYPE_NAMES, min(count, len(_CLIENT_TYPE_NAMES)))
+    while len(names) < count:
+        names.append(f"segment_{len(names) + 1}")
+    return [
+        {"client_type": name, "description": f"A {name.replace('_', ' ')}. " + _paragraph(rng, sentences=8)}
+        for name in names
+    ]
+
+
+def _questions(rng: random.Random, count: int) -> List[Dict[str, str]]:
+    return [
+        {
+            "question": f"How do I go about {rng.choice(_TOPICS)} (option {i + 1})?",
+            "context": _paragraph(rng, sentences=2),
+        }
+        for i in range(count)
+    ]
+
+
+def _response(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "response": _paragraph(rng, sentences=rng.randint(5, 10)),
+        "key_points": [f"Explains {topic}" for topic in rng.sample(_TOPICS, rng.randint(3, 5))],
+    }
+
+
+def _client_analysis(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "description_quality": rng.randint(5, 10),
+        "description_feedback": _paragraph(rng, sentences=3),
+        "question_quality": rng.randint(5, 10),
+        "question_feedback": _paragraph(rng, sentences=3),
+        "response_quality": rng.randint(5, 10),
+        "response_feedback": _paragraph(rng, sentences=3),
+        "improvement_suggestions": [f"Cover {topic} in more depth" for topic in rng.sample(_TOPICS, 3)],
+    }
+
+
+def _overall_analysis(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "overall_quality": rng.randint(5, 10),
+        "strengths": [f"Clear guidance on {topic}" for topic in rng.sample(_TOPICS, 3)],
+        "weaknesses": [f"Thin coverage of {topic}" for topic in rng.sample(_TOPICS, 2)],
+        "improvement_suggestions": [f"Add examples for {topic}" for topic in rng.sample(_TOPICS, 3)],
+        "summary": _paragraph(rng, sentences=5),
+    }
@@ -0,0 +1,311 @@
+import os
+import atexit
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Protocol, Union
+
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+
+from .utils import setup_logger
+from .cache import get_cache
+from .ratelimit import get_limiter
+from .retrieval import estimate_tokens
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# Keep-alive pool sizing for the HTTP client underneath each genai.Client
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "16"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# Which backend serves generate_text: "gemini" or "fake" (offline, see bot/fake_llm.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+_clients: Dict[str, genai.Client] = {}
+_clients_lock = threading.Lock()
+_stats = {"clients_created": 0, "client_reuses": 0, "clients_closed": 0}
+
+
+def _build_client(api_key: str) -> genai.Client:
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+    try:
+        http_options = types.HttpOptions(
+            client_args={"limits": limits},
+            async_client_args={"limits": limits},
+        )
+        return genai.Client(api_key=api_key, http_options=http_options)
+    except Exception as e:
+        # Older google-genai releases do not accept client_args; their default pool still keeps connections alive
+        logger.warning(f"Falling back to default genai HTTP options: {e}")
+        return genai.Client(api_key=api_key)
+
+
+def get_client(api_key: Optional[str] = None) -> genai.Client:
+    """
+    Return the process-wide genai.Client for an API key, creating it on first use.
+
+    genai.Client is not bound to a model, so clients are keyed by API key only and
+    every model shares the same pooled HTTP connections.
+    """
+    api_key = api_key or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable not set")
+
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is not None:
+            _stats["client_reuses"] += 1
+            return client
+
+        client = _build_client(api_key)
+        _clients[api_key] = client
+        _stats["clients_created"] += 1
+        logger.info(f"Created shared Gemini client #{_stats['clients_created']}")
+        return client
+
+
+def client_stats() -> Dict[str, int]:
+    """Counters for client creation and reuse across the process."""
+    with _clients_lock:
+        return {**_stats, "active_clients": len(_clients)}
+
+
+def close_clients():
+    """Close every shared client and its connection pool. Safe to call more than once."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+
+    for client in clients:
+        try:
+            close = getattr(client, "close", None)
+            if callable(close):
+                close()
+            else:
+                # Releases the underlying httpx connection pool on releases without Client.close()
+                http_client = getattr(getattr(client, "_api_client", None), "_httpx_client", None)
+                if http_client is not None:
+                    http_client.close()
+            _stats["clients_closed"] += 1
+        except Exception as e:
+            logger.warning(f"Failed to close Gemini client: {e}")
+
+    if clients:
+        logger.info(f"Closed {len(clients)} shared Gemini client(s)")
+
+
+class LLMBackend(Protocol):
+    """Minimal interface every LLM backend implements."""
+
+    name: str
+
+    def generate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        ...
+
+    async def agenerate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        ...
+
+    def generate_stream(self, model: str, prompt: str, config: Dict[str, Any]) -> Iterator[str]:
+        ...
+
+
+class GeminiBackend:
+    """Google Gemini through the shared genai client."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+
+    def generate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        response = get_client(self.api_key).models.generate_content(
+            model=model,
+            contents=prompt,
+            config=types.GenerateContentConfig(**config)
+        )
+        return response.text
+
+    async def agenerate(self, model: str, prompt: str, config: Dict[str, Any]) -> str:
+        response = await get_client(self.api_key).aio.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=types.GenerateContentConfig(**config)
+        )
+        return response.text
+
+    def generate_stream(self, model: str, prompt: str, config: Dict[str, Any]) -> Iterator[str]:
+        for chunk in get_client(self.api_key).models.generate_content_stream(
+            model=model,
+            contents=prompt,
+            config=types.GenerateContentConfig(**config)
+        ):
+            if chunk.text:
+                yield chunk.text
+
+
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: str) -> LLMBackend:
+    name = name.lower()
+    if name == "gemini":
+        return GeminiBackend()
+    if name == "fake":
+        from .fake_llm import FakeBackend
+        return FakeBackend()
+    raise ValueError(f"Unknown LLM backend '{name}', expected 'gemini' or 'fake'")
+
+
+def get_backend() -> LLMBackend:
+    """Return the process-wide backend, created from LLM_BACKEND on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend(LLM_BACKEND)
+            logger.info(f"Using '{_backend.name}' LLM backend")
+        return _backend
+
+
+def set_backend(backend: Union[str, LLMBackend]) -> LLMBackend:
+    """Replace the process-wide backend with an instance or a backend name."""
+    global _backend
+    if isinstance(backend, str):
+        backend = create_backend(backend)
+    with _backend_lock:
+        _backend = backend
+    logger.info(f"Using '{backend.name}' LLM backend")
+    return backend
+
+
+def _cache_lookup(model: str, prompt: str, config: Dict[str, Any], use_cache: Optional[bool], backend: LLMBackend,
+                  accept: Optional[Callable[[str], bool]] = None):
+    cache = get_cache()
+    if cache is None or not cache.should_use(config, use_cache):
+        return cache, None, None
+    # Namespace by backend so fake output never answers a real Gemini call
+    key = cache.make_key(f"{backend.name}/{model}", prompt, config)
+    cached = cache.get(key)
+    if cached is not None and accept is not None and not accept(cached):
+        # Stored before the caller started rejecting it; drop it so the call is retried
+        cache.delete(key)
+        cached = None
+    return cache, key, cached
+
+
+def generate_text(
+    model: str,
+    prompt: str,
+    config: Dict[str, Any],
+    use_cache: Optional[bool] = None,
+    accept: Optional[Callable[[str], bool]] = None
+) -> str:
+    """
+    Generate text for a prompt, serving identical (model, prompt, config) calls from the response cache.
+
+    Calls that reach the backend go through the process-wide rate limiter, which retries
+    429/503 errors with backoff (see bot/ratelimit.py).
+
+    Args:
+        model: Model name, e.g. "gemini-2.0-flash".
+        prompt: Full prompt text.
+        config: GenerateContentConfig fields such as temperature, top_p and max_output_tokens.
+        use_cache: Force the cache on or off for this call. None applies the cache policy,
+            which skips sampled calls when LLM_CACHE_BYPASS_SAMPLED is set.
+        accept: Check of the output, e.g. that it parses. Output it rejects is returned but
+            not cached, so retrying the call asks the model again instead of replaying it.
+
+    Returns:
+        The response text.
+    """
+    backend = get_backend()
+    cache, key, cached = _cache_lookup(model, prompt, config, use_cache, backend, accept)
+    if cached is not None:
+        logger.debug(f"LLM cache hit for {model} ({key[:12]})")
+        return cached
+
+    text = get_limiter().call(
+        lambda: backend.generate(model, prompt, config),
+        prompt_tokens=estimate_tokens(prompt),
+        output_tokens=lambda result: estimate_tokens(result or "")
+    )
+
+    if key is not None and text and (accept is None or accept(text)):
+        cache.put(key, model, text)
+    return text
+
+
+async def agenerate_text(
+    model: str,
+    prompt: str,
+    config: Dict[str, Any],
+    use_cache: Optional[bool] = None,
+    accept: Optional[Callable[[str], bool]] = None
+) -> str:
+    """Async counterpart of generate_text."""
+    backend = get_backend()
+    cache, key, cached = _cache_lookup(model, prompt, config, use_cache, backend, accept)
+    if cached is not None:
+        logger.debug(f"LLM cache hit for {model} ({key[:12]})")
+        return cached
+
+    text = await get_limiter().acall(
+        lambda: backend.agenerate(model, prompt, config),
+        prompt_tokens=estimate_tokens(prompt),
+        output_tokens=lambda result: estimate_tokens(result or "")
+    )
+
+    if key is not None and text and (accept is None or accept(text)):
+        cache.put(key, model, text)
+    return text
+
+
+def stream_text(
+    model: str,
+    prompt: str,
+    config: Dict[str, Any],
+    use_cache: Optional[bool] = None,
+    accept: Optional[Callable[[str], bool]] = None
+) -> Iterator[str]:
+    """
+    Stream the response text for a prompt chunk by chunk.
+
+    A cache hit is yielded as a single chunk. Backends without generate_stream fall back
+    to one generate call. The full text is cached once the stream completes, unless accept
+    (as in generate_text) rejects it.
+    """
+    backend = get_backend()
+    cache, key, cached = _cache_lookup(model, prompt, config, use_cache, backend, accept)
+    if cached is not None:
+        logger.debug(f"LLM cache hit for {model} ({key[:12]})")
+        yield cached
+        return
+
+    if hasattr(backend, "generate_stream"):
+        stream = get_limiter().stream(lambda: backend.generate_stream(model, prompt, config), prompt_tokens=estimate_tokens(prompt))
+    else:
+        stream = iter([get_limiter().call(
+            lambda: backend.generate(model, prompt, config),
+            prompt_tokens=estimate_tokens(prompt),
+            output_tokens=lambda result: estimate_tokens(result or "")
+        )])
+
+    parts = []
+    for chunk in stream:
+        parts.append(chunk)
+        yield chunk
+
+    text = "".join(parts)
+    if key is not None and text and (accept is None or accept(text)):
+        cache.put(key, model, text)
+
+
+atexit.register(close_clients)
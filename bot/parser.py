@@ -44,11 +44,15 @@ def parse_document(input_file_path: str, output_file_path: str) -> str:
     """Synchronous wrapper for backward compatibility"""
     logger.info(f"Starting to parse document: {input_file_path}")
     try:
-        # Use nest_asyncio to run the async function in sync context
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Normal case (worker or executor thread): give the parse its own event loop
+            return asyncio.run(parse_document_async(input_file_path, output_file_path))
+
+        # Called from inside a running loop; nest_asyncio lets us block on it there
         import nest_asyncio
         nest_asyncio.apply()
-        
-        # Run the async function in the current event loop
         return asyncio.get_event_loop().run_until_complete(
             parse_document_async(input_file_path, output_file_path)
         )
@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+from .database import update_generation_progress
+from .events import ProgressCallback
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# Minimum seconds between progress writes for one generation; stage changes are written immediately
+GENERATION_PROGRESS_FLUSH_SECONDS = float(os.getenv("GENERATION_PROGRESS_FLUSH_SECONDS", "2"))
+# Weight of the newest interval in the moving average of seconds per call
+PROGRESS_SMOOTHING = 0.2
+
+
+class GenerationProgress:
+    """
+    Progress callback that tracks LLM calls for a generation and stores them on its row.
+
+    Planned calls start as one client type call, are extended to one question call plus
+    questions_per_client response calls per client type once the client types are known,
+    plus one analysis call per client type and one overall analysis call, and are corrected
+    as actual question counts arrive. avg_seconds_per_call is a moving average of the wall
+    time between completed calls, so it reflects throughput with concurrency, and the ETA
+    is the remaining calls times that average. Calls served from a checkpoint count as
+    completed but do not feed the average.
+
+    Writes go to the database at most every flush_seconds, plus on every stage change.
+    Every event is also passed on to forward (e.g. the SSE broker).
+    """
+
+    def __init__(
+        self,
+        generation_id: int,
+        questions_per_client: int,
+        forward: Optional[ProgressCallback] = None,
+        flush_seconds: float = GENERATION_PROGRESS_FLUSH_SECONDS
+    ):
+        self.generation_id = generation_id
+        self.questions_per_client = questions_per_client
+        self.forward = forward
+        self.flush_seconds = flush_seconds
+
+        self.planned_calls = 1
+        self.completed_calls = 0
+        self.stage = "starting"
+        self.avg_seconds_per_call: Optional[float] = None
+        self.eta_seconds: Optional[float] = None
+        self._analysis_planned = 0
+        self._last_completion = time.monotonic()
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _complete(self, timed: bool = True):
+        now = time.monotonic()
+        self.completed_calls += 1
+        if timed:
+            interval = now - self._last_completion
+            if self.avg_seconds_per_call is None:
+                self.avg_seconds_per_call = interval
+            else:
+                self.avg_seconds_per_call += PROGRESS_SMOOTHING * (interval - self.avg_seconds_per_call)
+        self._last_completion = now
+        remaining = max(0, self.planned_calls - self.completed_calls)
+        if self.avg_seconds_per_call is not None:
+            self.eta_seconds = remaining * self.avg_seconds_per_call
+
+    def _apply(self, event: str, data: Dict[str, Any]) -> bool:
+        """Update counters for one event; returns True when the stage changed."""
+        if event == "stage":
+            self.stage = data["stage"]
+            return True
+        if event == "status":
+            status = data.get("status")
+            if status == "processing":
+                self.stage = "starting"
+            elif status in ("completed", "failed", "cancelled"):
+                self.stage = status
+                if status == "completed":
+                    self.eta_seconds = 0.0
+            return True
+        if event == "client_types":
+            count = len(data["client_types"])
+            self._analysis_planned = count + 1
+            self.planned_calls = 1 + count * (1 + self.questions_per_client) + self._analysis_planned
+            self._complete(timed=not data.get("checkpointed"))
+        elif event == "questions":
+            # Fewer (or more) questions than requested means fewer (or more) response calls
+            self.planned_calls += data["count"] - self.questions_per_client
+            self._complete(timed=not data.get("checkpointed"))
+        elif event == "response":
+            self._complete(timed=not data.get("checkpointed"))
+        elif event == "analysis_call":
+            self.planned_calls += data["total"] - self._analysis_planned
+            self._analysis_planned = data["total"]
+            self._complete()
+        return False
+
+    def __call__(self, event: str, **data):
+        try:
+            with self._lock:
+                stage_changed = self._apply(event, data)
+            self.flush(force=stage_changed)
+        except Exception as e:
+            # Progress reporting must never break a generation
+            logger.error(f"Failed to record {event} progress for generation {self.generation_id}: {e}")
+        if self.forward:
+            self.forward(event, **data)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "planned_calls": self.planned_calls,
+                "completed_calls": self.completed_calls,
+                "current_stage": self.stage,
+                "avg_seconds_per_call": round(self.avg_seconds_per_call, 3) if self.avg_seconds_per_call is not None else None,
+                "eta_seconds": round(self.eta_seconds, 1) if self.eta_seconds is not None else None,
+            }
+
+    def flush(self, force: bool = False):
+        """Write the current snapshot unless one was written less than flush_seconds ago."""
+        with self._flush_lock:
+            now = time.monotonic()
+            if not force and now - self._last_flush < self.flush_seconds:
+                return
+            self._last_flush = now
+            update_generation_progress(self.generation_id, **self.snapshot())
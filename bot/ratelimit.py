@@ -0,0 +1,335 @@
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# Quota shared by every LLM call in the process; set these to the project's Gemini limits
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+# Adaptive concurrency window: starts at LLM_INITIAL_INFLIGHT and moves between the min and max
+LLM_MIN_INFLIGHT = int(os.getenv("LLM_MIN_INFLIGHT", "1"))
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "32"))
+LLM_INITIAL_INFLIGHT = int(os.getenv("LLM_INITIAL_INFLIGHT", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+
+T = TypeVar("T")
+
+_RETRYABLE_CODES = {429, 503}
+_RETRYABLE_STATUSES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE"}
+# Status codes as whole words only, so ids, token counts or paths containing the digits do not match
+_RETRYABLE_MESSAGE = re.compile(r"\b(?:429|503|RESOURCE_EXHAUSTED|UNAVAILABLE)\b")
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate limit (429) and overload (503) errors from Gemini or the fake backend."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code in _RETRYABLE_CODES
+    status = getattr(error, "status", None)
+    if isinstance(status, str):
+        return status in _RETRYABLE_STATUSES
+    return bool(_RETRYABLE_MESSAGE.search(str(error)))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most one minute of quota.
+
+    reserve() always takes the tokens and returns how long the caller must wait before using
+    them, so waiting callers queue up in order instead of racing for the next refill.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        # A single request larger than the bucket would otherwise never fit
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def debit(self, amount: float):
+        """Charge usage discovered after the call (e.g. output tokens) without waiting."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class RateLimiter:
+    """
+    Process-wide limiter for LLM calls.
+
+    Every call reserves one request and its estimated prompt tokens from the per-minute
+    buckets and takes a slot in an AIMD concurrency window. Each success grows the window
+    by about one slot per window of calls. A 429/503 halves it and retries the call with
+    exponential backoff and jitter. All in-flight callers see the smaller window, so
+    concurrent jobs back off together instead of each hammering the API.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        min_inflight: int = LLM_MIN_INFLIGHT,
+        max_inflight: int = LLM_MAX_INFLIGHT,
+        initial_inflight: int = LLM_INITIAL_INFLIGHT,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.min_inflight = max(1, min_inflight)
+        self.max_inflight = max(self.min_inflight, max_inflight)
+        self.limit = float(min(max(initial_inflight, self.min_inflight), self.max_inflight))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.inflight = 0
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self._stats = {"calls": 0, "successes": 0, "throttled": 0, "retries": 0, "failures": 0, "wait_seconds": 0.0}
+
+    def _try_acquire_slot(self) -> bool:
+        if self.inflight < int(self.limit):
+            self.inflight += 1
+            return True
+        return False
+
+    def _acquire_slot(self):
+        with self._cond:
+            while not self._try_acquire_slot():
+                self._cond.wait()
+
+    def _release_slot(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def _quota_delay(self, prompt_tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(prompt_tokens))
+
+    def _on_success(self, output_tokens: int):
+        self.tokens.debit(output_tokens)
+        with self._cond:
+            self._stats["successes"] += 1
+            self.limit = min(self.max_inflight, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _on_throttle(self, attempt: int, error: Exception) -> float:
+        with self._cond:
+            self._stats["throttled"] += 1
+            now = time.monotonic()
+            # Errors from calls already in flight when we backed off describe the old window; decrease once per burst
+            if now - self._last_decrease > self.base_delay:
+                previous = self.limit
+                self.limit = max(float(self.min_inflight), self.limit / 2)
+                self._last_decrease = now
+                logger.warning(f"LLM throttled ({error}); concurrency limit {previous:.1f} -> {self.limit:.1f}")
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _record_wait(self, seconds: float):
+        if seconds > 0:
+            with self._cond:
+                self._stats["wait_seconds"] += seconds
+
+    def call(self, fn: Callable[[], T], prompt_tokens: int = 0, output_tokens: Callable[[T], int] = lambda _: 0) -> T:
+        """Run fn under the limiter, retrying throttling errors up to max_retries times."""
+        with self._cond:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            delay = self._quota_delay(prompt_tokens)
+            self._record_wait(delay)
+            time.sleep(delay)
+
+            self._acquire_slot()
+            try:
+                result = fn()
+            except Exception as e:
+                self._release_slot()
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                backoff = self._on_throttle(attempt, e)
+                with self._cond:
+                    self._stats["retries"] += 1
+                self._record_wait(backoff)
+                time.sleep(backoff)
+                attempt += 1
+                continue
+
+            self._release_slot()
+            self._on_success(output_tokens(result))
+            return result
+
+    def stream(self, fn: Callable[[], Iterator[str]], prompt_tokens: int = 0) -> Iterator[str]:
+        """
+        Iterate a streamed call under the limiter, holding its slot until the stream ends.
+
+        Throttling errors are retried only until the first chunk arrives; after that the
+        caller has already consumed output, so errors propagate.
+        """
+        with self._cond:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            delay = self._quota_delay(prompt_tokens)
+            self._record_wait(delay)
+            time.sleep(delay)
+
+            self._acquire_slot()
+            try:
+                chunks = iter(fn())
+                first = next(chunks, None)
+            except Exception as e:
+                self._release_slot()
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                backoff = self._on_throttle(attempt, e)
+                with self._cond:
+                    self._stats["retries"] += 1
+                self._record_wait(backoff)
+                time.sleep(backoff)
+                attempt += 1
+                continue
+            break
+
+        output_chars = 0
+        try:
+            if first is not None:
+                output_chars += len(first)
+                yield first
+            for chunk in chunks:
+                output_chars += len(chunk)
+                yield chunk
+        except GeneratorExit:
+            # Caller stopped reading early (e.g. it has all the items it needs); the call still succeeded
+            self._release_slot()
+            self._on_success((output_chars + 3) // 4)
+            raise
+        except Exception:
+            self._release_slot()
+            with self._cond:
+                self._stats["failures"] += 1
+            raise
+        self._release_slot()
+        self._on_success((output_chars + 3) // 4)
+
+    async def acall(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        prompt_tokens: int = 0,
+        output_tokens: Callable[[T], int] = lambda _: 0
+    ) -> T:
+        """Async counterpart of call; waits for a slot without blocking the event loop."""
+        with self._cond:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            delay = self._quota_delay(prompt_tokens)
+            self._record_wait(delay)
+            await asyncio.sleep(delay)
+
+            while True:
+                with self._cond:
+                    if self._try_acquire_slot():
+                        break
+                await asyncio.sleep(0.05)
+            try:
+                result = await fn()
+            except Exception as e:
+                self._release_slot()
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                backoff = self._on_throttle(attempt, e)
+                with self._cond:
+                    self._stats["retries"] += 1
+                self._record_wait(backoff)
+                await asyncio.sleep(backoff)
+                attempt += 1
+                continue
+
+            self._release_slot()
+            self._on_success(output_tokens(result))
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = {
+                **self._stats,
+                "wait_seconds": round(self._stats["wait_seconds"], 3),
+                "concurrency_limit": round(self.limit, 2),
+                "inflight": self.inflight,
+            }
+        stats["requests_per_minute"] = self.requests.capacity
+        stats["tokens_per_minute"] = self.tokens.capacity
+        stats["requests_available"] = round(self.requests.available(), 1)
+        stats["tokens_available"] = round(self.tokens.available(), 1)
+        return stats
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    """Return the process-wide rate limiter shared by every LLM caller."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
+
+
+def set_limiter(limiter: RateLimiter) -> RateLimiter:
+    """Replace the process-wide limiter, e.g. to start a benchmark run from fresh state."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+    return limiter
+
+
+def rate_limit_stats() -> Dict[str, Any]:
+    return get_limiter().stats()
@@ -0,0 +1,184 @@
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# "full" pastes the whole knowledge base into every prompt, "bm25" only the top-k relevant chunks
+KB_CONTEXT_MODE = os.getenv("KB_CONTEXT_MODE", "full")
+KB_TOP_K = int(os.getenv("KB_TOP_K", "4"))
+KB_CHUNK_CHARS = int(os.getenv("KB_CHUNK_CHARS", "1200"))
+
+_HEADING = re.compile(r"^#{1,6}\s+\S", re.MULTILINE)
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how", "i", "if",
+    "in", "is", "it", "me", "my", "of", "on", "or", "our", "so", "that", "the", "this", "to",
+    "what", "when", "which", "who", "will", "with", "you", "your",
+}
+
+_totals = {"queries": 0, "full_tokens": 0, "context_tokens": 0}
+_totals_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def split_sections(text: str, max_chars: int = KB_CHUNK_CHARS) -> List[str]:
+    """
+    Split markdown into chunks at headings, then pack paragraphs of long sections into chunks of
+    at most max_chars. Sub-chunks of a section repeat its heading so they stay self-describing.
+    """
+    starts = [m.start() for m in _HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    sections = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        section = text[start:end].strip()
+        # Fold heading-only or very short sections into the next one instead of indexing them alone
+        if sections and len(sections[-1]) < max_chars // 4 and len(sections[-1]) + len(section) + 2 <= max_chars:
+            sections[-1] = sections[-1] + "\n\n" + section
+        elif section:
+            sections.append(section)
+
+    chunks = []
+    for section in sections:
+        if len(section) <= max_chars:
+            chunks.append(section)
+            continue
+
+        first_line = section.split("\n", 1)[0]
+        heading = first_line if _HEADING.match(first_line) else ""
+        current = ""
+        for paragraph in re.split(r"\n\s*\n", section):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if current and len(current) + len(paragraph) + 2 > max_chars:
+                chunks.append(current)
+                current = heading + "\n\n" + paragraph if heading and paragraph != heading else paragraph
+            else:
+                current = current + "\n\n" + paragraph if current else paragraph
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+class KnowledgeBaseIndex:
+    """
+    BM25 index over knowledge base chunks.
+
+    Postings are kept per term as NumPy arrays of (chunk id, term frequency), so scoring a
+    query is a handful of vectorised updates over only the chunks containing its terms.
+    """
+
+    def __init__(self, text: str, max_chunk_chars: int = KB_CHUNK_CHARS, k1: float = 1.5, b: float = 0.75):
+        self.text = text
+        self.k1 = k1
+        self.b = b
+        self.chunks = split_sections(text, max_chunk_chars)
+        self.full_tokens = estimate_tokens(text)
+
+        postings: Dict[str, List[tuple]] = {}
+        lengths = []
+        for chunk_id, chunk in enumerate(self.chunks):
+            terms = tokenize(chunk)
+            lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                postings.setdefault(term, []).append((chunk_id, count))
+
+        self.doc_len = np.array(lengths, dtype=np.float32)
+        avgdl = float(self.doc_len.mean()) if len(lengths) else 0.0
+        # Per-chunk BM25 length normalisation, precomputed once
+        self._norm = self.k1 * (1 - self.b + self.b * self.doc_len / avgdl) if avgdl else np.full(len(lengths), self.k1, dtype=np.float32)
+
+        n = len(self.chunks)
+        self._postings = {}
+        for term, entries in postings.items():
+            ids = np.fromiter((e[0] for e in entries), dtype=np.int32, count=len(entries))
+            tf = np.fromiter((e[1] for e in entries), dtype=np.float32, count=len(entries))
+            idf = np.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+            self._postings[term] = (ids, tf, np.float32(idf))
+
+        self._stats = {"queries": 0, "full_tokens": 0, "context_tokens": 0}
+        self._lock = threading.Lock()
+        logger.debug(f"Indexed knowledge base into {n} chunks with {len(self._postings)} terms")
+
+    def score(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term, qtf in Counter(tokenize(query)).items():
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            ids, tf, idf = posting
+            scores[ids] += qtf * idf * tf * (self.k1 + 1) / (tf + self._norm[ids])
+        return scores
+
+    def top_k(self, query: str, k: int = KB_TOP_K) -> List[int]:
+        """Indices of the k best-scoring chunks, in document order."""
+        if k >= len(self.chunks):
+            return list(range(len(self.chunks)))
+        scores = self.score(query)
+        best = np.argpartition(-scores, k - 1)[:k]
+        # Drop chunks sharing no terms with the query, unless nothing matched at all
+        matched = [int(i) for i in best if scores[i] > 0]
+        return sorted(matched or (int(i) for i in best))
+
+    def context_for(self, query: str, k: int = KB_TOP_K) -> str:
+        """Knowledge base text to put in a prompt for this query, recording tokens saved."""
+        ids = self.top_k(query, k)
+        context = self.text if len(ids) == len(self.chunks) else "\n\n...\n\n".join(self.chunks[i] for i in ids)
+        context_tokens = estimate_tokens(context)
+
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["full_tokens"] += self.full_tokens
+            self._stats["context_tokens"] += context_tokens
+        with _totals_lock:
+            _totals["queries"] += 1
+            _totals["full_tokens"] += self.full_tokens
+            _totals["context_tokens"] += context_tokens
+        return context
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return _with_savings({**self._stats, "chunks": len(self.chunks)})
+
+
+def _with_savings(stats: Dict[str, float]) -> Dict[str, float]:
+    saved = stats["full_tokens"] - stats["context_tokens"]
+    stats["tokens_saved"] = saved
+    stats["saved_ratio"] = round(saved / stats["full_tokens"], 4) if stats["full_tokens"] else 0.0
+    return stats
+
+
+def retrieval_stats() -> Dict[str, float]:
+    """Process-wide prompt token savings from relevance-filtered knowledge base context."""
+    with _totals_lock:
+        return _with_savings(dict(_totals))
+
+
+def build_index(knowledge_base: str, mode: str = KB_CONTEXT_MODE) -> Optional[KnowledgeBaseIndex]:
+    """Return an index for "bm25" mode, or None when the full knowledge base should be used."""
+    mode = mode.lower()
+    if mode == "full":
+        return None
+    if mode != "bm25":
+        raise ValueError(f"Unknown knowledge base context mode '{mode}', expected 'full' or 'bm25'")
+    return KnowledgeBaseIndex(knowledge_base)
@@ -0,0 +1,103 @@
+import os
+import json
+import shutil
+import uuid
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+from .llm import get_backend
+from .digest import content_hash, KB_DIGEST_MODE, KB_DIGEST_THRESHOLD_CHARS, KB_DIGEST_CHUNK_CHARS, KB_DIGEST_MODEL
+from .retrieval import KB_CONTEXT_MODE, KB_TOP_K, KB_CHUNK_CHARS
+from .creator import GENERATION_MODEL, NUM_CLIENT_TYPES, STREAM_QUESTIONS, format_final_outputs
+from .analyzer import CLIENT_TYPE_ANALYSIS_MODEL, SUMMARY_ANALYSIS_MODEL
+from .database import set_document_content_hash, create_cloned_generation
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# How long an Idempotency-Key keeps returning the generation it created
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", str(24 * 3600)))
+
+
+def document_hash(document: Dict[str, Any]) -> str:
+    """SHA-256 of a processed document's parsed content, computed once and stored on the row."""
+    if document.get('content_hash'):
+        return document['content_hash']
+    with open(document['output_path'], 'r', encoding='utf-8') as f:
+        text_hash = content_hash(f.read())
+    set_document_content_hash(document['id'], text_hash)
+    return text_hash
+
+
+def request_signature(kb_doc: Dict[str, Any], persona_doc: Dict[str, Any], questions_per_client: int) -> str:
+    """
+    Identity of a generation's inputs: document contents rather than ids, so the same
+    knowledge base and persona uploaded by different users match, plus every setting
+    that changes the output.
+    """
+    inputs = {
+        "knowledge_base": document_hash(kb_doc),
+        "agent_persona": document_hash(persona_doc),
+        "questions_per_client": questions_per_client,
+        "model": f"{get_backend().name}/{GENERATION_MODEL}",
+        "analysis_models": [CLIENT_TYPE_ANALYSIS_MODEL, SUMMARY_ANALYSIS_MODEL],
+        "client_types": NUM_CLIENT_TYPES,
+        "stream_questions": STREAM_QUESTIONS,
+        "kb_mode": KB_CONTEXT_MODE,
+        "kb_retrieval": [KB_TOP_K, KB_CHUNK_CHARS],
+        "kb_digest": [KB_DIGEST_MODE, KB_DIGEST_THRESHOLD_CHARS, KB_DIGEST_CHUNK_CHARS, KB_DIGEST_MODEL],
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def request_hash(body: Dict[str, Any]) -> str:
+    """Hash of a request body, to tell an idempotent retry from a key reused for a different request."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def clone_generation(
+    source: Dict[str, Any],
+    user_id: int,
+    username: str,
+    knowledge_base_id: int,
+    agent_persona_id: int,
+    output_dir: str,
+    priority: str = "normal",
+    idempotency_key: Optional[str] = None,
+    body_hash: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Create a completed generation for user_id by copying source's artifacts instead of
+    calling the LLM: prompt outputs (and checkpoints), the analysis report, and the
+    server bot persona and knowledge base files rebuilt for username.
+    
+    Raises ValueError if output_dir is source's own directory.
+    """
+    if os.path.abspath(source['output_directory']) == os.path.abspath(output_dir):
+        raise ValueError(f"Generation {source['id']} cannot be cloned into its own output directory")
+    analysis_path = None
+    try:
+        shutil.copytree(source['output_directory'], output_dir, dirs_exist_ok=True)
+        format_final_outputs(Path(output_dir), username)
+        if source.get('analysis_path') and os.path.exists(source['analysis_path']):
+            analysis_dir = Path("data/analysis")
+            os.makedirs(analysis_dir, exist_ok=True)
+            analysis_path = str(analysis_dir / f"{username}_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}_clone{source['id']}_{uuid.uuid4().hex[:8]}.md")
+            shutil.copyfile(source['analysis_path'], analysis_path)
+        generation = create_cloned_generation(
+            source, user_id, knowledge_base_id, agent_persona_id, output_dir, analysis_path,
+            priority=priority, idempotency_key=idempotency_key, request_hash=body_hash
+        )
+    except Exception:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        if analysis_path and os.path.exists(analysis_path):
+            os.remove(analysis_path)
+        raise
+    logger.info(f"Generation {generation['id']} cloned from generation {source['id']}")
+    return generation
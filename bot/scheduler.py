@@ -0,0 +1,151 @@
+import os
+import asyncio
+import itertools
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+from .executor import run_task, EXECUTOR_TASK_WORKERS
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# Generation and analysis jobs one user may have running at once; the rest wait in the queue
+SCHEDULER_MAX_JOBS_PER_USER = int(os.getenv("SCHEDULER_MAX_JOBS_PER_USER", "2"))
+# Jobs the API process runs at once in JOB_QUEUE_MODE=inline
+SCHEDULER_MAX_RUNNING = int(os.getenv("SCHEDULER_MAX_RUNNING", str(EXECUTOR_TASK_WORKERS)))
+# Same setting as creator.NUM_CLIENT_TYPES, used to estimate job cost
+NUM_CLIENT_TYPES = int(os.getenv("CREATOR_NUM_CLIENT_TYPES", "2"))
+
+# Share of the queue a job gets relative to a normal one
+PRIORITY_WEIGHTS = {"low": 0.5, "normal": 1.0, "high": 2.0}
+PRIORITIES = tuple(PRIORITY_WEIGHTS)
+
+
+def job_cost(kind: str, payload: Dict[str, Any]) -> float:
+    """Estimated LLM calls of a job, the unit of fair share."""
+    if kind == "generation":
+        questions = payload.get("questions_per_client") or 5
+        return 1 + NUM_CLIENT_TYPES * (1 + questions) + NUM_CLIENT_TYPES + 1
+    if kind == "analysis":
+        return NUM_CLIENT_TYPES + 1
+    return 1.0
+
+
+def fair_tags(virtual_time: float, user_last_finish: Optional[float], cost: float, priority: str = "normal") -> Tuple[float, float]:
+    """
+    Start and finish tags of a new job under start-time fair queuing.
+
+    A job starts at the later of the current virtual time and the finish tag of its user's
+    previous job, and finishes cost / weight later. Serving jobs in finish tag order gives
+    each user with queued work an equal (weighted) share, however many jobs they submit.
+    """
+    start = max(virtual_time, user_last_finish or 0.0)
+    return start, start + cost / PRIORITY_WEIGHTS.get(priority, 1.0)
+
+
+class _Entry:
+    def __init__(self, seq: int, user_id: Any, key: Any, kind: str, start: float, finish: float, fn: Callable, kwargs: Dict[str, Any]):
+        self.seq = seq
+        self.user_id = user_id
+        self.key = key
+        self.kind = kind
+        self.start = start
+        self.finish = finish
+        self.fn = fn
+        self.kwargs = kwargs
+
+
+class FairScheduler:
+    """
+    In-process weighted fair queue for generation and analysis jobs (JOB_QUEUE_MODE=inline).
+
+    Jobs are ordered by fair_tags finish tag, so one user's backlog interleaves with other
+    users' jobs instead of running ahead of them. At most max_running jobs run at once on
+    the task executor, and at most max_per_user of them for the same user. Must be used
+    from the event loop thread. Workers apply the same policy through the jobs table.
+    """
+
+    def __init__(self, max_running: int = SCHEDULER_MAX_RUNNING, max_per_user: int = SCHEDULER_MAX_JOBS_PER_USER):
+        self.max_running = max(1, max_running)
+        self.max_per_user = max(1, max_per_user)
+        self.virtual_time = 0.0
+        self._queue: List[_Entry] = []
+        self._running_by_user: Counter = Counter()
+        self._running = 0
+        self._last_finish: Dict[Any, float] = {}
+        # Finish tag of each user's latest dispatched job, what _last_finish falls back to on discard
+        self._dispatched_finish: Dict[Any, float] = {}
+        self._tasks = set()
+        self._seq = itertools.count()
+
+    def submit(self, user_id: Any, key: Any, kind: str, cost: float, priority: str, fn: Callable, **kwargs):
+        """Queue fn(**kwargs); key (e.g. a generation id) identifies the job for discard and queue_positions."""
+        start, finish = fair_tags(self.virtual_time, self._last_finish.get(user_id), cost, priority)
+        self._last_finish[user_id] = finish
+        self._queue.append(_Entry(next(self._seq), user_id, key, kind, start, finish, fn, kwargs))
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._running < self.max_running:
+            eligible = [e for e in self._queue if self._running_by_user[e.user_id] < self.max_per_user]
+            if not eligible:
+                return
+            entry = min(eligible, key=lambda e: (e.finish, e.seq))
+            self._queue.remove(entry)
+            self._running += 1
+            self._running_by_user[entry.user_id] += 1
+            self.virtual_time = max(self.virtual_time, entry.start)
+            self._dispatched_finish[entry.user_id] = max(self._dispatched_finish.get(entry.user_id, 0.0), entry.finish)
+            task = asyncio.ensure_future(run_task(entry.fn, **entry.kwargs))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t, e=entry: self._done(e, t))
+
+    def _done(self, entry: _Entry, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._running -= 1
+        self._running_by_user[entry.user_id] -= 1
+        if not task.cancelled() and task.exception() is not None:
+            # Already logged and recorded on the generation by the task itself
+            logger.debug(f"{entry.kind} job {entry.key} failed: {task.exception()}")
+        self._dispatch()
+
+    def discard(self, key: Any) -> bool:
+        """Drop queued (not yet running) jobs for key; True if any were dropped."""
+        dropped = [e for e in self._queue if e.key == key]
+        if not dropped:
+            return False
+        self._queue = [e for e in self._queue if e.key != key]
+        # Dropped jobs no longer hold their users' place in line
+        for user_id in {e.user_id for e in dropped}:
+            finishes = [e.finish for e in self._queue if e.user_id == user_id]
+            if user_id in self._dispatched_finish:
+                finishes.append(self._dispatched_finish[user_id])
+            if finishes:
+                self._last_finish[user_id] = max(finishes)
+            else:
+                self._last_finish.pop(user_id, None)
+        return True
+
+    def queue_positions(self) -> Dict[Any, int]:
+        """1-based position of each queued key in service order, ignoring per-user caps."""
+        positions = {}
+        for position, entry in enumerate(sorted(self._queue, key=lambda e: (e.finish, e.seq)), 1):
+            positions.setdefault(entry.key, position)
+        return positions
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._queue),
+            "running": self._running,
+            "max_running": self.max_running,
+            "max_per_user": self.max_per_user,
+            "users_running": sum(1 for count in self._running_by_user.values() if count > 0),
+        }
+
+
+scheduler = FairScheduler()
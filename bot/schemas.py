@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from pydantic import BaseModel, EmailStr, Field, validator
 
@@ -65,6 +65,10 @@ class GenerationCreate(BaseModel):
     knowledge_base_id: int
     agent_persona_id: int
     questions_per_client: Optional[int] = 5
+    # Fair share weight among this user's and other users' queued jobs: low, normal or high
+    priority: Optional[str] = "normal"
+    # Copy the artifacts of a completed generation with identical inputs instead of calling the LLM
+    reuse_existing: Optional[bool] = False
 
 
 class GenerationResponse(BaseModel):
@@ -79,11 +83,29 @@ class GenerationResponse(BaseModel):
     error_message: Optional[str] = None
     analysis_path: Optional[str] = None
     analysis_completed: bool
+    planned_calls: Optional[int] = None
+    completed_calls: Optional[int] = None
+    current_stage: Optional[str] = None
+    avg_seconds_per_call: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    progress_updated_at: Optional[datetime] = None
+    priority: Optional[str] = "normal"
+    # Position among queued jobs while pending; None once running or finished
+    queue_position: Optional[int] = None
+    # Generation whose artifacts this one copied (reuse_existing)
+    cloned_from: Optional[int] = None
 
     class Config:
         orm_mode = True
 
 
+class ReusableGenerationResponse(BaseModel):
+    # Whether POST /generations with reuse_existing would copy a completed generation
+    available: bool
+    completed_at: Optional[datetime] = None
+    age_seconds: Optional[float] = None
+
+
 class ClientTypeResponse(BaseModel):
     id: int
     name: str
@@ -117,6 +139,33 @@ class AnalysisResponse(BaseModel):
         orm_mode = True
 
 
+# Dashboard statistics schemas
+class DocumentCounts(BaseModel):
+    total: int
+    processed: int
+    pending: int
+    failed: int
+
+
+class DocumentStats(DocumentCounts):
+    by_type: Dict[str, DocumentCounts] = {}
+
+
+class GenerationStats(BaseModel):
+    total: int
+    by_status: Dict[str, int] = {}
+    questions_total: int
+    client_types_total: int
+    average_duration_seconds: Optional[float] = None
+    analyses_completed: int
+    analysis_completion_rate: Optional[float] = None
+
+
+class StatsResponse(BaseModel):
+    documents: DocumentStats
+    generations: GenerationStats
+
+
 # Token schemas
 class Token(BaseModel):
     access_token: str
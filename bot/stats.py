@@ -0,0 +1,96 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+# Seconds a user's GET /stats aggregates are served from memory; writes made by this process
+# clear them sooner, writes made by workers only show up once they expire
+STATS_CACHE_TTL_SECONDS = float(os.getenv("STATS_CACHE_TTL_SECONDS", "10"))
+# Users whose aggregates are kept at once; the least recently cached are dropped first
+STATS_CACHE_MAX_USERS = int(os.getenv("STATS_CACHE_MAX_USERS", "10000"))
+
+
+class StatsCache:
+    """
+    Short-lived per-user cache of dashboard aggregates.
+
+    bot.database invalidates a user's entry when a write touching their documents or
+    generations commits. Each invalidation stamps the user with a new version from a global
+    clock, and put() drops a value computed under an older version, so a query that raced a
+    write cannot cache what it read before the write. Versions are kept for the
+    max_users most recently invalidated users; users without one are at the floor version,
+    which rises to cover every version that is forgotten (and to the clock when everything
+    is invalidated). Thread-safe: writes invalidate from executor threads.
+    """
+
+    def __init__(self, ttl_seconds: float = STATS_CACHE_TTL_SECONDS, max_users: int = STATS_CACHE_MAX_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max(1, max_users)
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._versions: "OrderedDict[Any, int]" = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _version(self, user_id: Any) -> int:
+        return self._versions.get(user_id, self._floor)
+
+    def version(self, user_id: Any) -> int:
+        """Token to pass to put() for a value computed from now on."""
+        with self._lock:
+            return self._version(user_id)
+
+    def get(self, user_id: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != self._version(user_id):
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            return entry[2]
+
+    def put(self, user_id: Any, version: int, value: Dict[str, Any]):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            if version != self._version(user_id):
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, version, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: Any = None):
+        """Drop user_id's aggregates, or every user's when user_id is None."""
+        with self._lock:
+            self._stats["invalidations"] += 1
+            self._clock += 1
+            if user_id is None:
+                self._floor = self._clock
+                self._entries.clear()
+                self._versions.clear()
+                return
+            self._versions[user_id] = self._clock
+            self._versions.move_to_end(user_id)
+            self._entries.pop(user_id, None)
+            while len(self._versions) > self.max_users:
+                # Raising the floor past the forgotten version keeps that user's stale puts out
+                _, forgotten = self._versions.popitem(last=False)
+                self._floor = max(self._floor, forgotten)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats, "users": len(self._entries), "versions": len(self._versions),
+                "ttl_seconds": self.ttl_seconds
+            }
+
+
+stats_cache = StatsCache()
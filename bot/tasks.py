@@ -0,0 +1,222 @@
+import os
+from pathlib import Path
+
+from .database import (
+    get_document, update_document_processed, update_document_error,
+    get_generation, get_generation_status, update_generation_status, update_generation_counts,
+    create_client_types, delete_client_types_by_generation, unit_of_work,
+    update_generation_analysis, complete_generation_analysis, update_generation_analysis_error
+)
+from .utils import setup_logger
+from .parser import parse_document
+from .creator import create_prompts, format_final_outputs
+from .analyzer import analyze_prompts
+from .digest import get_digest, should_use_digest
+from .events import generation_progress
+from .progress import GenerationProgress
+from . import cancellation
+from .cancellation import GenerationCancelled
+
+logger = setup_logger(__name__)
+
+# Work run either inline by the API (BackgroundTasks) or by bot.worker processes from the jobs table.
+# Each function records its outcome on the document/generation row and raises on failure so the
+# worker can retry it.
+
+
+def run_document_processing(document_id: int):
+    """Parse an uploaded document and store its output path and preview."""
+    db_document = get_document(document_id)
+    if not db_document:
+        logger.error(f"Document not found: {document_id}")
+        return
+
+    try:
+        # Construct a proper output path for the parsed document
+        # e.g., data/parsed/user_<user_id>_doc_<document_id>_<filename>.md
+        original_filename = os.path.basename(db_document['file_path'])
+        parsed_filename = f"user_{db_document['user_id']}_doc_{document_id}_{original_filename}.md"
+        parsed_output_dir = os.path.join("data", "parsed")
+        os.makedirs(parsed_output_dir, exist_ok=True)
+        output_path = os.path.join(parsed_output_dir, parsed_filename)
+
+        content = parse_document(db_document['file_path'], output_path)
+
+        # Precompute the digest for large knowledge bases so generations start from it
+        if db_document['document_type'] == "knowledge_base" and content and should_use_digest(content):
+            try:
+                get_digest(output_path, content)
+            except Exception as e:
+                logger.error(f"Error building digest for document {document_id}: {str(e)}")
+
+        # Get content preview (strictly < 512 chars)
+        content_preview = None
+        preview_max_len = 500
+        try:
+            with open(output_path, "r", encoding="utf-8") as f:
+                content = f.read(preview_max_len)
+            if len(content) >= preview_max_len:
+                content_preview = content[:preview_max_len - 3] + "..."
+            else:
+                content_preview = content
+        except Exception as e:
+            logger.error(f"Error reading content preview from {output_path}: {str(e)}")
+
+        update_document_processed(document_id, output_path, content_preview)
+        logger.info(f"Document processed successfully: {document_id}")
+    except Exception as e:
+        logger.error(f"Error processing document {document_id}: {str(e)}")
+        update_document_error(document_id, str(e))
+        raise
+
+
+def run_generation(
+    generation_id: int,
+    kb_path: str,
+    persona_path: str,
+    output_dir: str,
+    questions_per_client: int,
+    resume: bool = False
+):
+    """Generate client types, questions and responses for a generation, then analyze them."""
+    generation = get_generation(generation_id)
+    if not generation:
+        logger.error(f"Generation not found: {generation_id}")
+        return
+
+    if generation['status'] == "cancelled":
+        logger.info(f"Skipping cancelled generation {generation_id}")
+        return
+
+    log_username = generation.get('username') or f"user_{generation['user_id']}"
+    progress = GenerationProgress(generation_id, questions_per_client, forward=generation_progress(generation_id))
+    # The stored status is polled too, so a cancel recorded by another process is noticed
+    cancel = cancellation.register(generation_id, check=lambda: get_generation_status(generation_id) in ("cancelled", None))
+
+    try:
+        update_generation_status(generation_id, "processing")
+        progress("status", status="processing", resume=resume)
+
+        generation_specific_output_dir = Path(output_dir)
+        client_type_objects = create_prompts(
+            knowledge_base_path=kb_path,
+            agent_persona_path=persona_path,
+            questions_per_client=questions_per_client,
+            output_dir=generation_specific_output_dir,
+            username_for_logging=log_username,
+            resume=resume,
+            progress=progress,
+            cancel=cancel
+        )
+
+        if not client_type_objects:
+            raise RuntimeError("Failed to generate client types in creator module")
+
+        # Client type records and counts in one transaction
+        client_types = [
+            (
+                client_obj.client_type,
+                client_obj.description,
+                len(getattr(client_obj, 'questions', [])),
+                str(generation_specific_output_dir / f"{client_obj.client_type}_prompt.txt")
+            )
+            for client_obj in client_type_objects
+        ]
+        client_type_count = len(client_types)
+        question_count = sum(client_type[2] for client_type in client_types)
+        with unit_of_work():
+            if resume:
+                # A previous attempt may have inserted some client types before it stopped
+                delete_client_types_by_generation(generation_id)
+            create_client_types(generation_id, client_types)
+            update_generation_counts(generation_id, client_type_count, question_count)
+
+        server_bot_persona, kb_qa_path, _ = format_final_outputs(generation_specific_output_dir, log_username)
+
+        # Perform analysis automatically
+        cancel.raise_if_cancelled()
+        progress("stage", stage="analysis")
+        report_file, analysis_error = None, None
+        try:
+            analysis_dir = Path("data/analysis")
+            os.makedirs(analysis_dir, exist_ok=True)
+            report_file = analyze_prompts(
+                username=log_username,
+                prompts_dir=generation_specific_output_dir,
+                output_dir=analysis_dir,
+                progress=progress,
+                cancel=cancel
+            )
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error in automatic analysis for generation {generation_id}: {str(e)}")
+            analysis_error = str(e)
+
+        cancel.raise_if_cancelled()
+        # Analysis outcome and completion in one transaction
+        with unit_of_work():
+            if report_file:
+                update_generation_analysis(generation_id, str(report_file))
+                complete_generation_analysis(generation_id)
+            else:
+                update_generation_analysis_error(generation_id, analysis_error)
+            update_generation_status(generation_id, "completed")
+        if report_file:
+            logger.info(f"Analysis completed automatically for generation {generation_id}")
+            progress("analysis", status="completed")
+        else:
+            progress("analysis", status="failed", error=analysis_error)
+        progress("status", status="completed", client_types=client_type_count, questions=question_count)
+        logger.info(f"Generation completed for {generation_id}. Created {client_type_count} client types with {question_count} questions.")
+        logger.info(f"Final outputs: Persona: {server_bot_persona}, KB: {kb_qa_path}")
+    except GenerationCancelled:
+        # Not a failure: the job is done and must not be retried
+        logger.info(f"Generation {generation_id} cancelled")
+        if get_generation_status(generation_id) not in ("cancelled", None):
+            update_generation_status(generation_id, "cancelled")
+        progress("status", status="cancelled")
+    except Exception as e:
+        logger.error(f"Error in generation task {generation_id}: {str(e)}", exc_info=True)
+        update_generation_status(generation_id, "failed", str(e))
+        progress("status", status="failed", error=str(e))
+        raise
+    finally:
+        cancellation.unregister(generation_id, cancel)
+
+
+def run_analysis(generation_id: int, prompts_dir: str, analysis_path: str):
+    """Analyze a completed generation's prompts into a markdown report."""
+    generation = get_generation(generation_id)
+    if not generation:
+        logger.error(f"Generation not found: {generation_id}")
+        return
+
+    progress = generation_progress(generation_id)
+    progress("analysis", status="processing")
+    try:
+        report_file = analyze_prompts(
+            username=generation.get('username') or f"user_{generation['user_id']}",
+            prompts_dir=Path(prompts_dir),
+            output_dir=Path(analysis_path).parent,
+            progress=progress
+        )
+        # The analyzer names its own report file; point the generation at it
+        with unit_of_work():
+            update_generation_analysis(generation_id, str(report_file))
+            complete_generation_analysis(generation_id)
+        logger.info(f"Analysis task completed for generation: {generation_id}")
+        progress("analysis", status="completed")
+    except Exception as e:
+        logger.error(f"Error in analysis task for generation {generation_id}: {str(e)}")
+        update_generation_analysis_error(generation_id, str(e))
+        progress("analysis", status="failed", error=str(e))
+        raise
+
+
+# Job kinds handled by bot.worker, mapped to the function that runs them
+TASKS = {
+    "document": run_document_processing,
+    "generation": run_generation,
+    "analysis": run_analysis,
+}
@@ -1,3 +1,4 @@
+import json
 import logging
 import sys
 import os
@@ -36,4 +37,52 @@ def setup_logger(name: str, level: str = "INFO") -> logging.Logger:
         handler.setFormatter(formatter)
         logger.addHandler(handler)
 
-    return logger 
\ No newline at end of file
+    return logger 
+
+class JSONArrayStream:
+    """
+    Incremental parser for a JSON array of objects arriving in chunks, e.g. a streamed LLM reply.
+
+    feed() returns the objects completed by the new text. Anything before the opening '['
+    (such as a ```json fence) is skipped, and elements that fail to parse are dropped.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = None
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        items = []
+        while self._pos < len(self.text) and not self.done:
+            ch = self.text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = self._depth > 0
+            elif ch in "[{":
+                if self._depth == 1 and ch == "{":
+                    self._start = self._pos
+                self._depth += 1
+            elif ch in "]}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 1 and ch == "}" and self._start is not None:
+                    try:
+                        items.append(json.loads(self.text[self._start:self._pos + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._start = None
+                elif self._depth == 0:
+                    self.done = True
+            self._pos += 1
+        return items
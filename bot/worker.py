@@ -0,0 +1,164 @@
+import os
+import signal
+import socket
+import argparse
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from .utils import setup_logger
+from .database import init_db, claim_job, heartbeat_job, complete_job, fail_job, get_job_counts
+from .llm import set_backend, LLM_BACKEND
+from .tasks import TASKS
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+logger = setup_logger(__name__)
+
+# A job whose worker stops heartbeating becomes claimable again after this many seconds
+WORKER_LEASE_SECONDS = int(os.getenv("WORKER_LEASE_SECONDS", "60"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+# Delay before retrying a failed job, doubled on every further attempt
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "30"))
+
+
+class Worker:
+    """
+    Claims jobs from the jobs table and runs them.
+
+    A claimed job is leased for lease_seconds and the lease is renewed by a heartbeat
+    thread every third of that, so a job is only handed to another worker once its
+    current one has stopped heartbeating (crashed, killed or lost its node).
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        kinds: Optional[List[str]] = None,
+        lease_seconds: int = WORKER_LEASE_SECONDS,
+        poll_seconds: float = WORKER_POLL_SECONDS,
+        retry_delay_seconds: float = JOB_RETRY_DELAY_SECONDS,
+        stop_event: Optional[threading.Event] = None
+    ):
+        self.worker_id = worker_id
+        self.kinds = kinds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.retry_delay_seconds = retry_delay_seconds
+        self.stop_event = stop_event or threading.Event()
+
+    def _heartbeat(self, job_id: int, done: threading.Event):
+        while not done.wait(self.lease_seconds / 3):
+            if not heartbeat_job(job_id, self.worker_id, self.lease_seconds):
+                logger.warning(f"[{self.worker_id}] Lost lease on job {job_id}; another worker may run it")
+                return
+
+    def run_job(self, job: dict):
+        kind = job['kind']
+        payload = dict(job['payload'])
+        task = TASKS.get(kind)
+        if task is None:
+            fail_job(job['id'], self.worker_id, f"Unknown job kind '{kind}'")
+            return
+
+        if kind == "generation" and job['attempts'] > 1:
+            # Pick up the checkpoints left by the previous attempt instead of starting over
+            payload['resume'] = True
+
+        logger.info(f"[{self.worker_id}] Running {kind} job {job['id']} (attempt {job['attempts']}/{job['max_attempts']})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job['id'], done), daemon=True)
+        heartbeat.start()
+        try:
+            task(**payload)
+        except Exception as e:
+            delay = self.retry_delay_seconds * (2 ** (job['attempts'] - 1))
+            status = fail_job(job['id'], self.worker_id, str(e), retry_delay_seconds=delay)
+            if status == "queued":
+                logger.warning(f"[{self.worker_id}] Job {job['id']} failed, retrying in {delay:.0f}s: {e}")
+            else:
+                logger.error(f"[{self.worker_id}] Job {job['id']} failed permanently: {e}")
+        else:
+            if complete_job(job['id'], self.worker_id):
+                logger.info(f"[{self.worker_id}] Completed {kind} job {job['id']}")
+            else:
+                logger.warning(f"[{self.worker_id}] Finished job {job['id']} after its lease was lost")
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def run_once(self) -> bool:
+        """Claim and run a single job; returns False when nothing was runnable."""
+        job = claim_job(self.worker_id, self.lease_seconds, self.kinds)
+        if job is None:
+            return False
+        self.run_job(job)
+        return True
+
+    def run(self, drain: bool = False):
+        """Poll for jobs until stopped, or until the queue is empty when drain is set."""
+        logger.info(f"[{self.worker_id}] Worker started (kinds: {self.kinds or 'all'}, lease: {self.lease_seconds}s)")
+        while not self.stop_event.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                # Database busy or unavailable; back off and keep polling
+                logger.error(f"[{self.worker_id}] Error claiming job: {e}", exc_info=True)
+            if drain:
+                break
+            self.stop_event.wait(self.poll_seconds)
+        logger.info(f"[{self.worker_id}] Worker stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs (document parsing, generation, analysis) from the jobs table.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Jobs run concurrently by this process.")
+    parser.add_argument("--kinds", type=str, default="", help="Comma-separated job kinds to run (default: all).")
+    parser.add_argument("--lease", type=int, default=WORKER_LEASE_SECONDS, help="Lease length in seconds.")
+    parser.add_argument("--poll", type=float, default=WORKER_POLL_SECONDS, help="Seconds between polls when the queue is empty.")
+    parser.add_argument("--drain", action="store_true", help="Exit once no runnable job is left.")
+    parser.add_argument("--backend", type=str, default=LLM_BACKEND, choices=["gemini", "fake"], help="LLM backend to use.")
+    args = parser.parse_args()
+
+    set_backend(args.backend)
+    init_db()
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()] or None
+    logger.info(f"Jobs by status: {get_job_counts()}")
+
+    stop_event = threading.Event()
+
+    def _stop(signum, frame):
+        # Finish the jobs in hand, then exit; a second signal kills the process as usual
+        logger.info("Stopping after current jobs")
+        stop_event.set()
+        signal.signal(signum, signal.SIG_DFL)
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    base_id = f"{socket.gethostname()}:{os.getpid()}"
+    threads = []
+    for i in range(max(1, args.concurrency)):
+        worker = Worker(
+            worker_id=f"{base_id}:{i}",
+            kinds=kinds,
+            lease_seconds=args.lease,
+            poll_seconds=args.poll,
+            stop_event=stop_event
+        )
+        thread = threading.Thread(target=worker.run, kwargs={"drain": args.drain}, name=f"worker-{i}")
+        thread.start()
+        threads.append(thread)
+
+    # Join with a timeout so the main thread keeps handling signals
+    while any(t.is_alive() for t in threads):
+        for thread in threads:
+            thread.join(timeout=0.5)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import os
 import json
 import time
+import uuid
 import requests
 import tempfile
 import streamlit as st
@@ -13,6 +14,9 @@ load_dotenv()
 # API URL from environment or default to localhost
 API_URL = os.getenv("API_URL", "http://localhost:8000")
 
+# Rows per page of the document and generation lists
+PAGE_SIZE = int(os.getenv("UI_PAGE_SIZE", "20"))
+
 # Set page configuration
 st.set_page_config(
     page_title="BFSI Sales Bot Generator",
@@ -30,6 +34,9 @@ if "username" not in st.session_state:
     st.session_state.username = None
 if "current_page" not in st.session_state:
     st.session_state.current_page = "login"
+# Idempotency-Key of the last generation submitted, so a double click does not start it twice
+if "generation_request" not in st.session_state:
+    st.session_state.generation_request = None
 
 
 # Helper functions for API requests
@@ -70,11 +77,58 @@ def api_request(endpoint, method="GET", data=None, files=None, headers=None):
                 error_msg = f"API Error: {error_data['detail']}"
         except:
             pass
+        # Overloaded (503) or over the per-user limit (429): say when to try again
+        retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+        if retry_after:
+            error_msg += f" Try again in about {retry_after} seconds."
         
         st.error(error_msg)
         return None
 
 
+def api_page(endpoint, params=None):
+    """GET one page of a list endpoint: (items, cursor of the next page or None, total matching)."""
+    headers = {"Authorization": f"Bearer {st.session_state.token}"} if st.session_state.token else {}
+    try:
+        response = requests.get(f"{API_URL}{endpoint}", params=params, headers=headers)
+        response.raise_for_status()
+        return response.json(), response.headers.get("X-Next-Cursor"), int(response.headers.get("X-Total-Count", 0))
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {str(e)}")
+        return [], None, 0
+
+
+def fetch_page(key, endpoint, params=None):
+    """
+    The page of a list the user has paged to. The cursors of the pages before it are kept
+    in session state under key, so Previous can go back.
+    """
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    query = {**(params or {}), "limit": PAGE_SIZE}
+    if cursors[-1] is not None:
+        query["after"] = cursors[-1]
+    items, next_cursor, total = api_page(endpoint, query)
+    if not items and len(cursors) > 1:
+        # Everything on this page was deleted; start over from the first page
+        cursors[:] = [None]
+        return fetch_page(key, endpoint, params)
+    return items, next_cursor, total
+
+
+def page_controls(key, next_cursor, total):
+    """Previous/Next buttons for a list fetched with fetch_page."""
+    cursors = st.session_state[f"{key}_cursors"]
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        if len(cursors) > 1:
+            st.button("Previous", key=f"{key}_previous", on_click=cursors.pop)
+    with col2:
+        if next_cursor:
+            st.button("Next", key=f"{key}_next", on_click=cursors.append, args=(next_cursor,))
+    with col3:
+        st.caption(f"Page {len(cursors)} of {max(1, -(-total // PAGE_SIZE))} ({total} total)")
+
+
 # Authentication functions
 def login(username, password):
     """Log in user and set token."""
@@ -217,22 +271,42 @@ def show_dashboard():
     """Show the main dashboard."""
     st.title("Dashboard")
     
-    # Fetch user's data
-    documents = api_request("/documents") or []
-    generations = api_request("/generations") or []
+    # Aggregates are computed by the API; only the five most recent generations are fetched
+    stats = api_request("/stats") or {}
+    document_stats = stats.get("documents", {})
+    generation_stats = stats.get("generations", {})
+    generations, _, _ = api_page("/generations", {
+        "limit": 5, "fields": "id,status,started_at,completed_at,client_types_count,questions_count"
+    })
     
     # Display stats
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Documents", len(documents))
+        st.metric("Documents", document_stats.get("total", 0))
+        st.caption(f"{document_stats.get('processed', 0)} processed, {document_stats.get('pending', 0)} pending, "
+                   f"{document_stats.get('failed', 0)} failed")
     
     with col2:
-        st.metric("Generations", len(generations))
+        st.metric("Generations", generation_stats.get("total", 0))
+        by_status = generation_stats.get("by_status", {})
+        st.caption(", ".join(f"{count} {status}" for status, count in sorted(by_status.items())) or "None yet")
     
     with col3:
-        completed_gens = sum(1 for g in generations if g.get("status") == "completed")
-        st.metric("Completed Generations", completed_gens)
+        st.metric("Completed Generations", generation_stats.get("by_status", {}).get("completed", 0))
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric("Total Questions", generation_stats.get("questions_total", 0))
+    
+    with col2:
+        average_duration = generation_stats.get("average_duration_seconds")
+        st.metric("Average Duration", f"{average_duration / 60:.1f} min" if average_duration is not None else "—")
+    
+    with col3:
+        analysis_rate = generation_stats.get("analysis_completion_rate")
+        st.metric("Analyzed", f"{analysis_rate:.0%}" if analysis_rate is not None else "—")
     
     # Quick actions
     st.subheader("Quick Actions")
@@ -251,15 +325,8 @@ def show_dashboard():
     st.subheader("Recent Activity")
     
     if generations:
-        # Sort generations by started_at (recent first)
-        recent_generations = sorted(
-            generations, 
-            key=lambda x: datetime.fromisoformat(x["started_at"].replace("Z", "+00:00")), 
-            reverse=True
-        )[:5]
-        
-        # Display recent generations
-        for gen in recent_generations:
+        # Display recent generations (the API returns newest first)
+        for gen in generations:
             with st.expander(f"Generation #{gen['id']} - {gen['status'].title()}"):
                 col1, col2 = st.columns(2)
                 with col1:
@@ -331,14 +398,11 @@ def show_documents_page():
                     except:
                         st.error(f"Upload failed: {response.text}")
     
-    # Fetch and display documents
-    documents = api_request("/documents") or []
+    # Fetch and display the current page of each document type
+    kb_docs, kb_next, kb_total = fetch_page("kb_documents", "/documents", {"document_type": "knowledge_base"})
+    persona_docs, persona_next, persona_total = fetch_page("persona_documents", "/documents", {"document_type": "agent_persona"})
     
-    if documents:
-        # Separate documents by type
-        kb_docs = [d for d in documents if d["document_type"] == "knowledge_base"]
-        persona_docs = [d for d in documents if d["document_type"] == "agent_persona"]
-        
+    if kb_total or persona_total:
         col1, col2 = st.columns(2)
         
         with col1:
@@ -359,6 +423,7 @@ def show_documents_page():
                                 st.success("Document deleted successfully.")
                                 # Refresh the page
                                 st.rerun()
+                page_controls("kb_documents", kb_next, kb_total)
             else:
                 st.info("No knowledge base documents uploaded yet.")
         
@@ -380,6 +445,7 @@ def show_documents_page():
                                 st.success("Document deleted successfully.")
                                 # Refresh the page
                                 st.rerun()
+                page_controls("persona_documents", persona_next, persona_total)
             else:
                 st.info("No agent persona documents uploaded yet.")
     else:
@@ -390,10 +456,10 @@ def show_generations_page():
     """Show the generations page."""
     st.title("Prompt Generations")
     
-    # Get documents for generation
-    documents = api_request("/documents") or []
-    kb_docs = [d for d in documents if d["document_type"] == "knowledge_base" and d["processed"]]
-    persona_docs = [d for d in documents if d["document_type"] == "agent_persona" and d["processed"]]
+    # Get processed documents for generation (the most recent ones, names only)
+    document_query = {"processed": "true", "limit": 200, "fields": "id,filename"}
+    kb_docs, _, _ = api_page("/documents", {**document_query, "document_type": "knowledge_base"})
+    persona_docs, _, _ = api_page("/documents", {**document_query, "document_type": "agent_persona"})
     
     # Create new generation section
     with st.expander("Create New Generation", expanded=True):
@@ -419,17 +485,42 @@ def show_generations_page():
                     step=5
                 )
                 
+                priority = st.select_slider(
+                    "Priority",
+                    options=["low", "normal", "high"],
+                    value="normal",
+                    help="Share of the job queue relative to your other generations and other users' jobs"
+                )
+                
+                reuse_existing = st.checkbox(
+                    "Reuse an identical completed generation if one exists",
+                    value=True,
+                    help="Copies the results of a finished generation with the same documents and settings instead of running the LLM again"
+                )
+                
                 submit_button = st.form_submit_button("Generate Prompts")
                 if submit_button:
                     data = {
                         "knowledge_base_id": kb_id,
                         "agent_persona_id": persona_id,
-                        "questions_per_client": questions_per_client
+                        "questions_per_client": questions_per_client,
+                        "priority": priority,
+                        "reuse_existing": reuse_existing
                     }
                     
-                    response = api_request("/generations", method="POST", data=data)
+                    # The same form submitted again within a minute reuses the key and gets the same generation
+                    last = st.session_state.generation_request
+                    if not last or last["data"] != data or time.time() - last["time"] > 60:
+                        last = {"data": data, "key": str(uuid.uuid4())}
+                    last["time"] = time.time()
+                    st.session_state.generation_request = last
+                    
+                    response = api_request("/generations", method="POST", data=data, headers={"Idempotency-Key": last["key"]})
                     if response:
-                        st.success("Generation started successfully!")
+                        if response.get("cloned_from"):
+                            st.success(f"Reused the results of an identical generation (#{response['cloned_from']})")
+                        else:
+                            st.success("Generation started successfully!")
                         # Set a flag to start polling for generation status
                         st.session_state.polling_generation = response["id"]
                         st.session_state.selected_generation = response["id"]
@@ -438,8 +529,10 @@ def show_generations_page():
             st.warning("You need at least one processed knowledge base document and one agent persona document to create a generation.")
             st.button("Upload Documents", on_click=navigate_to, args=("documents",))
     
-    # Fetch and display generations
-    generations = api_request("/generations") or []
+    # Fetch and display the current page of generations
+    generations, generations_next, generations_total = fetch_page("generations", "/generations", {
+        "fields": "id,status,queue_position,started_at,client_types_count,questions_count,analysis_completed"
+    })
     
     if generations:
         # Display generations in a table
@@ -448,6 +541,7 @@ def show_generations_page():
             gen_data.append({
                 "ID": gen["id"],
                 "Status": gen["status"].capitalize(),
+                "Queue": gen.get("queue_position") or "",
                 "Started": gen["started_at"],
                 "Client Types": gen["client_types_count"],
                 "Questions": gen["questions_count"],
@@ -456,6 +550,7 @@ def show_generations_page():
         
         df = pd.DataFrame(gen_data)
         st.dataframe(df, use_container_width=True)
+        page_controls("generations", generations_next, generations_total)
         
         # View generation details
         col1, col2 = st.columns(2)
@@ -502,15 +597,23 @@ def show_generation_details():
             "pending": "blue",
             "processing": "orange",
             "completed": "green",
-            "failed": "red"
+            "failed": "red",
+            "interrupted": "violet",
+            "cancelled": "gray"
         }.get(generation["status"], "gray")
         
         st.markdown(f"Status: :{status_color}[**{generation['status'].upper()}**]")
+        if generation.get("queue_position"):
+            st.write(f"Queue position: {generation['queue_position']}")
     
     with col2:
         st.write(f"Started: {generation['started_at']}")
         if generation.get("completed_at"):
             st.write(f"Completed: {generation['completed_at']}")
+        elif generation.get("planned_calls"):
+            st.write(f"LLM calls: {generation['completed_calls']}/{generation['planned_calls']} ({generation.get('current_stage') or 'starting'})")
+            if generation.get("eta_seconds") is not None:
+                st.write(f"ETA: ~{int(generation['eta_seconds'])}s")
     
     with col3:
         # Buttons based on generation status
@@ -527,6 +630,24 @@ def show_generation_details():
                     time.sleep(1)  # Small delay
                     st.rerun()
         
+        elif generation["status"] in ["pending", "processing"]:
+            if st.button("Cancel Generation"):
+                # Stops before the next LLM call; completed work stays checkpointed for a resume
+                response = api_request(f"/generations/{generation['id']}/cancel", method="POST")
+                if response:
+                    st.success("Generation cancelled.")
+                    time.sleep(1)  # Small delay
+                    st.rerun()
+        
+        elif generation["status"] in ["failed", "interrupted", "cancelled"]:
+            if st.button("Resume Generation"):
+                # Completed client types, questions and responses are reused from the checkpoint
+                response = api_request(f"/generations/{generation['id']}/resume", method="POST")
+                if response:
+                    st.success("Generation resumed!")
+                    time.sleep(1)  # Small delay
+                    st.rerun()
+        
         elif generation["status"] == "completed" and generation.get("analysis_completed"):
             if st.button("View Analysis"):
                 # Get the analysis data
@@ -575,32 +696,89 @@ def show_generation_details():
                     except:
                         st.error("Failed to load questions from file.")
     
-    # If the generation is still processing, set up automatic refresh
+    # If the generation is still processing, follow its progress live
     if generation["status"] in ["pending", "processing"]:
-        st.info("This generation is still processing. The page will refresh automatically.")
-        # Add a refresh button
+        st.info("This generation is still processing. Progress updates live below.")
+        follow_generation_events(generation["id"])
+
+
+def follow_generation_events(generation_id):
+    """Render live progress from the generation's event stream, then reload the page once it finishes."""
+    stage_text = st.empty()
+    progress_bar = st.progress(0.0)
+    calls_text = st.empty()
+    client_type_text = st.empty()
+    
+    client_types = {}
+    questions_per_client = 0
+    stage = "Waiting to start"
+    
+    try:
+        with requests.get(
+            f"{API_URL}/generations/{generation_id}/events",
+            headers={"Authorization": f"Bearer {st.session_state.token}"},
+            stream=True,
+            timeout=(5, 60)  # the server sends a keep-alive at least every few seconds
+        ) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                    continue
+                if not line.startswith("data:") or not event:
+                    continue
+                data = json.loads(line[len("data:"):])
+                
+                if event in ("snapshot", "status", "progress"):
+                    if event != "progress" or not data.get("current_stage"):
+                        stage = f"Status: {data.get('status', 'unknown')}"
+                    else:
+                        stage = f"Stage: {data['current_stage'].replace('_', ' ')}"
+                    # Stored progress; the only detail available when a worker process runs the job
+                    if data.get("planned_calls"):
+                        eta = f", ETA ~{int(data['eta_seconds'])}s" if data.get("eta_seconds") is not None else ""
+                        calls_text.write(f"LLM calls: {data['completed_calls']}/{data['planned_calls']}{eta}")
+                elif event == "stage":
+                    stage = f"Stage: {data['stage'].replace('_', ' ')}"
+                elif event == "client_types":
+                    questions_per_client = data.get("questions_per_client", 0)
+                    for name in data["client_types"]:
+                        client_types.setdefault(name, {"questions": 0, "done": 0})
+                elif event == "questions":
+                    client_types.setdefault(data["client_type"], {"questions": 0, "done": 0})["questions"] = data["count"]
+                elif event == "response":
+                    entry = client_types.setdefault(data["client_type"], {"questions": 0, "done": 0})
+                    entry["done"] = max(entry["done"], data["done"])
+                elif event == "analysis":
+                    stage = f"Analysis: {data['status']}"
+                
+                total = sum(max(c["questions"], questions_per_client) for c in client_types.values())
+                done = sum(c["done"] for c in client_types.values())
+                stage_text.write(stage)
+                progress_bar.progress(min(done / total, 1.0) if total else 0.0, text=f"{done}/{total} responses" if total else None)
+                client_type_text.markdown("\n".join(
+                    f"- **{name}**: {c['questions']} questions, {c['done']} responses"
+                    for name, c in client_types.items()
+                ))
+    except requests.exceptions.RequestException as e:
+        st.warning(f"Live progress unavailable: {str(e)}")
         if st.button("Refresh Now"):
             st.rerun()
-        # Auto-refresh using JavaScript
-        st.markdown(
-            """
-            <script>
-                setTimeout(function() {
-                    window.location.reload();
-                }, 5000);  // Refresh every 5 seconds
-            </script>
-            """,
-            unsafe_allow_html=True
-        )
+        return
+    
+    # The stream ends when the generation finishes; show its final state
+    st.rerun()
 
 
 def show_analyses_page():
     """Show the analyses page."""
     st.title("Analyses")
     
-    # Fetch completed generations with analyses
-    generations = api_request("/generations") or []
-    analyzed_generations = [g for g in generations if g.get("analysis_completed")]
+    # Fetch the current page of generations with a completed analysis
+    analyzed_generations, analyses_next, analyses_total = fetch_page("analyses", "/generations", {
+        "analysis_completed": "true", "fields": "id,client_types_count,questions_count"
+    })
     
     if analyzed_generations:
         # Display available analyses
@@ -624,6 +802,7 @@ def show_analyses_page():
                         navigate_to("analysis_view")
                     except Exception as e:
                         st.error(f"Failed to fetch analysis: {str(e)}")
+        page_controls("analyses", analyses_next, analyses_total)
     else:
         st.info("No analyses available yet. Complete a generation and run analysis on it.")
         # Button to go to generations